@@ -0,0 +1,96 @@
+"""
+Compares the bytes sent on the wire and the end to end time of an xunit import request with each payload compression
+codec, with and without permessage-deflate, against a local echo server.  A small TCP proxy between the client and
+the server counts the bytes actually sent
+
+    python benchmarks/bench_compression.py --tests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.ws_helper import CODECS, make_xunit_import_request, serve
+
+
+def make_xunit(path: str, tests: int) -> None:
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuite name="bench" tests="{}">\n'.format(tests))
+        for i in range(tests):
+            f.write('  <testcase classname="bench.module_{}" name="test_{}" time="0.{}">\n'
+                    '    <system-out>ran test_{} with parameters x=1 y=2</system-out>\n'
+                    '  </testcase>\n'.format(i % 100, i, i % 1000, i))
+        f.write("</testsuite>\n")
+
+
+async def echo(websocket, path=None):
+    async for message in websocket:
+        req = json.loads(message)
+        await websocket.send(json.dumps({"tag": req["tag"], "info": {"type": req["type"], "size": len(message)}}))
+
+
+class CountingProxy:
+    """Forwards TCP connections to port, counting the bytes sent by the client"""
+    def __init__(self, port: int):
+        self.port = port
+        self.sent = 0
+
+    async def _pipe(self, reader, writer, count: bool):
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            if count:
+                self.sent += len(data)
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    async def handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.port)
+        await asyncio.gather(self._pipe(client_reader, server_writer, True),
+                             self._pipe(server_reader, client_writer, False))
+
+
+async def main(opts) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        xunit = os.path.join(workdir, "xunit.xml")
+        xargs = os.path.join(workdir, "xargs.json")
+        make_xunit(xunit, opts.tests)
+        with open(xargs, "w") as f:
+            json.dump({"project": "RHEL6", "testrun": {"title": "bench"}}, f)
+
+        server = await websockets.serve(echo, "127.0.0.1", opts.port, max_size=None)
+        proxy = CountingProxy(opts.port)
+        proxy_server = await asyncio.start_server(proxy.handle, "127.0.0.1", opts.port + 1)
+        print("xunit file: {:.1f} MB".format(os.path.getsize(xunit) / 2.0 ** 20))
+        print("{:<8} {:<10} {:>12} {:>10}".format("payload", "ws", "wire bytes", "time"))
+        try:
+            for codec in (None,) + CODECS:
+                for ws_compression in (None, "deflate"):
+                    proxy.sent = 0
+                    start = time.perf_counter()
+                    req = make_xunit_import_request(xunit, xargs, compression=codec)
+                    await serve(req, host="127.0.0.1", url="/", port=opts.port + 1, ws_compression=ws_compression)
+                    elapsed = time.perf_counter() - start
+                    print("{:<8} {:<10} {:>12} {:>9.3f}s".format(codec or "raw", ws_compression or "none",
+                                                                 proxy.sent, elapsed))
+        finally:
+            proxy_server.close()
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Payload compression benchmark")
+    parser.add_argument("-t", "--tests", type=int, default=20000, help="testcases in the synthetic xunit file")
+    parser.add_argument("--port", type=int, default=8911)
+    asyncio.run(main(parser.parse_args()))
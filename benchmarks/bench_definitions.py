@@ -0,0 +1,63 @@
+"""
+Compares cold (no cache) and warm (compiled cache) load times of a synthetic definitions file
+
+    python benchmarks/bench_definitions.py --tests 20000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.cache import cache_path, load_definitions, yaml_loader
+
+
+def make_definitions(path: str, size: int) -> None:
+    defs = [{"testcase": {"name": "bench.module_{}.test_{}".format(i % 100, i),
+                          "title": "bench.module_{}.test_{}".format(i % 100, i),
+                          "project": ["RHEL6", "RedHatEnterpriseLinux7"],
+                          "id": "",
+                          "description": "Synthetic testcase number {}".format(i),
+                          "custom-fields": {"caseimportance": "medium",
+                                            "caseautomation": "automated",
+                                            "caselevel": "component",
+                                            "caseposneg": "positive",
+                                            "testtype": "functional",
+                                            "tags": "comma,separated,values"},
+                          "linked-workitems": [{"linked-workitem": [{"workitem-id": "RHEL7-23456"},
+                                                                    {"role-id": "verifies"}]}],
+                          "update": False}} for i in range(size)]
+    with open(path, "w") as f:
+        yaml.dump(defs, f)
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Definitions cache benchmark")
+    parser.add_argument("-t", "--tests", type=int, default=20000, help="Number of testcases in the definitions file")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "definitions.yaml")
+        make_definitions(path, opts.tests)
+        print("{} testcases, {:.1f} MB of yaml, loader {}".format(opts.tests, os.path.getsize(path) / 2.0 ** 20,
+                                                                 yaml_loader().__name__))
+
+        cold = timed(load_definitions, path)
+        warm = timed(load_definitions, path)
+        os.utime(path)
+        rehash = timed(load_definitions, path)
+        print("cold (parse yaml and write cache): {:.3f}s".format(cold))
+        print("warm (cache hit):                  {:.3f}s".format(warm))
+        print("warm (mtime changed, rehashed):    {:.3f}s".format(rehash))
+        print("cache file: {:.1f} MB".format(os.path.getsize(cache_path(path)) / 2.0 ** 20))
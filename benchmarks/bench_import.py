@@ -0,0 +1,85 @@
+"""
+Measures the import time of polarizer_py modules with python -X importtime, and checks that heavy modules which should
+only be loaded on first use are not pulled in by a plain import.  Exits non-zero on a regression, so it can run in CI
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py -m polarizer_py.metadata --max-ms 40 --forbid yaml inspect
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which importing polarizer_py.metadata must not load
+LAZY_MODULES = ["yaml", "inspect", "xml.dom.minidom", "pprint", "tempfile"]
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.pop("POLARIZER_TESTCASE_CONFIG", None)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO, env.get("PYTHONPATH")]))
+    return env
+
+
+def _importtime(code: str) -> Dict[str, int]:
+    """Runs code in a fresh interpreter, and returns the {name: cumulative us} of every module it imported"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=_env(),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    modules = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def importtime(module: str, runs: int = 5) -> Tuple[float, Dict[str, int]]:
+    """
+    Imports module in a fresh interpreter runs times
+
+    :return: the best cumulative import time of module in ms, and the {name: cumulative us} of every module imported
+             because of it.  Modules an empty interpreter already imports at startup (eg from .pth files loaded by
+             site) are left out
+    """
+    startup = set(_importtime("pass"))
+    best = None
+    modules = {}
+    for _ in range(runs):
+        modules = {name: us for name, us in _importtime("import {}".format(module)).items() if name not in startup}
+        total = modules[module] / 1000.0
+        best = total if best is None else min(best, total)
+    return best, modules
+
+
+def check(module: str, max_ms: float, forbid: List[str], top: int) -> bool:
+    total, modules = importtime(module)
+    print("{}: {:.2f} ms".format(module, total))
+    slowest = sorted((m for m in modules.items() if m[0] != module), key=lambda m: m[1], reverse=True)
+    for name, us in slowest[:top]:
+        print("    {:<40} {:>8.2f} ms".format(name, us / 1000.0))
+
+    ok = True
+    loaded = [m for m in forbid if m in modules]
+    if loaded:
+        print("FAIL: importing {} loaded {}".format(module, ", ".join(loaded)))
+        ok = False
+    if max_ms is not None and total > max_ms:
+        print("FAIL: importing {} took {:.2f} ms (limit {} ms)".format(module, total, max_ms))
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time benchmark for polarizer_py")
+    parser.add_argument("-m", "--module", default="polarizer_py.metadata", help="Module to import")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the import takes longer than this")
+    parser.add_argument("--forbid", nargs="*", default=LAZY_MODULES, help="Modules that must not be imported")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to show")
+    opts = parser.parse_args()
+
+    sys.exit(0 if check(opts.module, opts.max_ms, opts.forbid, opts.top) else 1)
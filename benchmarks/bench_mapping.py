@@ -0,0 +1,103 @@
+"""
+Benchmarks how long decorating a suite takes as the suite (and therefore mapping.json) grows, comparing the default
+write-through mode with the write-behind mode (mapping-write-behind: true in the config), and with a re-run of an
+already synced suite using a sync-manifest
+
+Each run happens in a fresh interpreter, so that the config, mapping and definitions loaded by the previous run
+(which MetaData keeps as class attributes once first used) aren't reused
+
+    python benchmarks/bench_mapping.py --sizes 500 1000 2000 4000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter.  Prints the seconds spent decorating and flushing
+CHILD = """
+import sys, time
+from polarizer_py.metadata import MetaData
+
+def make_fn(name):
+    def fn(a, b):
+        pass
+    fn.__module__ = "bench"
+    fn.__name__ = fn.__qualname__ = name
+    return fn
+
+fns = [make_fn("test_{}".format(i)) for i in range(int(sys.argv[1]))]
+# Load the config, mapping and definitions up front so only decoration is timed
+MetaData.mapping, MetaData.definitions
+start = time.perf_counter()
+for fn in fns:
+    MetaData.metadata()(fn)
+MetaData.flush()
+print(time.perf_counter() - start)
+"""
+
+
+def make_suite(workdir: str, size: int, write_behind: bool, synced: bool = False) -> str:
+    """
+    Creates a definitions file with size testcases, an empty mapping.json and a config file pointing to them.  If
+    synced, every testcase already has an id in the definitions and the mapping, and a sync-manifest is configured
+
+    :return: path to the config file
+    """
+    defs = [{"testcase": {"name": "bench.test_{}".format(i),
+                          "title": "bench.test_{}".format(i),
+                          "project": "RHEL6",
+                          "id": "RHEL6-{}".format(i) if synced else "",
+                          "custom-fields": {}}} for i in range(size)]
+    defs_path = os.path.join(workdir, "definitions.yaml")
+    with open(defs_path, "w") as f:
+        yaml.dump(defs, f)
+
+    map_path = os.path.join(workdir, "mapping.json")
+    with open(map_path, "w") as f:
+        mapping = {"bench.test_{}".format(i): {"RHEL6": {"id": "RHEL6-{}".format(i), "params": ["a", "b"]}}
+                   for i in range(size)} if synced else {}
+        json.dump(mapping, f)
+
+    cfg = {"mapping": map_path,
+           "definitions-path": defs_path,
+           "mapping-write-behind": write_behind,
+           "testcase": {"selector": {"name": "bench", "value": "bench"}}}
+    if synced:
+        cfg["sync-manifest"] = os.path.join(workdir, "manifest.json")
+    cfg_path = os.path.join(workdir, "polarizer-testcase.json")
+    with open(cfg_path, "w") as f:
+        json.dump(cfg, f)
+    return cfg_path
+
+
+def run(size: int, write_behind: bool, synced: bool = False) -> float:
+    """Times decorating the suite.  A synced suite is decorated twice, and the second (manifest backed) run is timed"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env["POLARIZER_TESTCASE_CONFIG"] = make_suite(workdir, size, write_behind, synced)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO, env.get("PYTHONPATH")]))
+        for _ in range(2 if synced else 1):
+            out = subprocess.run([sys.executable, "-c", CHILD, str(size)], env=env, check=True,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return float(out.stdout.decode().strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time @metadata decoration against suite size")
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=[250, 500, 1000, 2000])
+    opts = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14} {:>14}".format("tests", "write-through", "write-behind", "synced re-run"))
+    for size in opts.sizes:
+        through = run(size, False)
+        behind = run(size, True)
+        synced = run(size, True, synced=True)
+        print("{:>8} {:>13.3f}s {:>13.3f}s {:>13.3f}s".format(size, through, behind, synced))
@@ -0,0 +1,79 @@
+"""
+Times utils.run (finding the test files which use polarizer_py.metadata) on a synthetic project, cold and with a warm
+content hash cache, against the ModuleFinder based check it replaced (timed on a sample and extrapolated)
+
+    python benchmarks/bench_scan.py --files 5000 --workers 4
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from modulefinder import ModuleFinder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.utils import run
+
+TEMPLATE = '''import os
+import json
+{imports}
+
+
+class TestModule{n}:
+{tests}
+'''
+
+TEST = '''    {decorator}
+    def test_{i}(self, arg):
+        data = json.dumps({{"value": {i}, "path": os.getcwd()}})
+        assert data
+'''
+
+
+def make_project(root: str, files: int) -> None:
+    for n in range(files):
+        uses = n % 3 == 0
+        pkg = os.path.join(root, "tests", "pkg_{}".format(n % 50))
+        os.makedirs(pkg, exist_ok=True)
+        tests = "\n".join(TEST.format(i=i, decorator='@metadata("RHEL6")' if uses else "@staticmethod")
+                          for i in range(10))
+        imports = "from polarizer_py.metadata import metadata" if uses else "import unittest"
+        with open(os.path.join(pkg, "test_{}.py".format(n)), "w") as f:
+            f.write(TEMPLATE.format(imports=imports, n=n, tests=tests))
+
+
+def legacy_imports_metadata(path: str) -> bool:
+    mf = ModuleFinder()
+    mf.run_script(path)
+    return any("metadata" in name for name in mf.modules)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark finding the files that use polarizer_py.metadata")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--legacy-sample", type=int, default=3, help="files to time with ModuleFinder")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_project(root, opts.files)
+        cache_path = os.path.join(root, "scan-cache.json")
+        for name in ("cold", "warm cache"):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                found = run(root, workers=opts.workers, cache_path=cache_path)
+            print("{:<12} {:8.2f}s  {} of {} files use metadata".format(name, time.perf_counter() - start, len(found),
+                                                                         opts.files))
+
+        sample = [os.path.join(root, "tests", "pkg_{}".format(n % 50), "test_{}.py".format(n))
+                  for n in range(opts.legacy_sample)]
+        start = time.perf_counter()
+        for path in sample:
+            legacy_imports_metadata(path)
+        per_file = (time.perf_counter() - start) / len(sample)
+        print("{:<12} {:8.2f}s  (extrapolated from {:.2f}s per file)".format("ModuleFinder", per_file * opts.files,
+                                                                           per_file))
@@ -0,0 +1,355 @@
+"""
+Benchmark suite for the metadata, import xml and websocket paths at synthetic scale.  For every scale, a suite of that
+many decorated tests (spread over modules, with definitions yaml and mapping.json for several projects) is generated,
+and the suite times:
+
+- init: loading the config, mapping and definitions (MetaData.cfg, MetaData.mapping and MetaData.definitions)
+- decorate: importing the test modules, which runs @metadata on every test
+- flush: writing the mapping (the suite runs in write-behind mode unless --write-through is given)
+- generate_import_xml: writing the TestCase import xml of every project
+- ws_request_testcase / ws_request_xunit: building the testcase and xunit import requests with ws_helper
+- ws_roundtrip_testcase / ws_roundtrip_xunit: sending those requests to a local MockUMB and waiting for the reply
+
+The metadata timings are taken in a fresh interpreter, so that the config, mapping and definitions loaded by the
+previous scale (which MetaData keeps as class attributes once first used) aren't reused.  Results are saved as json,
+and can be compared against a baseline, in which case the script exits non-zero if any timing regressed by more than
+the threshold
+
+    python benchmarks/bench_suite.py --scales 1000 10000 --projects 3 --output results.json
+    python benchmarks/bench_suite.py --scales 1000 10000 --projects 3 --baseline results.json --threshold 0.2
+    python benchmarks/bench_suite.py --compare old.json new.json
+    python benchmarks/bench_suite.py --generate /tmp/suite --scales 100000
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import yaml
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from polarizer_py.json_files import tcargs
+from polarizer_py.mock_umb import MockUMB
+from polarizer_py.ws_helper import make_testcase_import_request, make_xunit_import_request, serve
+
+PACKAGE = "synth"
+URLS = {"testcase": "/ws/testcase/import", "xunit": "/ws/xunit/import"}
+
+# Runs inside the child interpreter, with the generated suite on sys.path.  The last line printed is a json object of
+# the timings and the paths of the generated xml files
+CHILD = """
+import importlib, json, sys, time
+modules = int(sys.argv[1])
+timings = {}
+
+from polarizer_py.metadata import MetaData, generate_import_xml
+
+start = time.perf_counter()
+MetaData.cfg, MetaData.mapping, MetaData.definitions
+timings["init"] = time.perf_counter() - start
+
+start = time.perf_counter()
+for m in range(modules):
+    importlib.import_module("%s.module_{:04d}".format(m))
+timings["decorate"] = time.perf_counter() - start
+
+start = time.perf_counter()
+MetaData.flush()
+timings["flush"] = time.perf_counter() - start
+
+start = time.perf_counter()
+paths = generate_import_xml(MetaData.import_list, workers=1)
+timings["generate_import_xml"] = time.perf_counter() - start
+
+print(json.dumps({"timings": timings, "xml": paths}))
+""" % PACKAGE
+
+
+def _test_name(i: int, per_module: int) -> Tuple[int, str]:
+    """Returns the module number of test i, and its qualified name.  Every fourth test is a method of a class"""
+    module = i // per_module
+    name = "test_{:06d}".format(i)
+    if i % 4 == 3:
+        name = "TestClass{}.{}".format(module, name)
+    return module, "{}.module_{:04d}.{}".format(PACKAGE, module, name)
+
+
+def _write_module(path: str, module: int, tests: Sequence[int]) -> None:
+    functions = []
+    methods = []
+    for i in tests:
+        if i % 4 == 3:
+            methods.append('    @metadata()\n'
+                           '    def test_{0:06d}(self, x, y=1):\n'
+                           '        """Synthetic test {0}"""\n'
+                           '        return x + y\n'.format(i))
+        else:
+            functions.append('@metadata()\n'
+                             'def test_{0:06d}(name, count=2):\n'
+                             '    """Synthetic test {0}"""\n'
+                             '    return name * count\n'.format(i))
+    with open(path, "w") as f:
+        f.write("from polarizer_py.metadata import metadata\n\n\n")
+        f.write("\n\n".join(functions))
+        if methods:
+            f.write("\n\nclass TestClass{}:\n".format(module))
+            f.write("\n".join(methods))
+
+
+def generate(workdir: str, tests: int, projects: int = 3, per_module: int = 200, mapped: float = 0.5,
+             write_behind: bool = True) -> Dict[str, str]:
+    """
+    Writes a synthetic suite into workdir: a package of decorated test modules, the definitions yaml and mapping.json
+    for every test in every project, an xunit result file, a tcargs file, and a config file pointing to all of them
+
+    :param workdir: directory to write the suite to
+    :param tests: number of tests
+    :param projects: number of projects every test belongs to
+    :param per_module: number of tests per module
+    :param mapped: fraction of the tests which already have an id (in the definitions and the mapping).  A test's
+                   projects share one definition, and so one id
+    :param write_behind: value of mapping-write-behind in the config
+    :return: a dict of the generated paths (config, definitions, mapping, xunit, tcargs) and the number of modules
+    """
+    names = ["PROJECT{}".format(p) for p in range(projects)]
+    synced = int(tests * mapped)
+    pkg_dir = os.path.join(workdir, PACKAGE)
+    os.makedirs(pkg_dir, exist_ok=True)
+    open(os.path.join(pkg_dir, "__init__.py"), "w").close()
+
+    modules = (tests + per_module - 1) // per_module
+    for module in range(modules):
+        _write_module(os.path.join(pkg_dir, "module_{:04d}.py".format(module)), module,
+                      range(module * per_module, min(tests, (module + 1) * per_module)))
+    # Compile up front, so decorate doesn't time the compiler
+    import compileall
+    compileall.compile_dir(pkg_dir, quiet=1)
+
+    defs = []
+    mapping = {}
+    for i in range(tests):
+        _, qname = _test_name(i, per_module)
+        tid = "SYNTH-{}".format(i) if i < synced else ""
+        defs.append({"testcase": {"name": qname,
+                                  "title": qname,
+                                  "project": names,
+                                  "id": tid,
+                                  "description": "Synthetic test {}".format(i),
+                                  "custom-fields": {"caseimportance": "medium",
+                                                    "caseautomation": "automated",
+                                                    "caselevel": "component",
+                                                    "caseposneg": "positive",
+                                                    "testtype": "functional",
+                                                    "tags": "synthetic,bench"}}})
+        if i < synced:
+            params = ["self", "x", "y"] if i % 4 == 3 else ["name", "count"]
+            mapping[qname] = {p: {"id": tid, "params": params} for p in names}
+
+    paths = {name: os.path.join(workdir, name)
+             for name in ("definitions.yaml", "mapping.json", "xunit.xml", "tcargs.json", "polarizer-testcase.json")}
+    with open(paths["definitions.yaml"], "w") as f:
+        yaml.dump(defs, f, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper), default_flow_style=False)
+    with open(paths["mapping.json"], "w") as f:
+        json.dump(mapping, f)
+    with open(paths["xunit.xml"], "w") as f:
+        f.write('<testsuites><testsuite name="{}" tests="{}">'.format(PACKAGE, tests))
+        for i in range(tests):
+            _, qname = _test_name(i, per_module)
+            classname, name = qname.rsplit(".", 1)
+            f.write('<testcase classname="{}" name="{}" time="0.01"/>'.format(classname, name))
+        f.write("</testsuite></testsuites>")
+    with open(paths["tcargs.json"], "w") as f:
+        json.dump(tcargs, f)
+    with open(paths["polarizer-testcase.json"], "w") as f:
+        json.dump({"mapping": paths["mapping.json"],
+                   "definitions-path": paths["definitions.yaml"],
+                   "mapping-write-behind": write_behind,
+                   "testcase": {"selector": {"name": "bench", "value": "bench"}}}, f)
+
+    return {"config": paths["polarizer-testcase.json"], "definitions": paths["definitions.yaml"],
+            "mapping": paths["mapping.json"], "xunit": paths["xunit.xml"], "tcargs": paths["tcargs.json"],
+            "modules": modules}
+
+
+def run_metadata(workdir: str, suite: Dict) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """Times the metadata pipeline over the suite in a fresh interpreter, and returns the timings and xml paths"""
+    env = dict(os.environ)
+    env["POLARIZER_TESTCASE_CONFIG"] = suite["config"]
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO, workdir, env.get("PYTHONPATH")]))
+    # Keep logging I/O out of the timings
+    env.setdefault("POLARIZER_LOG_LEVEL", "WARNING")
+    out = subprocess.run([sys.executable, "-c", CHILD, str(suite["modules"])], env=env, cwd=workdir, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    result = json.loads(out.stdout.decode().strip().splitlines()[-1])
+    return result["timings"], result["xml"]
+
+
+def best_of(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def roundtrips(requests: Dict[str, Callable], repeat: int) -> Dict[str, float]:
+    """Median time for each kind of request to be sent to a local MockUMB and answered"""
+    mock = MockUMB(delay=0, progress=2)
+    server = await mock.start("127.0.0.1", 0)
+    port = list(server.sockets)[0].getsockname()[1]
+    results = {}
+    try:
+        for kind, make_request in requests.items():
+            samples = []
+            for _ in range(repeat):
+                req = make_request()
+                start = time.perf_counter()
+                reply = await serve(req, host="127.0.0.1", url=URLS[kind], port=port)
+                samples.append(time.perf_counter() - start)
+                if not isinstance(reply, dict) or reply.get("info", {}).get("status") != "passed":
+                    raise RuntimeError("{} round trip failed: {}".format(kind, reply))
+            results["ws_roundtrip_{}".format(kind)] = statistics.median(samples)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return results
+
+
+def run_scale(tests: int, opts) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as workdir:
+        suite = generate(workdir, tests, opts.projects, opts.per_module, opts.mapped, not opts.write_through)
+        timings = None
+        xml = {}
+        for _ in range(opts.repeat):
+            for path in xml.values():
+                os.unlink(path)
+            run, xml = run_metadata(workdir, suite)
+            timings = run if timings is None else {k: min(v, run[k]) for k, v in timings.items()}
+
+        try:
+            testcase_xml = xml[sorted(xml)[0]]
+            requests = {
+                "testcase": lambda: make_testcase_import_request(testcase_xml, suite["mapping"], suite["tcargs"]),
+                "xunit": lambda: make_xunit_import_request(suite["xunit"], suite["tcargs"])
+            }
+            for kind, make_request in requests.items():
+                timings["ws_request_{}".format(kind)] = best_of(make_request, max(opts.repeat, 5))
+            loop = asyncio.new_event_loop()
+            try:
+                timings.update(loop.run_until_complete(roundtrips(requests, opts.roundtrips)))
+            finally:
+                loop.close()
+        finally:
+            for path in xml.values():
+                os.unlink(path)
+    return timings
+
+
+def run_suite(opts) -> Dict:
+    results = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpus": os.cpu_count(),
+               "projects": opts.projects,
+               "per-module": opts.per_module,
+               "mapped": opts.mapped,
+               "write-behind": not opts.write_through,
+               "results": {}}
+    for tests in opts.scales:
+        timings = run_scale(tests, opts)
+        results["results"][str(tests)] = timings
+        print("{} tests x {} projects".format(tests, opts.projects))
+        for name, seconds in timings.items():
+            print("    {:<24} {:>10.4f}s".format(name, seconds))
+    return results
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, min_delta: float) -> List[Tuple[str, str, float, float]]:
+    """
+    Prints every timing of current next to the one in baseline
+
+    :param threshold: a timing regressed if it is more than this fraction slower than in the baseline
+    :param min_delta: ...and more than this many seconds slower, so that noise in tiny timings isn't flagged
+    :return: the (scale, name, baseline seconds, current seconds) of every regression
+    """
+    regressions = []
+    print("{:>8} {:<24} {:>11} {:>11} {:>8}".format("tests", "timing", "baseline", "current", "change"))
+    for scale, timings in current["results"].items():
+        old = baseline["results"].get(scale, {})
+        for name, seconds in timings.items():
+            if name not in old:
+                continue
+            change = (seconds - old[name]) / old[name] if old[name] else 0.0
+            regressed = change > threshold and seconds - old[name] > min_delta
+            if regressed:
+                regressions.append((scale, name, old[name], seconds))
+            print("{:>8} {:<24} {:>10.4f}s {:>10.4f}s {:>+7.1f}%{}".format(scale, name, old[name], seconds,
+                                                                         change * 100, "  REGRESSION" if regressed
+                                                                         else ""))
+    return regressions
+
+
+def _load(path: str) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic scale benchmarks of the metadata, xml and websocket paths")
+    parser.add_argument("-s", "--scales", nargs="+", type=int, default=[1000, 10000],
+                        help="Numbers of tests to generate (eg 1000 10000 100000)")
+    parser.add_argument("-p", "--projects", type=int, default=3, help="Number of projects of every test")
+    parser.add_argument("--per-module", type=int, default=200, help="Number of tests per generated module")
+    parser.add_argument("--mapped", type=float, default=0.5, help="Fraction of tests already in mapping.json")
+    parser.add_argument("--write-through", action="store_true", default=False,
+                        help="Write the mapping after every test instead of once (slow at large scales)")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Runs of the metadata pipeline, the best is kept")
+    parser.add_argument("--roundtrips", type=int, default=5, help="Websocket round trips per request type")
+    parser.add_argument("-o", "--output", help="Write the results to this json file")
+    parser.add_argument("-b", "--baseline", help="Compare the results with this json file")
+    parser.add_argument("-c", "--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Only compare two results files")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="Fraction by which a timing must be slower than the baseline to be a regression")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Seconds by which a timing must be slower than the baseline to be a regression")
+    parser.add_argument("-g", "--generate", metavar="DIR",
+                        help="Only generate a suite of the first scale into DIR (eg to profile it)")
+    opts = parser.parse_args()
+
+    if opts.generate:
+        suite = generate(opts.generate, opts.scales[0], opts.projects, opts.per_module, opts.mapped,
+                         not opts.write_through)
+        print("Generated {} modules in {}.  Run with PYTHONPATH={} POLARIZER_TESTCASE_CONFIG={}"
+              .format(suite["modules"], opts.generate, opts.generate, suite["config"]))
+        sys.exit(0)
+
+    if opts.compare:
+        baseline, current = (_load(path) for path in opts.compare)
+    else:
+        baseline = _load(opts.baseline) if opts.baseline else None
+        current = run_suite(opts)
+        if opts.output:
+            with open(opts.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print("Results written to {}".format(opts.output))
+        if baseline is None:
+            sys.exit(0)
+
+    regressions = compare(baseline, current, opts.threshold, opts.min_delta)
+    if regressions:
+        print("FAIL: {} timings regressed by more than {:.0f}%".format(len(regressions), opts.threshold * 100))
+    sys.exit(1 if regressions else 0)
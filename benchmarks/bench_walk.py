@@ -0,0 +1,66 @@
+"""
+Compares the old Path.iterdir based recurse with utils.walk (serial, threaded, and with a warm DirManifest) on a
+synthetic source tree with nested venv and node_modules directories
+
+    python benchmarks/bench_walk.py --packages 200 --workers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.utils import DEFAULT_EXCLUDES, DirManifest, walk
+
+
+def legacy_recurse(start: Path, excludes):
+    """utils.recurse before it used os.scandir (excludes were only applied to the top level)"""
+    for i in start.iterdir():
+        if i.is_file():
+            yield i
+        if i.is_dir():
+            if i.name not in excludes:
+                yield from legacy_recurse(i, [])
+
+
+def make_tree(root: str, packages: int) -> None:
+    for p in range(packages):
+        pkg = os.path.join(root, "pkg_{}".format(p))
+        for sub in ("src", "tests", os.path.join("venv", "lib", "site"), os.path.join("node_modules", "dep")):
+            os.makedirs(os.path.join(pkg, sub))
+            for f in range(20):
+                open(os.path.join(pkg, sub, "mod_{}.py".format(f)), "w").close()
+
+
+def timed(fn) -> (float, int):
+    start = time.perf_counter()
+    count = sum(1 for _ in fn())
+    return time.perf_counter() - start, count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the source tree walker")
+    parser.add_argument("--packages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, opts.packages)
+        # Directories must be older than DirManifest.MIN_AGE to be cached
+        past = time.time() - 60
+        for dirpath, _, _ in os.walk(root):
+            os.utime(dirpath, (past, past))
+
+        manifest = DirManifest()
+        sum(1 for _ in walk(root, DEFAULT_EXCLUDES, manifest=manifest))
+        runs = [("legacy recurse", lambda: legacy_recurse(Path(root), ["venv"])),
+                ("walk", lambda: walk(root, DEFAULT_EXCLUDES)),
+                ("walk, {} threads".format(opts.workers), lambda: walk(root, DEFAULT_EXCLUDES, workers=opts.workers)),
+                ("walk, warm manifest", lambda: walk(root, DEFAULT_EXCLUDES, manifest=manifest))]
+        for name, fn in runs:
+            elapsed, count = timed(fn)
+            print("{:<24} {:8.2f}ms  {} files".format(name, elapsed * 1000, count))
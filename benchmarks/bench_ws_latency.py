@@ -0,0 +1,77 @@
+"""
+Measures the latency of ws_helper.serve against the local mock UMB server, compared with the old implementation which
+polled websocket.recv() with a 2 second timeout, 120 times
+
+    python benchmarks/bench_ws_latency.py --requests 200 --progress 3 --delay 0.005
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, Sequence
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.mock_umb import MockUMB
+from polarizer_py.ws_helper import make_umb_request, serve
+
+
+async def legacy_serve(req: Dict, host: str, url: str, port: int) -> Dict:
+    """The implementation of ws_helper.serve before it was made event driven"""
+    wsurl = "ws://{}:{}{}".format(host, port, url)
+    async with websockets.connect(wsurl) as websocket:
+        await websocket.send(json.dumps(req))
+        count = 0
+        info = ""
+        while count < 120:
+            try:
+                response = await asyncio.wait_for(websocket.recv(), 2)
+                info = json.loads(response)
+                if 'info' in info:
+                    break
+            except asyncio.TimeoutError:
+                count += 1
+        return info
+
+
+def percentiles(samples: Sequence[float]) -> str:
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))] * 1000
+
+    return "p50 {:7.2f}ms  p90 {:7.2f}ms  p99 {:7.2f}ms  max {:7.2f}ms".format(pct(50), pct(90), pct(99),
+                                                                              ordered[-1] * 1000)
+
+
+async def measure(fn, requests: int, port: int) -> Sequence[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await fn(make_umb_request("testing", data="ping"), host="127.0.0.1", url="/ws", port=port)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main(opts) -> None:
+    server = await MockUMB(delay=opts.delay, progress=opts.progress).start("127.0.0.1", opts.port)
+    try:
+        for name, fn in (("legacy serve", legacy_serve), ("serve", serve)):
+            print("{:<14} {}".format(name, percentiles(await measure(fn, opts.requests, opts.port))))
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ws_helper.serve latency benchmark")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("--progress", type=int, default=3, help="progress messages sent before the final reply")
+    parser.add_argument("--delay", type=float, default=0.005, help="seconds between messages from the server")
+    parser.add_argument("--port", type=int, default=8901)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""
+Load generator for the websocket client code.  Sends requests to a mock UMB server (started in process unless --host
+is given) and reports requests/sec and latency percentiles, either with one pooled UMBClient or with ws_helper.serve
+(a new connection per request)
+
+    python benchmarks/bench_ws_load.py --requests 1000 --concurrency 50 --op xunit --client pooled
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_ws_latency import percentiles
+from polarizer_py.mock_umb import MockUMB
+from polarizer_py.ws_client import UMBClient
+from polarizer_py.ws_helper import make_testcase_import_request, make_umb_request, make_xunit_import_request, serve
+
+URLS = {"testing": "/ws", "xunit": "/ws/xunit/import", "testcase": "/ws/testcase/import"}
+
+
+def make_files(workdir: str) -> dict:
+    paths = {name: os.path.join(workdir, name) for name in ("xunit.xml", "testcase.xml", "args.json", "mapping.json")}
+    with open(paths["xunit.xml"], "w") as f:
+        f.write('<testsuite name="load">' + "".join('<testcase classname="load" name="test_{}"/>'.format(i)
+                                                      for i in range(100)) + "</testsuite>")
+    with open(paths["testcase.xml"], "w") as f:
+        f.write('<testcases project-id="RHEL6">' + "".join('<testcase id=""><title>load.test_{}</title></testcase>'
+                                                           .format(i) for i in range(100)) + "</testcases>")
+    for name in ("args.json", "mapping.json"):
+        with open(paths[name], "w") as f:
+            json.dump({}, f)
+    return paths
+
+
+def request_factory(op: str, paths: dict, compression: str = None):
+    if op == "xunit":
+        return lambda: make_xunit_import_request(paths["xunit.xml"], paths["args.json"], compression=compression)
+    if op == "testcase":
+        return lambda: make_testcase_import_request(paths["testcase.xml"], paths["mapping.json"], paths["args.json"],
+                                                    compression=compression)
+    return lambda: make_umb_request("testing", data="load")
+
+
+async def run_load(opts, make_request, host: str, port: int):
+    url = URLS[opts.op]
+    slots = asyncio.Semaphore(opts.concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(send):
+        nonlocal failures
+        async with slots:
+            start = time.perf_counter()
+            try:
+                reply = await send(make_request(), host=host, url=url, port=port, timeout=opts.timeout)
+                if not isinstance(reply, dict) or reply.get("info", {}).get("status") != "passed":
+                    failures += 1
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if opts.client == "pooled":
+        async with UMBClient(max_in_flight=opts.concurrency) as client:
+            await asyncio.gather(*(one(client.request) for _ in range(opts.requests)))
+    else:
+        await asyncio.gather(*(one(serve) for _ in range(opts.requests)))
+    elapsed = time.perf_counter() - start
+
+    print("{} {} requests, {} client, concurrency {}".format(opts.requests, opts.op, opts.client, opts.concurrency))
+    print("{:.1f} requests/sec, {} failed".format(opts.requests / elapsed, failures))
+    print(percentiles(latencies))
+
+
+async def main(opts) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        make_request = request_factory(opts.op, make_files(workdir), opts.compression)
+        if opts.host:
+            await run_load(opts, make_request, opts.host, opts.port)
+            return
+
+        mock = MockUMB(delay=opts.delay, jitter=opts.jitter, progress=opts.progress, failure_rate=opts.failure_rate)
+        server = await mock.start("127.0.0.1", opts.port)
+        try:
+            await run_load(opts, make_request, "127.0.0.1", opts.port)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the UMB websocket clients")
+    parser.add_argument("-n", "--requests", type=int, default=500)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--op", choices=sorted(URLS), default="xunit")
+    parser.add_argument("--client", choices=["pooled", "serve"], default="pooled")
+    parser.add_argument("--compression", choices=["gzip", "zlib", "lzma"], default=None)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--host", default=None, help="Load an already running server instead of a local mock")
+    parser.add_argument("--port", type=int, default=8931)
+    parser.add_argument("--delay", type=float, default=0.01, help="mock server: seconds between messages")
+    parser.add_argument("--jitter", type=float, default=0.005, help="mock server: random extra delay")
+    parser.add_argument("--progress", type=int, default=2, help="mock server: progress messages per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="mock server: fraction of failed requests")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""
+Times generate_import_xml over a synthetic multi-project import list, serially and with increasing numbers of worker
+processes
+
+    python benchmarks/bench_xml.py --projects 12 --tests 2000 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polarizer_py.metadata import generate_import_xml
+
+CFG = {"testcase": {"selector": {"name": "bench", "value": "bench"}}}
+
+
+def make_import_list(projects: int, tests: int) -> Dict:
+    import_list = {}
+    for p in range(projects):
+        project = "PROJECT{}".format(p)
+        import_list[project] = [{
+            "name": "bench.module_{}.test_{}".format(i % 100, i),
+            "project": project,
+            "id": "",
+            "description": "Synthetic testcase number {}".format(i),
+            "test-steps": [{"test-step": {"test-step-column": [
+                {"parameter": {"name": name, "scope": "local"}} for name in ("self", "x", "y", "z")]}}]
+        } for i in range(tests)]
+    return import_list
+
+
+def timed(import_list: Dict, workers: int) -> float:
+    start = time.perf_counter()
+    paths = generate_import_xml(import_list, cfg=CFG, workers=workers)
+    elapsed = time.perf_counter() - start
+    for path in paths.values():
+        os.unlink(path)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate_import_xml benchmark")
+    parser.add_argument("-p", "--projects", type=int, default=12)
+    parser.add_argument("-t", "--tests", type=int, default=2000, help="testcases per project")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4])
+    opts = parser.parse_args()
+
+    import_list = make_import_list(opts.projects, opts.tests)
+    # meta_to_tc_xml and the logger are chatty, so silence stdout (including in the worker processes)
+    stdout = os.dup(1)
+    results = []
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            for workers in opts.workers:
+                results.append((workers, timed(import_list, workers)))
+        finally:
+            sys.stdout.flush()
+            os.dup2(stdout, 1)
+
+    print("{} projects x {} testcases, {} cpus".format(opts.projects, opts.tests, os.cpu_count()))
+    base = results[0][1]
+    for workers, elapsed in results:
+        print("workers={:<3} {:8.3f}s  speedup {:.2f}x".format(workers, elapsed, base / elapsed))
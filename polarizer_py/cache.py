@@ -0,0 +1,200 @@
+"""
+Caching for the YAML definition files.
+
+Parsing a large definitions file with yaml is slow, so the parsed list of testcases is stored in a compiled (marshal)
+cache file next to the YAML file, eg definitions.yaml gets a .definitions.yaml.cache sibling.  The cache is keyed by
+the size, mtime and sha256 of the YAML file, and is rebuilt atomically whenever it is stale.
+
+Set the environment variable POLARIZER_DEFINITIONS_CACHE=0 to disable the cache.
+
+On top of that, FileCache is a bounded, in-process LRU cache of values derived from files, used so that a definition
+file which many tests point to with @metadata(path=...) is only parsed once per process.
+"""
+
+import marshal
+import os
+import struct
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+from . logger import glob_logger as log
+
+POLARIZER_DEFINITIONS_CACHE = "POLARIZER_DEFINITIONS_CACHE"
+
+# Bump this whenever the layout of the cache file changes, so old caches get rebuilt
+CACHE_VERSION = 1
+# The cache file is: the length of the marshalled header, the marshalled header, then the marshalled definitions.
+# Reading it back with marshal.loads on whole byte strings is much faster than marshal.load on the file object.
+_HEADER_LEN = struct.Struct("<I")
+
+
+def yaml_loader():
+    """
+    Returns the libyaml based loader if pyyaml was built with it, otherwise the pure python one
+    """
+    import yaml
+
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_yaml(stream) -> Any:
+    import yaml
+
+    return yaml.load(stream, Loader=yaml_loader())
+
+
+def cache_path(def_path: str) -> str:
+    """
+    Returns the path of the compiled cache for the definitions file at def_path
+    """
+    head, tail = os.path.split(os.path.abspath(def_path))
+    return os.path.join(head, ".{}.cache".format(tail))
+
+
+def _read_cache(path: str) -> Tuple[Tuple, Any]:
+    """
+    Reads the (header, definitions) stored in the cache file at path.  The header is (version, size, mtime_ns, sha256)
+
+    :return: (None, None) if there is no usable cache file
+    """
+    try:
+        with open(path, "rb") as c:
+            size, = _HEADER_LEN.unpack(c.read(_HEADER_LEN.size))
+            header = marshal.loads(c.read(size))
+            if not isinstance(header, tuple) or len(header) != 4 or header[0] != CACHE_VERSION:
+                return None, None
+            return header, marshal.loads(c.read())
+    except (OSError, EOFError, ValueError, TypeError, struct.error):
+        return None, None
+
+
+def _write_cache(path: str, header: Tuple, defs: Any) -> None:
+    """
+    Atomically writes the cache file.  If it can't be written (eg read-only directory, or the definitions contain
+    types marshal can't handle) this is logged and otherwise ignored
+    """
+    import tempfile
+
+    try:
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path), dir=os.path.dirname(path))
+    except OSError as ex:
+        log.debug("Could not create definitions cache %s: %s", path, ex)
+        return
+    try:
+        with os.fdopen(fd, "wb") as c:
+            head = marshal.dumps(header)
+            c.write(_HEADER_LEN.pack(len(head)))
+            c.write(head)
+            c.write(marshal.dumps(defs))
+        os.replace(tmp, path)
+    except (OSError, ValueError) as ex:
+        log.debug("Could not write definitions cache %s: %s", path, ex)
+        os.unlink(tmp)
+
+
+def load_definitions(def_path: str) -> Any:
+    """
+    Returns the parsed contents of the YAML definitions file at def_path, using the compiled cache when it is valid.
+
+    The cache is trusted without hashing the YAML file if its size and mtime match.  If only the mtime differs (eg a
+    fresh checkout), the content hash decides whether the cache can be reused.
+
+    :param def_path: path to the yaml definitions file
+    :return:
+    """
+    import hashlib
+
+    if os.environ.get(POLARIZER_DEFINITIONS_CACHE, "1") == "0":
+        with open(def_path, "rb") as definitions:
+            return load_yaml(definitions)
+
+    st = os.stat(def_path)
+    c_path = cache_path(def_path)
+    header, defs = _read_cache(c_path)
+    if header is not None and header[1:3] == (st.st_size, st.st_mtime_ns):
+        return defs
+
+    with open(def_path, "rb") as definitions:
+        raw = definitions.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if header is None or header[1] != st.st_size or header[3] != digest:
+        log.debug("Definitions cache for %s is stale, parsing yaml", def_path)
+        defs = load_yaml(raw)
+    _write_cache(c_path, (CACHE_VERSION, st.st_size, st.st_mtime_ns, digest), defs)
+    return defs
+
+
+class FileCache:
+    """
+    A bounded LRU cache of values computed from files (eg parsed definition files), keyed by absolute path.
+
+    An entry is reused as long as the file's size and mtime are unchanged.  The cache holds at most max_entries
+    entries, and if max_bytes is set, at most max_bytes worth of files (the size on disk is used as a proxy for the
+    memory held by the parsed value).  The least recently used entries are evicted first.
+    """
+    def __init__(self, loader: Callable[[str], Any], max_entries: int = 128, max_bytes: int = None):
+        """
+        :param loader: function taking the absolute path of a file and returning the value to cache
+        :param max_entries: maximum number of files to cache
+        :param max_bytes: optional maximum total size of the cached files
+        """
+        self.loader = loader
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path: str) -> Any:
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[2]
+
+        self.misses += 1
+        value = self.loader(key)
+        self._discard(key)
+        self._entries[key] = (st.st_size, st.st_mtime_ns, value)
+        self.bytes += st.st_size
+        self._evict()
+        return value
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[0]
+
+    def _evict(self) -> None:
+        # Always keep the most recently added entry, even if it alone is over max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                          (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            key, entry = self._entries.popitem(last=False)
+            self.bytes -= entry[0]
+            self.evictions += 1
+            log.debug("Evicted %s from the file cache", key)
+
+    def resize(self, max_entries: int = None, max_bytes: int = None) -> None:
+        """Changes the limits of the cache, evicting entries as needed"""
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes}
@@ -0,0 +1,176 @@
+"""
+A content addressed cache of built uberjars, so that tc_importer only rebuilds the jar when the sources changed.
+
+Entries are keyed by the git tree hash of the checked out commit (git rev-parse HEAD^{tree}), which is the same for
+any two commits with identical contents, followed by a hash of the build commands and artifact glob, so that building
+the same tree differently (eg with another lein profile) doesn't reuse the jar.  Each entry is a directory named after
+the key holding the jar under its original name:
+
+    ~/.polarizer/jar-cache/<tree hash>-<build hash>/sm-1.1.0-SNAPSHOT-standalone.jar
+
+The cache is bounded by the total size of the jars.  An entry's mtime is bumped on every hit, and the least recently
+used entries are removed first.
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+from typing import List, Optional, Sequence, Tuple
+
+from polarizer_py.logger import glob_logger as log
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".polarizer", "jar-cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_BUILD = ("lein clean", "lein uberjar")
+DEFAULT_ARTIFACT = "target/*standalone*.jar"
+
+
+def _git(args: List[str], cwd: str) -> str:
+    return subprocess.run(["git"] + args, cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+
+def tree_hash(repo: str = None) -> Optional[str]:
+    """
+    Returns the tree hash of HEAD in the git repository at repo, or None if the working tree has changes (tracked or
+    untracked files that aren't ignored), since the hash then doesn't describe what would be built
+    """
+    repo = repo or os.getcwd()
+    if _git(["status", "--porcelain"], repo):
+        return None
+    return _git(["rev-parse", "HEAD^{tree}"], repo)
+
+
+def cache_key(tree: str, build: Sequence[str], artifact: str) -> str:
+    """Returns the cache key of the jar built from tree by the build commands"""
+    import hashlib
+    import json
+
+    recipe = hashlib.sha1(json.dumps([list(build), artifact]).encode("utf-8")).hexdigest()
+    return "{}-{}".format(tree, recipe[:12])
+
+
+class JarCache:
+    """The cache directory, and the limit on its size"""
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: where the jars are stored
+        :param max_bytes: maximum total size of the cached jars
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the path of the jar cached for key, or None"""
+        entry = self._entry(key)
+        jars = glob.glob(os.path.join(entry, "*.jar"))
+        if not jars:
+            return None
+        os.utime(entry)
+        return jars[0]
+
+    def put(self, key: str, jar: str) -> str:
+        """
+        Copies jar into the cache under key, and evicts old entries if the cache is now too big
+
+        :return: the path of the cached jar
+        """
+        entry = self._entry(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Copy into a temporary directory and rename it, so a concurrent run never sees a partial jar
+        tmp = "{}.tmp{}".format(entry, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        shutil.copy2(jar, tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Someone else stored the same tree first
+            shutil.rmtree(tmp, ignore_errors=True)
+        os.utime(entry)
+        self.evict(keep=key)
+        return os.path.join(entry, os.path.basename(jar))
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """Returns (last used, size in bytes, key) for every complete entry, least recently used first"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        found = []
+        for de in os.scandir(self.cache_dir):
+            if not de.is_dir() or ".tmp" in de.name:
+                continue
+            size = sum(os.path.getsize(j) for j in glob.glob(os.path.join(de.path, "*.jar")))
+            found.append((de.stat().st_mtime, size, de.name))
+        return sorted(found)
+
+    def evict(self, keep: str = None) -> List[str]:
+        """
+        Removes least recently used entries until the cache fits in max_bytes
+
+        :param keep: key that is never evicted (the entry just used)
+        :return: the evicted keys
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            evicted.append(key)
+            log.info("Evicted jar %s from %s", key, self.cache_dir)
+        return evicted
+
+
+def find_artifact(repo: str, pattern: str = DEFAULT_ARTIFACT) -> str:
+    """Returns the newest file in repo matching pattern (eg the standalone jar made by lein uberjar)"""
+    found = glob.glob(os.path.join(repo, pattern))
+    if not found:
+        raise FileNotFoundError("No build artifact matching {} in {}".format(pattern, repo))
+    return max(found, key=os.path.getmtime)
+
+
+def build_jar(repo: str = None,
+              build: Sequence[str] = DEFAULT_BUILD,
+              artifact: str = DEFAULT_ARTIFACT,
+              cache: JarCache = None,
+              timeout: float = None) -> str:
+    """
+    Returns the path to the uberjar for the checked out sources in repo, only running the build commands if the cache
+    has no jar for the current tree hash
+
+    :param repo: the git repository to build (defaults to the current directory)
+    :param build: shell commands run in order in repo to build the jar
+    :param artifact: glob, relative to repo, of the jar the build produces
+    :param cache: the JarCache to use, or None to always build
+    :param timeout: seconds each build command may run before it is killed, or None (lein uberjar can take minutes)
+    :return: path of the jar (inside the cache if one is used)
+    """
+    from polarizer_py.utils import launch
+
+    repo = repo or os.getcwd()
+    tree = tree_hash(repo) if cache is not None else None
+    key = cache_key(tree, build, artifact) if tree is not None else None
+    if key is not None:
+        jar = cache.get(key)
+        if jar is not None:
+            log.info("Reusing jar built from tree %s: %s", tree, jar)
+            return jar
+    elif cache is not None:
+        log.info("%s has uncommitted changes, not using the jar cache", repo)
+
+    for cmd in build:
+        output, returncode = launch(cmd, cwd=repo, shell=True, timeout=timeout)
+        if returncode != 0:
+            raise RuntimeError("Build command '{}' failed with return code {}".format(cmd, returncode))
+    jar = find_artifact(repo, artifact)
+    if key is not None:
+        jar = cache.put(key, jar)
+    return jar
@@ -3,6 +3,11 @@ import time
 import sys
 import os
 
+# Set to 1 to hand log records to a background thread instead of writing them in the calling thread
+POLARIZER_ASYNC_LOGGING = "POLARIZER_ASYNC_LOGGING"
+# Level of glob_logger (eg INFO).  Calls below it return before any record is created or message formatted
+POLARIZER_LOG_LEVEL = "POLARIZER_LOG_LEVEL"
+
 
 def make_timestamp():
     """
@@ -40,10 +45,18 @@ def make_stream_handler(fmt, stream=sys.stdout, loglevel=logging.INFO):
     return strm_handler
 
 
-def make_file_handler(fmt, filename, loglevel=logging.DEBUG):
+class _DirCreatingFileHandler(logging.FileHandler):
+    """A FileHandler which creates the log file's directory when the file is first opened"""
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+def make_file_handler(fmt, filename, loglevel=logging.DEBUG, delay=False):
     """
+    :param delay: (bool) if True, the log file (and its directory) is not created until the first record is emitted
     """
-    file_handler = logging.FileHandler(filename)
+    file_handler = _DirCreatingFileHandler(filename, delay=delay)
     file_handler.setFormatter(fmt)
     file_handler.setLevel(loglevel)
     return file_handler
@@ -71,7 +84,7 @@ def get_simple_logger(logname, filename, loglvl=logging.DEBUG):
     # Make the filename, file handler and formatter
     fname = make_timestamped_filename(filename, ".log")
     file_fmt = make_formatter()
-    fh = make_file_handler(file_fmt, fname)
+    fh = make_file_handler(file_fmt, fname, delay=True)
 
     # get the actual logger
     logr = make_logger(logname, (sh, fh))
@@ -86,7 +99,55 @@ def banner(logger, msgs, loglevel=logging.INFO,  highlight="=", length=20):
     logger.log(loglevel, highlight * length)
 
 
+def enable_async_logging(logger):
+    """
+    Moves the logger's handlers behind a QueueHandler, so that logging only puts the record on a queue and the
+    formatting and I/O happen on a QueueListener thread.  The listener is stopped (and the queue drained) at exit.
+
+    :param logger: the logger, eg glob_logger
+    :return: the QueueListener
+    """
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    class PassThroughQueueHandler(QueueHandler):
+        # QueueHandler.prepare() formats the message on the logging thread, so queue the record as it is instead.
+        # Mutable arguments should therefore not be changed after they are logged
+        def prepare(self, record):
+            return record
+
+    handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return None
+    q = queue.SimpleQueue()
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    for h in handlers:
+        logger.removeHandler(h)
+    logger.addHandler(PassThroughQueueHandler(q))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def _level_from_env(default=logging.DEBUG):
+    """
+    :return: the level named by POLARIZER_LOG_LEVEL (or default), and the value of the variable if it is not a level
+    """
+    level = os.environ.get(POLARIZER_LOG_LEVEL)
+    if not level:
+        return default, None
+    value = int(level) if level.isdigit() else logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        return default, level
+    return value, None
+
+
+# The log directory and file are only created once something is written to the file
 log_dir = "/tmp/smog"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-glob_logger = get_simple_logger(__name__, log_dir)
+_level, _bad_level = _level_from_env()
+glob_logger = get_simple_logger(__name__, log_dir, loglvl=_level)
+if os.environ.get(POLARIZER_ASYNC_LOGGING, "0") == "1":
+    enable_async_logging(glob_logger)
+if _bad_level is not None:
+    glob_logger.warning("Unknown %s=%s, using %s", POLARIZER_LOG_LEVEL, _bad_level, logging.getLevelName(_level))
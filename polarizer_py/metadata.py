@@ -6,17 +6,22 @@ file.
 """
 
 from functools import wraps
-import yaml
+from collections import Counter, namedtuple
+import io
 import os
 import json
+import logging
 import types
-from inspect import getfullargspec
 from typing import Mapping, Callable, Sequence, Dict
 from . logger import glob_logger as log
-from pprint import pprint
+from . cache import FileCache, load_definitions, load_yaml
+from . timing import phase, timings
 from xml.etree import ElementTree as ET
-from xml.dom import minidom
-import tempfile
+import atexit
+
+# Note: yaml, inspect, minidom, pprint, tempfile and shutil are imported where they are used, so that merely importing
+# this module (eg from an xdist worker that never decorates anything) stays cheap.  Likewise, the configuration, the
+# mapping file and the definitions file are only loaded the first time MetaData needs them.
 
 # We can look for the configuration file in 2 places:
 # - The default which is in ~/.polarizer/polarizer-testcase.json|yml
@@ -27,14 +32,14 @@ POLARIZER_TESTCASE_CONFIG = "POLARIZER_TESTCASE_CONFIG"
 def config():
     if POLARIZER_TESTCASE_CONFIG in os.environ:
         cfg_path = os.environ[POLARIZER_TESTCASE_CONFIG]
-        fn = json.load if os.environ[POLARIZER_TESTCASE_CONFIG].endswith(".json") else yaml.load
+        fn = json.load if os.environ[POLARIZER_TESTCASE_CONFIG].endswith(".json") else load_yaml
         with open(cfg_path, "r") as cfg:
             return fn(cfg)
 
     polarizer_dir = os.path.join(os.path.expanduser("~"), ".polarizer")
     tups = zip(map(lambda x: os.path.join(polarizer_dir, x),
                    ["polarizer-testcase.json", "polarizer-testcase.yaml", "polarizer-testcase.yml"]),
-               (json.load, yaml.load, yaml.load))
+               (json.load, load_yaml, load_yaml))
 
     for p, fn in tups:
         if os.path.exists(p):
@@ -96,6 +101,32 @@ def get_mapping(map_path):
     return mapper
 
 
+def write_mapping(map_path: str, mapping: Mapping) -> None:
+    """
+    Atomically writes the mapping to map_path.  The json is dumped to a temp file in the same directory which is then
+    renamed over map_path, so readers never see a partially written mapping.json
+
+    :param map_path:
+    :param mapping:
+    :return:
+    """
+    import tempfile
+    import shutil
+
+    map_dir = os.path.dirname(os.path.abspath(map_path))
+    fd, tmp = tempfile.mkstemp(suffix=".json", prefix=".mapping-", dir=map_dir)
+    try:
+        with os.fdopen(fd, "w") as j:
+            json.dump(mapping, j, sort_keys=True, indent=2)
+        if os.path.exists(map_path):
+            shutil.copymode(map_path, tmp)
+        os.replace(tmp, map_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
 def qual_name(obj) -> str:
     if isinstance(obj, types.ModuleType):
         return "{}.{}".format(obj.__package__, obj.__qualname__)
@@ -112,7 +143,10 @@ def meta_to_tc_xml(name: str, meta: Mapping) -> ET.Element:
     :param project:
     :return:
     """
-    pprint(meta)
+    if log.isEnabledFor(logging.DEBUG):
+        from pprint import pformat
+
+        log.debug("Metadata for %s:\n%s", name, pformat(meta))
     root = ET.Element("testcase", attrib={"id": meta["id"]})
     title = ET.SubElement(root, "title")
     title.text = name
@@ -138,9 +172,25 @@ def _get_test_steps(fn: Callable) -> Sequence:
     :param fn:
     :return:
     """
-    spec = getfullargspec(fn)
+    if isinstance(fn, types.FunctionType) and not hasattr(fn, "__signature__"):
+        # Same as getfullargspec(fn).args for a plain function, without building a Signature
+        args = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+    else:
+        from inspect import getfullargspec
+
+        args = getfullargspec(fn).args
+    return _make_test_steps(args)
+
+
+def _make_test_steps(args: Sequence[str]) -> Sequence:
+    """
+    Returns the test steps for a function with the given positional argument names
+
+    :param args:
+    :return:
+    """
     test_step_column = []
-    for arg in spec.args:
+    for arg in args:
         parameter = {
             "parameter": {
                 "name": arg,
@@ -161,9 +211,158 @@ def write_xml(path, node):
         x.write(str.encode(node))
 
 
+def _xml_escape(data: str) -> str:
+    """Escapes text and attribute values the same way xml.dom.minidom does"""
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def write_element(out, elem: ET.Element, indent: str = "  ", depth: int = 0) -> None:
+    """
+    Writes elem (and its children) to the file-like out.  With an indent, the output is the same as minidom's
+    toprettyxml, but without building a DOM or an intermediate string of the whole document.
+
+    :param out: file-like object opened in text mode
+    :param elem: the element to write
+    :param indent: indentation per level, or None to write without whitespace
+    :param depth: the nesting level of elem
+    :return:
+    """
+    newl = "\n" if indent is not None else ""
+    pad = (indent or "") * depth
+    out.write(pad + "<" + elem.tag)
+    for name, value in elem.attrib.items():
+        out.write(" {}=\"{}\"".format(name, _xml_escape(value)))
+
+    nodes = [elem.text] if elem.text else []
+    for child in elem:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+
+    if not nodes:
+        out.write("/>" + newl)
+    elif len(nodes) == 1 and isinstance(nodes[0], str):
+        out.write(">" + _xml_escape(nodes[0]) + "</" + elem.tag + ">" + newl)
+    else:
+        out.write(">" + newl)
+        for node in nodes:
+            if isinstance(node, str):
+                out.write(_xml_escape(pad + (indent or "") + node + newl))
+            else:
+                write_element(out, node, indent, depth + 1)
+        out.write(pad + "</" + elem.tag + ">" + newl)
+
+
+def _testcases_header(project: str, selector: Sequence[str], indent: str = "  ") -> str:
+    """Returns everything in a <testcases> document up to the first <testcase>"""
+    newl = "\n" if indent is not None else ""
+    response_props = ET.Element("response-properties")
+    ET.SubElement(response_props, "response-property", attrib={"name": selector[0], "value": selector[1]})
+    out = io.StringIO()
+    out.write("<?xml version=\"1.0\" ?>" + newl)
+    out.write("<testcases project-id=\"{}\">".format(_xml_escape(project)) + newl)
+    write_element(out, response_props, indent, 1)
+    return out.getvalue()
+
+
+def _testcases_footer(indent: str = "  ") -> str:
+    return "</testcases>" + ("\n" if indent is not None else "")
+
+
+def _render_testcase(meta: Mapping, indent: str = "  ") -> str:
+    qname = meta["name"]
+    log.info("TODO: Test method %s will be added to TestCase import request", qname)
+    out = io.StringIO()
+    write_element(out, meta_to_tc_xml(qname, meta), indent, 1)
+    return out.getvalue()
+
+
+def write_testcases_xml(path: str, project: str, selector: Sequence[str], metas: Sequence[Mapping],
+                        indent: str = "  ") -> None:
+    """
+    Streams a <testcases> import document to path.  Each <testcase> is created by meta_to_tc_xml and written out
+    immediately, so memory use does not grow with the number of testcases
+
+    :param path: where to write the xml
+    :param project: the Polarion project id
+    :param selector: (name, value) of the response-property selector
+    :param metas: the testcase metadata to write
+    :param indent: indentation used for pretty printing, or None to write without whitespace
+    :return:
+    """
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        out.write(_testcases_header(project, selector, indent))
+        for item in metas:
+            out.write(_render_testcase(item, indent))
+        out.write(_testcases_footer(indent))
+
+
+# One file of a chunked TestCase import.  selector is the (name, value) of its response-property, and testcases is how
+# many testcases it contains
+XMLChunk = namedtuple("XMLChunk", ["path", "selector", "testcases"])
+
+
+def write_testcases_xml_chunks(project: str, selector: Sequence[str], metas: Sequence[Mapping],
+                               max_testcases: int = None, max_bytes: int = None,
+                               indent: str = "  ") -> Sequence[XMLChunk]:
+    """
+    Like write_testcases_xml, but splits the testcases over as many files as needed so that no file has more than
+    max_testcases testcases or is bigger than max_bytes.  A single testcase bigger than max_bytes gets a file of its
+    own.  Each file's selector value gets a -1, -2, ... suffix, so the responses to each import can be told apart
+
+    :param project: the Polarion project id
+    :param selector: (name, value) of the response-property selector
+    :param metas: the testcase metadata to write
+    :param max_testcases: maximum number of testcases per file (None for no limit)
+    :param max_bytes: maximum size in bytes of each file (None for no limit)
+    :param indent: indentation used for pretty printing, or None to write without whitespace
+    :return: the chunk files in order
+    """
+    footer = _testcases_footer(indent)
+    footer_size = len(footer.encode("utf-8"))
+    chunks = []
+    out = None
+    count = size = 0
+
+    def close_chunk():
+        out.write(footer)
+        out.close()
+        chunks[-1] = chunks[-1]._replace(testcases=count)
+
+    try:
+        for item in metas:
+            tc = _render_testcase(item, indent)
+            tc_size = len(tc.encode("utf-8")) if max_bytes else 0
+            full = out is not None and ((max_testcases and count >= max_testcases) or
+                                        (max_bytes and size + tc_size + footer_size > max_bytes))
+            if out is None or full:
+                if out is not None:
+                    close_chunk()
+                chunk_selector = _chunk_selector(selector, len(chunks) + 1)
+                header = _testcases_header(project, chunk_selector, indent)
+                chunks.append(XMLChunk(_make_xml_path(), chunk_selector, 0))
+                out = open(chunks[-1].path, "w", encoding="utf-8", newline="")
+                out.write(header)
+                count, size = 0, len(header.encode("utf-8"))
+                if max_bytes and size + tc_size + footer_size > max_bytes:
+                    log.warning("%s alone is bigger than %s bytes", item["name"], max_bytes)
+            out.write(tc)
+            count += 1
+            size += tc_size
+        if out is not None:
+            close_chunk()
+    finally:
+        if out is not None and not out.closed:
+            out.close()
+    return chunks
+
+
 def testcase_xml_node(tid, qname, meta, update=False):
+    import tempfile
+    from xml.dom import minidom
+
     if tid == "" or update:
-        log.info("TODO: Test method {} will be added to TestCase import request".format(qname))
+        log.info("TODO: Test method %s will be added to TestCase import request", qname)
         root = meta_to_tc_xml(qname, meta)
         parsed = ET.tostring(root)
         pretty = minidom.parseString(parsed)
@@ -176,32 +375,125 @@ def testcase_xml_node(tid, qname, meta, update=False):
     return "", None
 
 
-def generate_import_xml(import_list: Dict, cfg=config()):
-    s_name = cfg["testcase"]["selector"]["name"]
-    s_val = cfg["testcase"]["selector"]["value"]
+def _make_xml_path() -> str:
+    """Returns the path of a new, unique xml file in /tmp"""
+    import tempfile
+
+    # For some reason, using the NamedTemporaryFile in a with context didn't work
+    tf = tempfile.NamedTemporaryFile(suffix=".xml", prefix="polarion-testcase-", dir="/tmp")
+    log.info("Created xml definition file in %s", tf.name)
+    tf.close()
+    return tf.name
+
+
+def _selector(cfg: Mapping) -> Sequence[str]:
+    return cfg["testcase"]["selector"]["name"], cfg["testcase"]["selector"]["value"]
+
+
+def _chunk_selector(selector: Sequence[str], part: int) -> Sequence[str]:
+    return selector[0], "{}-{}".format(selector[1], part)
+
+
+def _write_chunk(path: str, project: str, selector: Sequence[str], metas: Sequence[Mapping],
+                 indent: str = "  ") -> XMLChunk:
+    write_testcases_xml(path, project, selector, metas, indent=indent)
+    return XMLChunk(path, selector, len(metas))
+
+
+def _run_tasks(tasks: Sequence, workers: int = None) -> Sequence:
+    """
+    Runs a sequence of (fn, args) tasks and returns their results in the same order.  If workers is more than 1, the
+    tasks are spread over a pool of that many processes
+
+    :param tasks:
+    :param workers:
+    :return:
+    """
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        return [fn(*args) for fn, args in tasks]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        futures = [pool.submit(fn, *args) for fn, args in tasks]
+        return [f.result() for f in futures]
+
+
+def generate_import_xml(import_list: Dict, cfg=None, indent: str = "  ", workers: int = None):
+    """
+    Writes one TestCase import xml file per project in import_list
+
+    :param import_list: a dict of project to the list of testcase metadata to import
+    :param cfg: configuration (defaults to MetaData.cfg)
+    :param indent: indentation used for pretty printing.  If None, the xml is written without any whitespace
+    :param workers: if more than 1, the projects are written in parallel by a pool of this many processes
+    :return: a dict of project to the path of its xml file
+    """
+    if cfg is None:
+        cfg = MetaData.cfg
+    selector = _selector(cfg)
     nodes = {}
+    tasks = []
+    # The file names are all picked here, in project order, so they don't depend on which worker runs first
     for project, tcs in import_list.items():
-        parent = ET.Element("testcases", attrib={"project-id": project})
-        response_props = ET.SubElement(parent, "response-properties")
-        response_prop = ET.SubElement(response_props, "response-property", attrib={"name": s_name, "value": s_val})
-        for item in tcs:
-            qname = item["name"]
-            log.info("TODO: Test method {} will be added to TestCase import request".format(qname))
-            root = meta_to_tc_xml(qname, item)
-            parent.append(root)
-
-        parsed = ET.tostring(parent)
-        pretty = minidom.parseString(parsed)
-        node = pretty.toprettyxml(indent="  ")
-        # For some reason, using the NamedTemporaryFile in a with context didn't work
-        tf = tempfile.NamedTemporaryFile(suffix=".xml", prefix="polarion-testcase-", dir="/tmp")
-        log.info("Created xml definition file in {}".format(tf.name))
-        tf.close()
-        write_xml(tf.name, node)
-        nodes[project] = tf.name
+        path = _make_xml_path()
+        tasks.append((write_testcases_xml, (path, project, selector, tcs, indent)))
+        nodes[project] = path
+    with phase("generate_import_xml"):
+        _run_tasks(tasks, workers)
     return nodes
 
 
+def generate_import_xml_chunks(import_list: Dict, cfg=None, max_testcases: int = None, max_bytes: int = None,
+                               indent: str = "  ", workers: int = None) -> Dict[str, Sequence[XMLChunk]]:
+    """
+    Like generate_import_xml, but each project's testcases are split into batches, so that each batch can be imported
+    (and retried) on its own.  The limits default to the max-testcases and max-bytes keys of the testcase.batch
+    section of the configuration
+
+    :param import_list: a dict of project to the list of testcase metadata to import
+    :param cfg: configuration (defaults to MetaData.cfg)
+    :param max_testcases: maximum number of testcases per file
+    :param max_bytes: maximum size of each file
+    :param indent: indentation used for pretty printing.  If None, the xml is written without any whitespace
+    :param workers: if more than 1, the files are written in parallel by a pool of this many processes
+    :return: a dict of project to its ordered list of XMLChunk
+    """
+    if cfg is None:
+        cfg = MetaData.cfg
+    batch = cfg["testcase"].get("batch", {})
+    if max_testcases is None:
+        max_testcases = batch.get("max-testcases")
+    if max_bytes is None:
+        max_bytes = batch.get("max-bytes")
+    selector = _selector(cfg)
+
+    tasks = []
+    projects = []
+    for project, tcs in import_list.items():
+        if max_testcases and not max_bytes:
+            # The batches are known up front, so each one can be written by its own task
+            tcs = list(tcs)
+            for part, start in enumerate(range(0, len(tcs), max_testcases), 1):
+                batch_tcs = tcs[start:start + max_testcases]
+                args = (_make_xml_path(), project, _chunk_selector(selector, part), batch_tcs, indent)
+                tasks.append((_write_chunk, args))
+                projects.append(project)
+        else:
+            tasks.append((write_testcases_xml_chunks, (project, selector, tcs, max_testcases, max_bytes, indent)))
+            projects.append(project)
+
+    chunks = {project: [] for project in import_list}
+    with phase("generate_import_xml_chunks"):
+        results = _run_tasks(tasks, workers)
+    for project, result in zip(projects, results):
+        if isinstance(result, XMLChunk):
+            chunks[project].append(result)
+        else:
+            chunks[project].extend(result)
+    return chunks
+
+
 def calc(kw, mtype=0):
     mtype |= 0 if kw["path"] is None else 1 << 1
     mtype |= 0 if kw["definition"] is None else 1 << 0
@@ -217,14 +509,13 @@ def _get_metadata_kwargs(kwargs: Mapping, name: str) -> Dict:
         meta_path = kwargs["path"]
         if not os.path.exists(meta_path):
             return {}
-        with open(meta_path, "r") as cfg:
-            defs = yaml.load(cfg)
+        defs = load_definitions(meta_path)
         if defs is not None:
             fltr = _fltr_definitions_by_name(name)
             definition = list(filter(fltr, defs))
             if len(definition) > 1:
                 tc_def = definition[0]
-                log.error("Found multiple entries with {} in {} file. Using {}".format(name, meta_path, tc_def))
+                log.error("Found multiple entries with %s in %s file. Using %s", name, meta_path, tc_def)
                 return tc_def
             if len(definition) == 0:
                 err = "No definition found for {} in file."
@@ -237,9 +528,7 @@ def _get_metadata_kwargs(kwargs: Mapping, name: str) -> Dict:
 
 
 def _get_definitions_from_path(def_path: str) -> Dict:
-    with open(def_path, "r") as definitions:
-        defs = yaml.load(definitions)
-    return defs
+    return load_definitions(def_path)
 
 
 def _get_metadata_definitions(def_path: str) -> Dict:
@@ -271,21 +560,153 @@ def get_meta_from_dict(definitions: Mapping, qname: str, project: str) -> Dict:
     return definitions[qname][project]
 
 
+class _lazy:
+    """
+    Decorator for a classmethod-like function computing a class attribute.  The function runs the first time the
+    attribute is looked up, and the result then replaces the descriptor on the class, so later lookups are plain
+    attribute accesses.  Assigning the attribute before first use (eg MetaData.cfg = {...}) skips the computation.
+    """
+    def __init__(self, fn: Callable):
+        self.fn = fn
+        self.name = fn.__name__
+
+    def __get__(self, obj, owner):
+        value = self.fn(owner)
+        setattr(owner, self.name, value)
+        return value
+
+
 class MetaData:
     """
     Container class so that every function wrapped with @metadata can store information here
     """
-    cfg = config()
-    mapping = get_mapping(cfg["mapping"])
-    definitions = _get_metadata_definitions(cfg["definitions-path"])
     import_list = {}
     import_by = set()
+    journal = []
+    manifest_dirty = False
+
+    @_lazy
+    def cfg(cls) -> Dict:
+        with phase("load_config"):
+            return config()
+
+    @_lazy
+    def mapping(cls) -> Dict:
+        with phase("load_mapping"):
+            return get_mapping(cls.cfg["mapping"])
+
+    @_lazy
+    def definitions(cls) -> Dict:
+        with phase("load_definitions"):
+            return _get_metadata_definitions(cls.cfg["definitions-path"])
+
+    @classmethod
+    def _file_cache(cls, loader: Callable) -> FileCache:
+        limits = cls.cfg.get("definition-files-cache", {})
+        return FileCache(loader, max_entries=limits.get("max-entries", 128), max_bytes=limits.get("max-bytes"))
+
+    @_lazy
+    def definition_files(cls) -> FileCache:
+        """Parsed custom definition files, as used by @metadata(path=...)"""
+        return cls._file_cache(_get_metadata_definitions)
+
+    @_lazy
+    def write_behind(cls) -> bool:
+        """In write-behind mode, mapping mutations are only journaled, and mapping.json is written once by flush()"""
+        return bool(cls.cfg.get("mapping-write-behind", False))
+
+    @_lazy
+    def manifest(cls) -> Dict:
+        """
+        The sync manifest: for each qualified name, the fingerprint of the test when it was last registered and the
+        mapping ids it ended up with.  Empty if no sync-manifest is configured
+        """
+        path = cls.cfg.get("sync-manifest")
+        if path is None or not os.path.exists(path):
+            return {}
+        with open(path) as m:
+            return json.load(m)
+
+    @classmethod
+    def _fingerprint(cls, qname: str, path: str, definition: Dict, description: str, test_steps: Sequence,
+                     params: Sequence[str]) -> str:
+        """
+        Hashes everything _register depends on: what the decorator knows about the function, and the test's entries
+        in the default and custom definition files
+        """
+        import hashlib
+
+        entries = [cls.definitions.get(qname)]
+        if path is not None and os.path.exists(path):
+            entries.append(cls.definition_files.get(path).get(qname))
+        state = [qname, path, definition, description, test_steps, list(params), entries]
+        return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _unchanged(cls, qname: str, fingerprint: str) -> bool:
+        """True if the manifest says qname was registered with this fingerprint and its mapping ids haven't changed"""
+        entry = cls.manifest.get(qname)
+        if entry is None or entry["hash"] != fingerprint:
+            return False
+        mapped = cls.mapping.get(qname, {})
+        return all(mapped.get(project, {}).get("id") == tc_id for project, tc_id in entry["ids"].items())
+
+    @classmethod
+    def _update_manifest(cls, qname: str, fingerprint: str, tcs: Mapping) -> None:
+        """
+        Records the test in the manifest, if it is fully synced: every project has an id in the mapping and nothing
+        asked for an update.  Otherwise it is dropped from the manifest, so it is processed again next time
+        """
+        ids = {project: cls.mapping.get(qname, {}).get(project, {}).get("id", "") for project in tcs}
+        synced = bool(ids) and all(ids.values()) and not any(tcs[p].get("update", False) for p in tcs)
+        if synced:
+            cls.manifest[qname] = {"hash": fingerprint, "ids": ids}
+        elif cls.manifest.pop(qname, None) is None:
+            return
+        cls.manifest_dirty = True
+
+    @classmethod
+    def _record(cls, op: str, qname: str, project: str, value: str, map_path: str = None) -> None:
+        """
+        Appends a mutation to the journal.  If the mutation touches a mapping file and we are not in write-behind mode,
+        the mapping file is written out immediately
+
+        :param op: name of the operation (eg update_mapping)
+        :param qname:
+        :param project:
+        :param value: the new id
+        :param map_path: path of the mapping.json file that needs to be rewritten, or None
+        :return:
+        """
+        cls.journal.append((op, qname, project, value, map_path))
+        if map_path is not None and not cls.write_behind:
+            cls.flush()
+
+    @classmethod
+    def flush(cls) -> None:
+        """
+        Writes out every mapping.json file touched by the journaled mutations (once per file), then clears the journal.
+        The sync manifest is written too, if it changed.  This is registered to run at process exit, but can be called
+        explicitly at any time.
+
+        :return:
+        """
+        changes = Counter(entry[-1] for entry in cls.journal if entry[-1] is not None)
+        for map_path in sorted(changes):
+            log.debug("Flushing %s mapping changes to %s", changes[map_path], map_path)
+            with phase("write_mapping"):
+                write_mapping(map_path, cls.mapping)
+        cls.journal.clear()
+        if cls.manifest_dirty:
+            write_mapping(cls.cfg["sync-manifest"], cls.manifest)
+            cls.manifest_dirty = False
 
     @classmethod
     def update_definition(cls, qname: str, project: str, map_id: str) -> None:
         """Edits the map_id in the id field of the definition file"""
         meta = cls.definitions[qname][project]
         meta["id"] = map_id
+        cls._record("update_definition", qname, project, map_id)
 
     @classmethod
     def update_mapping(cls, qname: str, project: str, meta_id: str) -> None:
@@ -299,11 +720,12 @@ class MetaData:
         """
         meta = get_meta_from_dict(cls.definitions["testcase"], qname, project)
         if qname not in cls.mapping:
-            log.error("Could not find {} in mapping.json".format(qname))
+            log.error("Could not find %s in mapping.json", qname)
             cls.mapping[qname] = {project: {}}
         if project not in cls.mapping[qname]:
             cls.mapping[qname][project] = {}
         cls.mapping[qname][project]["id"] = meta_id
+        cls._record("update_mapping", qname, project, meta_id, cls.cfg["mapping"])
 
     @classmethod
     def compare_map_to_meta(cls, qname: str, project: str, map_id: str, meta_id: str, update=False) -> None:
@@ -332,7 +754,7 @@ class MetaData:
 
         comparison = check()
         if comparison == 0:
-            if map_id != meta_id: log.error("{} in map and {} in meta do not match".format(map_id, meta_id))
+            if map_id != meta_id: log.error("%s in map and %s in meta do not match", map_id, meta_id)
         elif comparison == 1:
             cls.update_definition(qname, project, map_id)
         elif comparison == 2:
@@ -397,7 +819,7 @@ class MetaData:
             meta_path = kwargs["path"]
             if not os.path.exists(meta_path):
                 return {}
-            defs = _get_metadata_definitions(meta_path)
+            defs = cls.definition_files.get(meta_path)
             if defs is not None:
                 if name in defs:
                     return defs[name]
@@ -420,7 +842,83 @@ class MetaData:
             return def_tc
 
     @classmethod
-    def metadata(cls, cfg=config(), path=None, definition=None) -> Callable:
+    def _register(cls, qname: str, cfg: Mapping, path: str = None, definition: Dict = None, description: str = None,
+                  test_steps: Sequence = (), params: Sequence[str] = ()) -> None:
+        """
+        Does the work of the @metadata decorator for one test: merges its metadata, adds it to the mapping, and adds
+        it to the import_list if it needs a new testcase.  The decorator calls this with what it finds out about the
+        function by reflection, polarizer_py.static_scan with what it finds out from the source.
+
+        :param qname: qualified name of the test, as given by qual_name
+        :param cfg: the configuration
+        :param path: the path argument of the decorator
+        :param definition: the definition argument of the decorator
+        :param description: description of the testcase
+        :param test_steps: as returned by _get_test_steps
+        :param params: the local variable names of the function (its __code__.co_varnames)
+        :return:
+        """
+        fingerprint = None
+        if cls.cfg.get("sync-manifest"):
+            with phase("fingerprint"):
+                fingerprint = cls._fingerprint(qname, path, definition, description, test_steps, params)
+                unchanged = cls._unchanged(qname, fingerprint)
+            if unchanged:
+                return
+
+        with phase("get_metadata"):
+            tcs = cls._get_metadata({"path": path, "definition": definition}, qname)
+
+        for project in tcs:
+            meta = tcs[project]
+            # Set up the defaults
+            test_case_id = meta["id"]
+            update = meta["update"] if "update" in meta else False
+            mapping = cls.mapping
+
+            meta["description"] = description
+            meta["test-steps"] = test_steps
+            _set_custom_defaults(meta)
+            cls.definitions[qname][project] = meta
+
+            def set_fn_in_mapping(imap: Dict) -> Dict:
+                """
+                Writes the inner map conaining the id and params to the mapping json file.  In write-behind mode
+                the write is deferred until MetaData.flush()
+
+                :param imap:
+                :return:
+                """
+                imap[project] = {
+                    "id": test_case_id,
+                    "params": list(params)
+                }
+                cls._record("set_fn_in_mapping", qname, project, test_case_id, cfg["mapping"])
+                return mapping
+
+            # Set up the mapping.json appropriately. If the qualified name is not in the mapping file, add it.
+            # If it is in mapping.json, check if the testcase_id is set for the project
+            if qname not in mapping:
+                mapping[qname] = {}
+                with phase("set_fn_in_mapping"):
+                    set_fn_in_mapping(mapping[qname])
+            elif project not in mapping[qname]:
+                with phase("set_fn_in_mapping"):
+                    set_fn_in_mapping(mapping[qname])
+            else:
+                log.debug("%s already in map file for project %s", qname, project)
+
+            # Compare the meta defintion with the mapping definition and do what is needed.  This will add functions
+            # to the cls.import_list as needed
+            map_id = mapping[qname][project]["id"]
+            with phase("compare_map_to_meta"):
+                cls.compare_map_to_meta(qname, project, map_id, test_case_id, update=update)
+
+        if fingerprint is not None:
+            cls._update_manifest(qname, fingerprint, tcs)
+
+    @classmethod
+    def metadata(cls, cfg=None, path=None, definition=None) -> Callable:
         """
         The decorator which specifies where the test definition yaml file lives.
 
@@ -435,60 +933,25 @@ class MetaData:
         plain text file in code (but we can not edit source code as in python decorators or java annotations), we can
         automatically fill in the ID for the testcase, or turn off the update key in the file.
 
-        :param cfg: a dictionary containing configuration options
+        :param cfg: a dictionary containing configuration options (defaults to MetaData.cfg)
         :param path: Path to where the yaml definition file is
         :param definition: An optional configuration dictionary
         :return: decorator
         """
+        if cfg is None:
+            cfg = cls.cfg
 
         def outer(fn):
             """Code here gets executed at decoration not invocation time"""
             qname = qual_name(fn)
-            tcs = cls._get_metadata({"path": path, "definition": definition}, qname)
-
-            for project in tcs:
-                meta = tcs[project]
-                # Set up the defaults
-                test_case_id = meta["id"]
-                update = meta["update"] if "update" in meta else False
-                mapping = cls.mapping
-
+            with timings.test(qname):
                 # Insert information about the function via reflection
-                is_doc = hasattr(fn, "__docstring__")
-                meta["description"] = fn.__docstring__ if is_doc else "No docstring for {}".format(qname)
-                meta["test-steps"] = _get_test_steps(fn)
-                _set_custom_defaults(meta)
-                cls.definitions[qname][project] = meta
-
-                def set_fn_in_mapping(imap: Dict) -> Dict:
-                    """
-                    Writes the inner map conaining the id and params to the mapping json file
-
-                    :param imap:
-                    :return:
-                    """
-                    imap[project] = {
-                        "id": test_case_id,
-                        "params": list(fn.__code__.co_varnames)
-                    }
-                    with open(cfg["mapping"], "w") as j:
-                        json.dump(mapping, j, sort_keys=True, indent=2)
-                    return mapping
-
-                # Set up the mapping.json appropriately. If the qualified name is not in the mapping file, add it.
-                # If it is in mapping.json, check if the testcase_id is set for the project
-                if qname not in mapping:
-                    mapping[qname] = {}
-                    set_fn_in_mapping(mapping[qname])
-                elif project not in mapping[qname]:
-                    set_fn_in_mapping(mapping[qname])
-                else:
-                    log.debug("{} already in map file for project {}".format(qname, project))
-
-                # Compare the meta defintion with the mapping definition and do what is needed.  This will add functions
-                # to the cls.import_list as needed
-                map_id = mapping[qname][project]["id"]
-                cls.compare_map_to_meta(qname, project, map_id, test_case_id, update=update)
+                with phase("get_test_steps"):
+                    is_doc = hasattr(fn, "__docstring__")
+                    description = fn.__docstring__ if is_doc else "No docstring for {}".format(qname)
+                    test_steps = _get_test_steps(fn)
+                cls._register(qname, cfg, path=path, definition=definition, description=description,
+                              test_steps=test_steps, params=list(fn.__code__.co_varnames))
 
             @wraps(fn)
             def inner(*args, **kwds):
@@ -511,4 +974,5 @@ class MetaData:
         pass
 
 
+atexit.register(MetaData.flush)
 metadata = MetaData.metadata
@@ -0,0 +1,120 @@
+"""
+A local stand-in for the polarizer /testcase/mapper HTTP endpoint, to exercise tc_importer.ImporterClient without the
+real service.
+
+It accepts the multipart tcargs, mapping and jar upload, and replies with the mapping where every testcase of the
+tcargs project without an id has been given one.  A response delay, and a number of 503 responses before the first
+success, are configurable.
+
+    python -m polarizer_py.mock_mapper --port 9000 --delay 0.5 --fail-first 1
+"""
+
+import argparse
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Returns the contents of each part of a multipart/form-data body, by field name"""
+    msg = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in msg.iter_parts()}
+
+
+class MockMapper(ThreadingHTTPServer):
+    """The mock server.  Each request is handled on its own thread"""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], delay: float = 0.0, fail_first: int = 0):
+        """
+        :param address: (host, port) to listen on.  Use port 0 to pick a free port
+        :param delay: seconds to wait before answering each request
+        :param fail_first: number of requests answered with 503 before the server starts working
+        """
+        super().__init__(address, _Handler)
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests = 0
+        self.jar_bytes = 0
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}/testcase/mapper".format(*self.server_address[:2])
+
+    def new_id(self, project: str) -> str:
+        with self._lock:
+            self._next_id += 1
+            return "{}-{}".format(project, self._next_id)
+
+    def start(self) -> threading.Thread:
+        """Serves on a background thread, until shutdown() is called"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server._lock:
+            server.requests += 1
+            count = server.requests
+        time.sleep(server.delay)
+        if self.path != "/testcase/mapper":
+            return self._reply(404, {"status": "failed", "error": "unknown path {}".format(self.path)})
+        if count <= server.fail_first:
+            return self._reply(503, {"status": "failed", "error": "injected failure"})
+
+        try:
+            parts = parse_multipart(self.headers["Content-Type"], body)
+            tcargs = json.loads(parts["tcargs"].decode("utf-8"))
+            mapping = json.loads(parts["mapping"].decode("utf-8") or "{}")
+            jar = parts["jar"]
+        except (KeyError, TypeError, ValueError) as ex:
+            return self._reply(400, {"status": "failed", "error": "bad upload: {}".format(ex)})
+
+        project = tcargs["project"]
+        created = 0
+        for name, projects in mapping.items():
+            entry = projects.get(project)
+            if entry is not None and not entry.get("id"):
+                entry["id"] = server.new_id(project)
+                created += 1
+        with server._lock:
+            server.jar_bytes += len(jar)
+        self._reply(200, {"status": "passed", "project": project, "created": created, "jar-bytes": len(jar),
+                          "mapping": mapping})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the polarizer testcase mapper endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=9000, type=int)
+    parser.add_argument("--delay", default=0.0, type=float, help="seconds to wait before each response")
+    parser.add_argument("--fail-first", default=0, type=int, help="number of requests answered with 503 first")
+    opts = parser.parse_args()
+
+    server = MockMapper((opts.host, opts.port), delay=opts.delay, fail_first=opts.fail_first)
+    print("Mock testcase mapper listening on {}".format(server.url))
+    server.serve_forever()
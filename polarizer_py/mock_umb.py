@@ -0,0 +1,166 @@
+"""
+A local stand-in for the polarizer UMB verticle, to exercise and load test ws_helper and UMBClient without the real
+service.
+
+It understands the xunit-import-ws, testcase-import-ws and testing ops.  Every request gets some progress messages
+followed by a final message with an 'info' key, all carrying the request's tag.  The time between messages, random
+jitter, and the rate of failed or unanswered requests are configurable.
+
+    python -m polarizer_py.mock_umb --port 9000 --delay 0.05 --jitter 0.02 --failure-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from typing import Dict
+from xml.etree import ElementTree as ET
+
+import websockets
+
+from polarizer_py.logger import glob_logger as log
+
+
+def decode_payload(_type: str, value: str) -> str:
+    """Undoes the compression of a value in the data of a request whose type is <codec>+base64 (see ws_helper)"""
+    if not _type.endswith("+base64"):
+        return value
+
+    import base64
+    import zlib
+
+    raw = base64.b64decode(value)
+    codec = _type[:-len("+base64")]
+    if codec == "gzip":
+        return zlib.decompress(raw, 31).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(raw).decode("utf-8")
+    if codec == "lzma":
+        import lzma
+        return lzma.decompress(raw).decode("utf-8")
+    raise ValueError("Unknown payload type {}".format(_type))
+
+
+class MockUMB:
+    """
+    The mock server.  Requests on the same connection are handled concurrently, like the real verticle does
+    """
+    def __init__(self,
+                 delay: float = 0.05,
+                 jitter: float = 0.0,
+                 progress: int = 2,
+                 failure_rate: float = 0.0,
+                 drop_rate: float = 0.0,
+                 seed: int = None):
+        """
+        :param delay: seconds between each message sent for a request
+        :param jitter: up to this many seconds are randomly added to each delay
+        :param progress: number of progress messages before the final one
+        :param failure_rate: fraction of requests whose final message reports a failure
+        :param drop_rate: fraction of requests which never get a final message (to test client timeouts)
+        :param seed: seed for the random jitter and failures
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.progress = progress
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self._next_id = 0
+
+    async def _pause(self) -> None:
+        await asyncio.sleep(self.delay + self.random.uniform(0, self.jitter))
+
+    def _new_id(self, project: str) -> str:
+        self._next_id += 1
+        return "{}-{}".format(project, self._next_id)
+
+    def _xunit_info(self, data: Dict) -> Dict:
+        root = ET.fromstring(data["xunit"])
+        tests = root.iter("testcase")
+        return {"status": "passed", "testcases": sum(1 for _ in tests)}
+
+    def _testcase_info(self, data: Dict) -> Dict:
+        """Gives every testcase without an id a new one, and returns the updated mapping like polarizer does"""
+        mapping = json.loads(data["mapping"]) if data.get("mapping") else {}
+        root = ET.fromstring(data["testcase"])
+        project = root.get("project-id")
+        created = 0
+        for tc in root.iter("testcase"):
+            title = tc.findtext("title")
+            if tc.get("id"):
+                continue
+            entry = mapping.setdefault(title, {}).setdefault(project, {"params": []})
+            entry["id"] = self._new_id(project)
+            created += 1
+        return {"status": "passed", "created": created, "mapping": mapping}
+
+    async def _respond(self, websocket, message: str) -> None:
+        req = json.loads(message)
+        op = req.get("op")
+        tag = req.get("tag")
+        self.requests[op] += 1
+        try:
+            for step in range(self.progress):
+                await self._pause()
+                await websocket.send(json.dumps({"op": op, "tag": tag, "status": "in progress", "step": step}))
+            await self._pause()
+
+            if self.random.random() < self.drop_rate:
+                return
+            if self.random.random() < self.failure_rate:
+                final = {"status": "failed", "error": "injected failure"}
+            elif op == "testing":
+                final = {"status": "passed", "data": req.get("data")}
+            elif op in ("xunit-import-ws", "testcase-import-ws"):
+                data = json.loads(req["data"])
+                data = {k: decode_payload(req.get("type", "na"), v) for k, v in data.items()}
+                final = self._xunit_info(data) if op == "xunit-import-ws" else self._testcase_info(data)
+            else:
+                final = {"status": "failed", "error": "unknown op {}".format(op)}
+            await websocket.send(json.dumps({"op": op, "tag": tag, "info": final}))
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as ex:
+            log.error("mock UMB could not handle %s: %s", op, ex)
+            await websocket.send(json.dumps({"op": op, "tag": tag, "info": {"status": "failed", "error": str(ex)}}))
+
+    async def handler(self, websocket, path=None) -> None:
+        tasks = set()
+        try:
+            async for message in websocket:
+                tasks.add(asyncio.ensure_future(self._respond(websocket, message)))
+                tasks = set(t for t in tasks if not t.done())
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 9000, **serve_kwargs):
+        """Starts serving on host:port, and returns the websockets server"""
+        serve_kwargs.setdefault("max_size", None)
+        return await websockets.serve(self.handler, host, port, **serve_kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the polarizer UMB websocket verticle")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=9000, type=int)
+    parser.add_argument("--delay", default=0.05, type=float, help="seconds between messages")
+    parser.add_argument("--jitter", default=0.0, type=float, help="random extra delay, up to this many seconds")
+    parser.add_argument("--progress", default=2, type=int, help="progress messages per request")
+    parser.add_argument("--failure-rate", default=0.0, type=float, help="fraction of requests that fail")
+    parser.add_argument("--drop-rate", default=0.0, type=float, help="fraction of requests never answered")
+    parser.add_argument("--seed", default=None, type=int)
+    opts = parser.parse_args()
+
+    mock = MockUMB(delay=opts.delay, jitter=opts.jitter, progress=opts.progress, failure_rate=opts.failure_rate,
+                   drop_rate=opts.drop_rate, seed=opts.seed)
+
+    async def _main():
+        server = await mock.start(opts.host, opts.port)
+        print("Mock UMB listening on ws://{}:{}".format(opts.host, opts.port))
+        await server.wait_closed()
+
+    asyncio.get_event_loop().run_until_complete(_main())
@@ -0,0 +1,387 @@
+"""
+Builds MetaData.import_list and updates mapping.json from the test sources, without importing them.
+
+Running the @metadata decorators means importing every test module, which drags in the whole test environment.  This
+module instead finds the @metadata(...) decorated functions with ast, works out what the decorator would have learned
+by reflection (the qualified name, the arguments and the local variable names) and feeds that into the same
+MetaData._register the decorator uses.  The path= and definition= arguments must be literals, or names of module level
+literals.
+
+    python -m polarizer_py.static_scan /path/to/tests --root /path/to
+
+Some of what reflection sees can only be approximated from the source:
+
+- __code__.co_varnames is rebuilt from the arguments and the names assigned in the function, in the order they first
+  appear.  Names captured by nested functions (cell variables) are left out, like CPython does
+- if another decorator is applied below @metadata, the decorator sees the wrapper, so the test steps come from the
+  wrapper's arguments.  Here they always come from the decorated function itself
+"""
+
+import argparse
+import ast
+import os
+import sys
+from collections import namedtuple
+from typing import Any, Dict, List, Sequence, Tuple
+
+from polarizer_py.logger import glob_logger as log
+from polarizer_py.metadata import MetaData, _make_test_steps, generate_import_xml
+from polarizer_py.timing import phase, timings
+from polarizer_py.utils import find_all_py_files, scan_metadata_usage
+
+StaticTest = namedtuple("StaticTest", ["qname", "path", "definition", "args", "varnames", "source", "lineno"])
+
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+# Since python 3.12 (PEP 709) list, set and dict comprehensions (not generator expressions) run in the enclosing
+# function, so their variables are part of its co_varnames
+INLINED_COMPREHENSIONS = sys.version_info >= (3, 12)
+
+
+class NotLiteral(ValueError):
+    pass
+
+
+def module_name(path: str, root: str = None) -> str:
+    """
+    Returns the name a python file is imported as.  If root (the sys.path entry) isn't given, it is the first parent
+    directory without an __init__.py, like pytest's default import mode
+    """
+    path = os.path.abspath(path)
+    if root is None:
+        root = os.path.dirname(path)
+        while os.path.exists(os.path.join(root, "__init__.py")):
+            root = os.path.dirname(root)
+    rel = os.path.splitext(os.path.relpath(path, os.path.abspath(root)))[0]
+    parts = rel.split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def _bound_names(node: ast.AST) -> List[str]:
+    """Names a statement binds in the current scope, other than through Name targets"""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [(a.asname or a.name).split(".")[0] for a in node.names if a.name != "*"]
+    # Capture patterns of match statements
+    name = getattr(node, "rest", None) if type(node).__name__ == "MatchMapping" else None
+    if type(node).__name__ in ("MatchAs", "MatchStar"):
+        name = node.name
+    if name:
+        return [name]
+    return []
+
+
+class _ScopeNames(ast.NodeVisitor):
+    """
+    Collects, in evaluation order, the names used (loaded or stored) directly in one function scope, the names it
+    binds, its global/nonlocal declarations, and the names loaded by the scopes nested in it
+    """
+    def __init__(self):
+        self.order = []
+        self.stored = set()
+        self.declared = set()
+        self.nested_loads = set()
+
+    def _use(self, name: str, store: bool) -> None:
+        if name not in self.order:
+            self.order.append(name)
+        if store:
+            self.stored.add(name)
+
+    def scan(self, fn) -> "_ScopeNames":
+        for stmt in fn.body:
+            self.visit(stmt)
+        return self
+
+    def _nested(self, node: ast.AST) -> None:
+        inner = _ScopeNames()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            inner.stored.update(_all_args(node.args))
+        if isinstance(node, ast.Lambda):
+            inner.visit(node.body)
+        elif isinstance(node, _COMPREHENSIONS):
+            for i, gen in enumerate(node.generators):
+                if i:
+                    inner.visit(gen.iter)
+                inner.visit(gen.target)
+                for cond in gen.ifs:
+                    inner.visit(cond)
+            for child in ("key", "value", "elt"):
+                if hasattr(node, child):
+                    inner.visit(getattr(node, child))
+        else:
+            inner.scan(node)
+        free = set(n for n in inner.order if n not in inner.stored or n in inner.declared)
+        self.nested_loads |= free | inner.nested_loads
+
+    def visit_Name(self, node: ast.Name) -> None:
+        self._use(node.id, not isinstance(node.ctx, ast.Load))
+
+    def visit_Global(self, node) -> None:
+        self.declared.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def _def(self, node) -> None:
+        # Decorators and defaults run in this scope, the body in its own
+        for d in node.decorator_list:
+            self.visit(d)
+        if not isinstance(node, ast.ClassDef):
+            for default in node.args.defaults + [d for d in node.args.kw_defaults if d is not None]:
+                self.visit(default)
+        else:
+            for base in node.bases + [k.value for k in node.keywords]:
+                self.visit(base)
+        self._nested(node)
+        self._use(node.name, True)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _def
+
+    def visit_Lambda(self, node) -> None:
+        for default in node.args.defaults:
+            self.visit(default)
+        self._nested(node)
+
+    def _comprehension(self, node) -> None:
+        if INLINED_COMPREHENSIONS and not isinstance(node, ast.GeneratorExp):
+            for gen in node.generators:
+                self.visit(gen.iter)
+                self.visit(gen.target)
+                for cond in gen.ifs:
+                    self.visit(cond)
+            for child in ("key", "value", "elt"):
+                if hasattr(node, child):
+                    self.visit(getattr(node, child))
+            return
+        # Only the first iterable is evaluated in this scope, the rest runs in the comprehension's own scope
+        self.visit(node.generators[0].iter)
+        self._nested(node)
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _comprehension
+
+    def visit_Assign(self, node) -> None:
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AnnAssign(self, node) -> None:
+        if node.value is not None:
+            self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_For(self, node) -> None:
+        self.visit(node.iter)
+        self.visit(node.target)
+        for stmt in node.body + node.orelse:
+            self.visit(stmt)
+
+    visit_AsyncFor = visit_For
+
+    def visit_Try(self, node) -> None:
+        # The else block is compiled before the handlers
+        for stmt in node.body + node.orelse + node.handlers + node.finalbody:
+            self.visit(stmt)
+
+    visit_TryStar = visit_Try
+
+    def visit_ExceptHandler(self, node) -> None:
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            self._use(node.name, True)
+        for stmt in node.body:
+            self.visit(stmt)
+
+    def visit_NamedExpr(self, node) -> None:
+        self.visit(node.value)
+        self.visit(node.target)
+
+    def generic_visit(self, node) -> None:
+        super().generic_visit(node)
+        for name in _bound_names(node):
+            self._use(name, True)
+
+
+def _all_args(args: ast.arguments) -> List[str]:
+    names = [a.arg for a in getattr(args, "posonlyargs", []) + args.args + args.kwonlyargs]
+    if args.vararg:
+        names.append(args.vararg.arg)
+    if args.kwarg:
+        names.append(args.kwarg.arg)
+    return names
+
+
+def function_varnames(fn: ast.FunctionDef) -> List[str]:
+    """Approximates fn.__code__.co_varnames: the arguments, then the (non cell) local variables in order of use"""
+    args = _all_args(fn.args)
+    scope = _ScopeNames().scan(fn)
+    local = scope.stored - scope.declared - set(args)
+    return args + [n for n in scope.order if n in local and n not in scope.nested_loads]
+
+
+def _is_metadata_decorator(node: ast.AST, names: Dict[str, str]) -> bool:
+    """True for a call of the metadata function, under whatever names the module imported it as"""
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    if isinstance(func, ast.Name):
+        return names.get(func.id) == "metadata"
+    return (isinstance(func, ast.Attribute) and func.attr == "metadata" and isinstance(func.value, ast.Name) and
+            names.get(func.value.id) in ("MetaData", "module"))
+
+
+def _imported_names(tree: ast.Module) -> Dict[str, str]:
+    """Maps the names the metadata decorator is reachable through in this module to what they refer to"""
+    names = {"metadata": "metadata", "MetaData": "MetaData"}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and (node.module or "").endswith("metadata"):
+            for alias in node.names:
+                if alias.name in ("metadata", "MetaData"):
+                    names[alias.asname or alias.name] = alias.name
+        elif isinstance(node, ast.ImportFrom) and node.module == "polarizer_py":
+            for alias in node.names:
+                if alias.name == "metadata":
+                    names[alias.asname or alias.name] = "module"
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "polarizer_py.metadata" and alias.asname:
+                    names[alias.asname] = "module"
+    return names
+
+
+def _literal(node: ast.AST, constants: Dict[str, Any]) -> Any:
+    if isinstance(node, ast.Name) and node.id in constants:
+        return constants[node.id]
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise NotLiteral(ast.dump(node))
+
+
+def _module_constants(tree: ast.Module) -> Dict[str, Any]:
+    """Module level NAME = <literal> assignments"""
+    constants = {}
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+            try:
+                constants[stmt.targets[0].id] = ast.literal_eval(stmt.value)
+            except ValueError:
+                constants.pop(stmt.targets[0].id, None)
+    return constants
+
+
+def _decorator_kwargs(call: ast.Call, constants: Dict[str, Any]) -> Dict[str, Any]:
+    """The path and definition arguments of a metadata(cfg, path, definition) call"""
+    kwargs = {"path": None, "definition": None}
+    for name, arg in zip(("cfg", "path", "definition"), call.args):
+        if name != "cfg":
+            kwargs[name] = _literal(arg, constants)
+    for kw in call.keywords:
+        if kw.arg in kwargs:
+            kwargs[kw.arg] = _literal(kw.value, constants)
+    return kwargs
+
+
+def find_tests(source: str, module: str, filename: str = "<unknown>") -> Tuple[List[StaticTest], List[str]]:
+    """
+    Finds the @metadata decorated functions in python source
+
+    :param source: the source code
+    :param module: the name the module is imported as
+    :param filename: used in the results and messages
+    :return: (the tests found, messages about decorated functions which had to be skipped)
+    """
+    tree = ast.parse(source, filename)
+    names = _imported_names(tree)
+    constants = _module_constants(tree)
+    tests, skipped = [], []
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                visit(node.body, prefix + node.name + ".")
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                qname = "{}.{}{}".format(module, prefix, node.name)
+                for d in node.decorator_list:
+                    if not _is_metadata_decorator(d, names):
+                        continue
+                    try:
+                        kwargs = _decorator_kwargs(d, constants)
+                    except NotLiteral as ex:
+                        skipped.append("{}:{} {}: argument is not a literal ({})".format(filename, node.lineno,
+                                                                                          qname, ex))
+                        continue
+                    args = [a.arg for a in getattr(node.args, "posonlyargs", []) + node.args.args]
+                    tests.append(StaticTest(qname, kwargs["path"], kwargs["definition"], args,
+                                            function_varnames(node), filename, node.lineno))
+                visit(node.body, prefix + node.name + ".<locals>.")
+
+    visit(tree.body, "")
+    return tests, skipped
+
+
+def analyze(paths: Sequence[str], root: str = None) -> Tuple[List[StaticTest], List[str]]:
+    """
+    Runs find_tests on every file
+
+    :param paths: python files
+    :param root: the sys.path entry the tests are imported from (see module_name)
+    :return: (tests, skipped)
+    """
+    tests, skipped = [], []
+    for path in paths:
+        with open(str(path), "rb") as src:
+            found, skip = find_tests(src.read(), module_name(str(path), root), str(path))
+        tests.extend(found)
+        skipped.extend(skip)
+    return tests, skipped
+
+
+def register(tests: Sequence[StaticTest], cfg: Dict = None) -> Dict:
+    """
+    Does what the @metadata decorators would have done for the tests, and returns MetaData.import_list
+    """
+    if cfg is None:
+        cfg = MetaData.cfg
+    for test in tests:
+        with timings.test(test.qname):
+            MetaData._register(test.qname, cfg, path=test.path, definition=test.definition,
+                               description="No docstring for {}".format(test.qname),
+                               test_steps=_make_test_steps(test.args), params=test.varnames)
+    return MetaData.import_list
+
+
+def scan_project(project: str, root: str = None, workers: int = None, cfg: Dict = None) -> Dict:
+    """
+    Finds the files in project which use metadata, registers their tests and returns MetaData.import_list
+
+    :param project: directory with the tests
+    :param root: the sys.path entry the tests are imported from (see module_name)
+    :param workers: number of processes used to find the files which use metadata
+    :param cfg: the configuration (defaults to MetaData.cfg)
+    :return:
+    """
+    files = list(find_all_py_files(project))
+    files = [f for f, uses in zip(files, scan_metadata_usage(files, workers=workers)) if uses]
+    with phase("static_analyze"):
+        tests, skipped = analyze(files, root)
+    for msg in skipped:
+        log.warning("Skipping %s", msg)
+    return register(tests, cfg)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the testcase import xml from the test sources, offline")
+    parser.add_argument("project", help="Directory with the tests")
+    parser.add_argument("-r", "--root", help="sys.path entry the tests are imported from", default=None)
+    parser.add_argument("-w", "--workers", type=int, default=None, help="processes used to scan files")
+    parser.add_argument("--no-xml", action="store_true", default=False, help="Only update the mapping")
+    opts = parser.parse_args()
+
+    import_list = scan_project(opts.project, opts.root, opts.workers)
+    MetaData.flush()
+    if not opts.no_xml:
+        for project, path in generate_import_xml(import_list).items():
+            print("{}: {}".format(project, path))
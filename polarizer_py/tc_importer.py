@@ -1,22 +1,43 @@
 from polarizer_py.utils import launch
+from polarizer_py.jar_cache import DEFAULT_BUILD, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, JarCache, build_jar
 from polarizer_py.json_files import tcargs
+from polarizer_py.logger import glob_logger as log
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List, Sequence, Tuple, Union
 import os
 import shutil
 import json
+import time
 from pprint import pprint
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
 import argparse
 
+MAPPER_URL = "http://rhsm-cimetrics2.usersys.redhat.com:9000/testcase/mapper"
+# Responses worth retrying: the service (or a proxy in front of it) is restarting or overloaded
+RETRY_STATUSES = (502, 503, 504)
 
-def git_compile(branch: str):
+
+def git_compile(branch: str, build: Sequence[str] = DEFAULT_BUILD, cache: JarCache = None,
+                timeout: float = None) -> str:
+    """
+    Checks out branch and returns the path to its uberjar, which is only rebuilt if cache has no jar for the tree
+
+    :param branch: the branch to check out
+    :param build: shell commands that build the jar
+    :param cache: optional JarCache
+    :param timeout: seconds each build command may run before it is killed, or None to wait for it
+    :return: path to the standalone jar
+    """
     git_cmd = "git checkout {}".format(branch)
-    launch(git_cmd)
-    launch("lein clean")
-    launch("lein uberjar")
+    launch(git_cmd, timeout=None)
+    return build_jar(os.getcwd(), build=build, cache=cache, timeout=timeout)
 
 
-def create_tc_args(config, argpath: str):
-    config["project"] = "RHEL6"
+def create_tc_args(config, argpath: str, project: str = "RHEL6"):
+    config["project"] = project
     config["testcase"]["enabled"] = os.environ["IMPORTER_ENABLED"]
     with open(argpath, 'w') as tc_args:
         tc = json.dumps(config, indent=2)
@@ -33,29 +54,165 @@ def call_curl(tcargs_path: str, jarpath: str, mapping_path: str):
     print("Calling " + cmd)
 
     # The synchronous version
-    return launch(cmd, shell=True)
+    return launch(cmd, shell=True, timeout=None)
+
+
+class ImportJob(dict):
+    """The three files sent for one testcase import (usually one per project)"""
+    def __init__(self, tcargs_path: str, jarpath: str, mapping_path: str):
+        super().__init__(tcargs=tcargs_path, jar=jarpath, mapping=mapping_path)
+
+
+class ImporterClient:
+    """
+    Client for the polarizer /testcase/mapper endpoint.
+
+    Every import is a multipart upload of the tcargs, mapping and uberjar files.  The body is streamed from disk with
+    a MultipartEncoder, so the jar is never loaded into memory, and all requests go through one requests.Session whose
+    connection pool is reused across imports.  Several imports can run concurrently with import_many.
+
+    Connection errors, timeouts and 502/503/504 responses are retried with exponential backoff.  This is done here
+    rather than with a urllib3 Retry, because a streamed body can't be rewound: every attempt reopens the files.
+    """
+    def __init__(self,
+                 url: str = MAPPER_URL,
+                 pool_size: int = 4,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 timeout: Tuple[float, float] = (10, 600)):
+        """
+        :param url: url of the /testcase/mapper endpoint
+        :param pool_size: number of connections kept open to the server
+        :param retries: how many times a failed import is retried
+        :param backoff: seconds to wait before the first retry, doubled for each retry after that
+        :param timeout: (connect, read) timeouts in seconds
+        """
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
+    def close(self) -> None:
+        self.session.close()
 
-def call_curl_req(tcargs_path, jarpath, mapping_path):
-    files = {"tcargs": ('tcargs.json', open(tcargs_path, 'rb'), 'application/json'),
-             "mapping": ('mapping.json', open(mapping_path, 'rb'), 'application/json'),
-             "jar": ('sm-1.1.0-SNAPSHOT-standalone.jar', open(jarpath, 'rb'), 'application/java-archive')}
-    r = requests.post('http://rhsm-cimetrics2.usersys.redhat.com:9000/testcase/mapper', files=files)
-    return r
+    def _post(self, job: ImportJob) -> requests.Response:
+        with ExitStack() as files:
+            fields = {"tcargs": ("tcargs.json", files.enter_context(open(job["tcargs"], "rb")), "application/json"),
+                      "mapping": ("mapping.json", files.enter_context(open(job["mapping"], "rb")),
+                                  "application/json"),
+                      "jar": (os.path.basename(job["jar"]), files.enter_context(open(job["jar"], "rb")),
+                              "application/java-archive")}
+            body = MultipartEncoder(fields=fields)
+            return self.session.post(self.url, data=body, headers={"Content-Type": body.content_type},
+                                     timeout=self.timeout)
+
+    def import_testcases(self, tcargs_path: str, jarpath: str, mapping_path: str) -> requests.Response:
+        """
+        Uploads the files to the mapper endpoint, retrying on read errors and 502/503/504 responses
+
+        :param tcargs_path: path to the tcargs json file
+        :param jarpath: path to the uberjar
+        :param mapping_path: path to the current mapping.json
+        :return: the response (possibly an error response, once retries are exhausted)
+        """
+        job = ImportJob(tcargs_path, jarpath, mapping_path)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                resp = self._post(job)
+                if resp.status_code not in RETRY_STATUSES or attempt > self.retries:
+                    return resp
+                reason = "HTTP {}".format(resp.status_code)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                if attempt > self.retries:
+                    raise
+                reason = str(ex)
+            wait = self.backoff * 2 ** (attempt - 1)
+            log.warning("Import of %s failed (%s), retrying in %ss", tcargs_path, reason, wait)
+            time.sleep(wait)
+
+    def import_many(self,
+                    jobs: Sequence[Union[ImportJob, Tuple[str, str, str]]],
+                    max_workers: int = 4) -> List[Union[requests.Response, Exception]]:
+        """
+        Runs several imports concurrently (eg one per project)
+
+        :param jobs: ImportJobs, or (tcargs_path, jarpath, mapping_path) tuples
+        :param max_workers: maximum number of imports running at the same time
+        :return: the response for each job, in the same order, or the exception if it failed
+        """
+        def run(job):
+            if isinstance(job, dict):
+                job = (job["tcargs"], job["jar"], job["mapping"])
+            try:
+                return self.import_testcases(*job)
+            except Exception as ex:
+                log.error("Import of %s failed: %s", job[0], ex)
+                return ex
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(run, jobs))
+
+
+def call_curl_req(tcargs_path, jarpath, mapping_path, url: str = MAPPER_URL):
+    with ImporterClient(url=url) as client:
+        return client.import_testcases(tcargs_path, jarpath, mapping_path)
+
+
+def merge_mappings(mappings: Sequence[Dict]) -> Dict:
+    """
+    Combines the mappings returned by several project imports.  For the same testcase and project, an entry with an id
+    wins over one without, otherwise the later mapping wins
+    """
+    merged = {}
+    for mapping in mappings:
+        for name, projects in mapping.items():
+            entries = merged.setdefault(name, {})
+            for project, entry in projects.items():
+                # The response for one project still carries the other projects' entries, without their new ids
+                if project not in entries or entry.get("id"):
+                    entries[project] = entry
+    return merged
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Script to make testcase import")
     parser.add_argument("-m", "--new-mapping-path", help="Path to the new mapping.json file")
     parser.add_argument("-t", "--test", help="If true, clone rhsm-qe to /tmp", action="store_true", default=True)
+    parser.add_argument("-u", "--url", help="url of the testcase mapper endpoint", default=MAPPER_URL)
+    parser.add_argument("-p", "--project", help="Project to import to (may be given several times)",
+                        action="append", default=None)
+    parser.add_argument("-w", "--workers", help="Number of project imports to run concurrently", type=int, default=4)
+    parser.add_argument("--retries", help="Number of times to retry a failed import", type=int, default=3)
+    parser.add_argument("--timeout", help="Seconds to wait for the server's response", type=float, default=600)
+    parser.add_argument("-b", "--build-cmd", help="Shell command to build the jar (may be given several times)",
+                        action="append", default=None)
+    parser.add_argument("--jar-cache", help="Directory of the built jar cache", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--jar-cache-max-bytes", help="Maximum size of the jar cache", type=int,
+                        default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--build-timeout", help="Seconds each build command may run (default: no limit)", type=float,
+                        default=None)
+    parser.add_argument("--no-jar-cache", help="Always rebuild the jar", action="store_true", default=False)
     opts = parser.parse_args()
+    projects = opts.project or ["RHEL6"]
 
     if opts.test:
         if os.path.exists("/tmp/rhsm-qe"):
             shutil.rmtree("/tmp/rhsm-qe")
         os.chdir("/tmp")
         if not os.path.exists("/tmp/rhsm-qe"):
-            launch("git clone https://github.com/rarebreed/rhsm-qe.git")
+            launch("git clone https://github.com/rarebreed/rhsm-qe.git", timeout=None)
         os.chdir("/tmp/rhsm-qe")
 
     if 'WORKSPACE' not in os.environ:
@@ -69,20 +226,31 @@ if __name__ == "__main__":
         print(tc)
         os.environ["TC_IMPORT_CFG"] = tc
 
-    # Clean and compile
-    git_compile(os.environ["RHSMQE_BRANCH"])
-
-    JAR_NAME = launch("ls {}/target | grep standalone".format(os.getcwd()), shell=True)[0].strip()
-    UBERJAR_PATH = "{}/target/{}".format(os.getcwd(), JAR_NAME)
+    # Clean and compile, unless the jar for this tree is already cached
+    jar_cache = None if opts.no_jar_cache else JarCache(opts.jar_cache, opts.jar_cache_max_bytes)
+    UBERJAR_PATH = git_compile(os.environ["RHSMQE_BRANCH"], build=opts.build_cmd or DEFAULT_BUILD, cache=jar_cache,
+                               timeout=opts.build_timeout)
     MAPPING_JSON_PATH = "{}/mapping.json".format(os.getcwd())
-    TC_ARGS_PATH = "{}/tcargs.json".format(os.environ["WORKSPACE"])
+    jobs = []
+    for project in projects:
+        name = "tcargs.json" if len(projects) == 1 else "tcargs-{}.json".format(project)
+        TC_ARGS_PATH = "{}/{}".format(os.environ["WORKSPACE"], name)
+        create_tc_args(tcargs, TC_ARGS_PATH, project)
+        jobs.append(ImportJob(TC_ARGS_PATH, UBERJAR_PATH, MAPPING_JSON_PATH))
 
-    create_tc_args(tcargs, TC_ARGS_PATH)
-    resp = call_curl_req(TC_ARGS_PATH, UBERJAR_PATH, MAPPING_JSON_PATH)
+    with ImporterClient(url=opts.url, pool_size=opts.workers, retries=opts.retries,
+                        timeout=(10, opts.timeout)) as client:
+        responses = client.import_many(jobs, max_workers=opts.workers)
 
-    jresp = json.loads(resp.text)
-    mapping = jresp["mapping"]
-    pprint(jresp, indent=2)
+    mappings = []
+    for project, resp in zip(projects, responses):
+        if isinstance(resp, Exception):
+            raise SystemExit("Import for {} failed: {}".format(project, resp))
+        resp.raise_for_status()
+        jresp = resp.json()
+        pprint(jresp, indent=2)
+        mappings.append(jresp["mapping"])
+    mapping = merge_mappings(mappings)
 
     with open(opts.new_mapping_path, "w") as new_map:
         new_map.write(json.dumps(mapping, indent=2, sort_keys=True))
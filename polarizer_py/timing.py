@@ -0,0 +1,149 @@
+"""
+Timers and counters for the phases of the @metadata pipeline (loading the definitions, merging metadata, writing the
+mapping, generating the import xml...), aggregated per process.
+
+Timing is off by default, and then each instrumented phase only costs an attribute check.  Turn it on with the
+environment variable POLARIZER_TIMING=1, or by calling enable().  At exit, a summary table is printed to stderr and a
+json report, including the slowest decorated tests, is written to POLARIZER_TIMING_REPORT (by default
+/tmp/polarizer-timing-<pid>.json).
+
+    with phase("get_metadata"):
+        ...
+"""
+
+import atexit
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+POLARIZER_TIMING = "POLARIZER_TIMING"
+POLARIZER_TIMING_REPORT = "POLARIZER_TIMING_REPORT"
+POLARIZER_TIMING_TOP = "POLARIZER_TIMING_TOP"
+
+
+class _Null:
+    """A reusable context manager which does nothing, returned by the timers when timing is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class Timings:
+    """
+    Accumulates, for every phase, how many times it ran and its total and longest time, and the total time spent
+    decorating each test.  Phases can nest, and each one is timed inclusively of the phases inside it
+    """
+    def __init__(self):
+        self.enabled = False
+        self.report_path = None
+        self.top = 10
+        self.phases = {}
+        self.tests = {}
+        self._registered = False
+
+    def enable(self, report_path: str = None, top: int = 10) -> None:
+        """
+        Starts collecting timings, and reporting them at exit
+
+        :param report_path: where to write the json report (None for /tmp/polarizer-timing-<pid>.json)
+        :param top: how many of the slowest tests to report
+        """
+        self.enabled = True
+        self.report_path = report_path
+        self.top = top
+        if not self._registered:
+            atexit.register(self._at_exit)
+            self._registered = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        self.phases.clear()
+        self.tests.clear()
+
+    def record(self, name: str, elapsed: float) -> None:
+        stats = self.phases.get(name)
+        if stats is None:
+            self.phases[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    @contextmanager
+    def _timer(self, name: str, test: bool):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if test:
+                self.tests[name] = self.tests.get(name, 0.0) + elapsed
+            else:
+                self.record(name, elapsed)
+
+    def phase(self, name: str):
+        """Context manager timing one run of the phase called name"""
+        if not self.enabled:
+            return _NULL
+        return self._timer(name, False)
+
+    def test(self, qname: str):
+        """Context manager timing the decoration of the test qname"""
+        if not self.enabled:
+            return _NULL
+        return self._timer(qname, True)
+
+    def report(self) -> Dict:
+        slowest = sorted(self.tests.items(), key=lambda item: item[1], reverse=True)[:self.top]
+        return {"pid": os.getpid(),
+                "tests": len(self.tests),
+                "phases": {name: {"count": count, "total": total, "mean": total / count, "max": longest}
+                           for name, (count, total, longest) in self.phases.items()},
+                "slowest-tests": [{"name": name, "seconds": seconds} for name, seconds in slowest]}
+
+    def summary(self) -> str:
+        """The phases as a table, slowest total first, followed by the slowest tests"""
+        lines = ["{:<28} {:>8} {:>11} {:>11} {:>11}".format("phase", "count", "total ms", "mean ms", "max ms")]
+        for name, (count, total, longest) in sorted(self.phases.items(), key=lambda item: item[1][1],
+                                                     reverse=True):
+            lines.append("{:<28} {:>8} {:>11.2f} {:>11.3f} {:>11.3f}".format(name, count, total * 1000,
+                                                                          total / count * 1000, longest * 1000))
+        if self.tests:
+            lines.append("slowest of {} decorated tests:".format(len(self.tests)))
+            for entry in self.report()["slowest-tests"]:
+                lines.append("  {:>9.3f} ms  {}".format(entry["seconds"] * 1000, entry["name"]))
+        return "\n".join(lines)
+
+    def write_report(self, path: str = None) -> str:
+        import json
+
+        path = path or self.report_path or "/tmp/polarizer-timing-{}.json".format(os.getpid())
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+    def _at_exit(self) -> None:
+        if not self.enabled or not (self.phases or self.tests):
+            return
+        path = self.write_report()
+        print(self.summary(), file=sys.stderr)
+        print("Timing report written to {}".format(path), file=sys.stderr)
+
+
+timings = Timings()
+phase = timings.phase
+enable = timings.enable
+disable = timings.disable
+
+if os.environ.get(POLARIZER_TIMING, "0") not in ("", "0"):
+    enable(os.environ.get(POLARIZER_TIMING_REPORT), int(os.environ.get(POLARIZER_TIMING_TOP, 10)))
@@ -1,120 +1,673 @@
 from pathlib import Path
+import ast
+import asyncio
 import os
-from modulefinder import ModuleFinder
-from typing import Generator, Union, Sequence
-from subprocess import Popen, PIPE, STDOUT
-import time
+import signal
+from typing import Callable, Dict, Generator, List, Tuple, Union, Sequence
+from subprocess import PIPE, STDOUT
 import shutil
 
+# Longest line of subprocess output that can be read (asyncio's default is 64KiB)
+STREAM_LIMIT = 1 << 20
+# Seconds between terminating a timed out command and killing it
+KILL_GRACE = 5
+
 def get_file_dir(fd: str, up: int=1) -> Path:
     p = Path(fd)
     return Path(*p.parts[:-up])
 
 
-def recurse(start: Path=None, get_dirs=False, excludes: Sequence[str]=None) -> Generator[Path, None, None]:
+# Excluded at every depth by find_all_py_files unless other excludes are given
+DEFAULT_EXCLUDES = (".git/", "venv/", ".venv/", "node_modules/", "__pycache__/", ".tox/")
+
+
+class Excludes:
+    """
+    A set of gitignore-style exclude patterns, matched against paths relative to the directory being walked:
+
+    - a pattern without a slash (eg venv, *.pyc) matches a file or directory of that name at any depth
+    - a pattern containing a slash (eg build/lib, /docs) matches the relative path from the top, with fnmatch
+      wildcards, where ** spans any number of directories
+    - a trailing slash (eg venv/) only matches directories
+    - a leading ! re-includes what an earlier pattern excluded
+    """
+    def __init__(self, patterns: Sequence[str] = ()):
+        import re
+
+        self.rules = []
+        for pattern in patterns:
+            negate = pattern.startswith("!")
+            pattern = pattern[1:] if negate else pattern
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            self.rules.append((re.compile(self._translate(pattern.lstrip("/"))), negate, dir_only, anchored))
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        """Like fnmatch.translate, except that only ** matches across slashes"""
+        import re
+
+        parts = []
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+            elif pattern.startswith("**", i):
+                parts.append(".*")
+                i += 2
+            elif pattern[i] == "*":
+                parts.append("[^/]*")
+                i += 1
+            elif pattern[i] == "?":
+                parts.append("[^/]")
+                i += 1
+            elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+                end = pattern.index("]", i + 2)
+                body = pattern[i + 1:end]
+                parts.append("[^" + body[1:] + "]" if body.startswith("!") else "[" + body + "]")
+                i = end + 1
+            else:
+                parts.append(re.escape(pattern[i]))
+                i += 1
+        return "".join(parts) + r"\Z"
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, rel: str, name: str, is_dir: bool) -> bool:
+        """
+        :param rel: path relative to the top of the walk, with / separators
+        :param name: the last component of rel
+        :param is_dir: whether it is a directory
+        :return: True if the path is excluded
+        """
+        excluded = False
+        for regex, negate, dir_only, anchored in self.rules:
+            if excluded is negate and (is_dir or not dir_only) and regex.match(rel if anchored else name):
+                excluded = not negate
+        return excluded
+
+
+class DirManifest:
+    """
+    A cache of directory listings keyed by each directory's mtime.  A directory's mtime changes whenever entries are
+    added to, removed from or renamed in it, so a listing is reused as long as the mtime is the same, and a repeat
+    walk only has to stat the directories rather than list them.
+
+    The manifest can be persisted to a json file, to speed up scans across runs.
+    """
+    # Listings of directories modified less than this many seconds ago aren't cached, since another change within
+    # the filesystem's timestamp granularity would go unnoticed
+    MIN_AGE = 2
+
+    def __init__(self, path: str = None):
+        """
+        :param path: optional json file the manifest is loaded from and saved to
+        """
+        import json
+
+        self.path = path
+        self.dirs = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.dirs = {d: tuple(entry) for d, entry in json.load(f).items()}
+            except (OSError, ValueError):
+                self.dirs = {}
+
+    def listing(self, dirpath: str) -> Tuple[List[str], List[str]]:
+        """Returns the (file names, directory names) in dirpath"""
+        import time
+
+        mtime = os.stat(dirpath).st_mtime_ns
+        entry = self.dirs.get(dirpath)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        files, dirs = _list_dir(dirpath)
+        if time.time_ns() - mtime > self.MIN_AGE * 10 ** 9:
+            self.dirs[dirpath] = (mtime, files, dirs)
+        else:
+            self.dirs.pop(dirpath, None)
+        return files, dirs
+
+    def save(self, path: str = None) -> None:
+        """Atomically writes the manifest to path (defaults to the path it was loaded from)"""
+        import json
+        import tempfile
+
+        path = path or self.path
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.dirs, f)
+        os.replace(tmp, path)
+
+
+def _list_dir(dirpath: str) -> Tuple[List[str], List[str]]:
+    """
+    Returns the (file names, directory names) in dirpath.  The type comes from the DirEntry, which usually needs no
+    extra stat call.  Symlinks to directories are not followed, so the walk can't loop
+    """
+    files, dirs = [], []
+    with os.scandir(dirpath) as it:
+        for de in it:
+            if de.is_dir(follow_symlinks=False):
+                dirs.append(de.name)
+            elif de.is_file():
+                files.append(de.name)
+    return files, dirs
+
+
+def walk(start: str = None,
+         excludes: Sequence[str] = (),
+         get_dirs: bool = False,
+         workers: int = 1,
+         manifest: DirManifest = None) -> Generator[str, None, None]:
+    """
+    Yields the paths of all files (and optionally directories) under start, skipping anything that matches excludes.
+    Excluded directories are not descended into.
+
+    The tree is walked one level at a time.  With workers > 1, the directories of a level are listed concurrently on
+    a thread pool (scandir releases the GIL, so this helps on network filesystems and cold caches).
+
+    :param start: the directory to walk, defaults to the current directory
+    :param excludes: gitignore-style patterns (see Excludes)
+    :param get_dirs: also yield directories
+    :param workers: number of threads listing directories
+    :param manifest: optional DirManifest, so unchanged directories aren't listed again
+    :return:
+    """
+    if start is None:
+        start = os.getcwd()
+    start = str(start)
+    if not isinstance(excludes, Excludes):
+        excludes = Excludes(excludes or ())
+    list_dir = manifest.listing if manifest is not None else _list_dir
+
+    def listing(dirpath):
+        try:
+            return list_dir(dirpath)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return [], []
+
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        level = [(start, "")]
+        while level:
+            results = pool.map(listing, [d for d, _ in level]) if pool else map(listing, [d for d, _ in level])
+            next_level = []
+            for (dirpath, rel), (files, dirs) in zip(level, results):
+                for name in files:
+                    if not excludes or not excludes.match(rel + name, name, False):
+                        yield os.path.join(dirpath, name)
+                for name in dirs:
+                    if excludes and excludes.match(rel + name, name, True):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    if get_dirs:
+                        yield path
+                    next_level.append((path, rel + name + "/"))
+            level = next_level
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+def recurse(start: Path=None, get_dirs=False, excludes: Sequence[str]=None, workers: int = 1,
+            manifest: DirManifest = None) -> Generator[Path, None, None]:
     """
     Helper function to return all files from a given start directory
 
-    :param excludes:
-    :param get_dirs:
+    :param excludes: gitignore-style patterns of files and directories to skip, at any depth (see Excludes)
+    :param get_dirs: also return the directories
     :param start:
+    :param workers: number of threads listing directories
+    :param manifest: optional DirManifest caching directory listings
     :return:
     """
-    if excludes is None:
-        excludes = []
-    if start is None: start = Path(os.getcwd())
-    for i in start.iterdir():
-        if i.is_file():
-            yield i
-        if i.is_dir():
-            if get_dirs:
-                yield i
-            if i.name not in excludes:
-                yield from recurse(start=i)
+    return (Path(p) for p in walk(start, excludes=excludes or (), get_dirs=get_dirs, workers=workers,
+                                  manifest=manifest))
+
+
+def find_all_py_files(start: str, excludes: Sequence[str] = DEFAULT_EXCLUDES, workers: int = 1,
+                      manifest: DirManifest = None) -> Generator[Path, None, None]:
+    return (Path(p) for p in walk(start, excludes=excludes or (), workers=workers, manifest=manifest)
+            if p.endswith(".py"))
+
 
+METADATA_MODULE = "polarizer_py.metadata"
+# Below this many files to parse, starting a process pool costs more than it saves
+POOL_THRESHOLD = 64
 
-def find_all_py_files(start: str, excludes=None) -> Generator[Path, None, None]:
-    return (p for p in recurse(start=Path(start), excludes=excludes) if str(p).endswith(".py"))
+
+def _is_metadata_decorator(node) -> bool:
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Name):
+        return node.id == "metadata"
+    return (isinstance(node, ast.Attribute) and node.attr == "metadata" and
+            isinstance(node.value, ast.Name) and node.value.id in ("MetaData", "metadata"))
+
+
+def source_uses_metadata(source: Union[str, bytes]) -> bool:
+    """
+    Returns True if the python source imports polarizer_py.metadata (or metadata relative to the polarizer_py package)
+    or decorates anything with @metadata or @MetaData.metadata.  Files which don't parse are reported as False.
+    """
+    if (b"metadata" if isinstance(source, bytes) else "metadata") not in source:
+        return False
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name == METADATA_MODULE or alias.name.startswith(METADATA_MODULE + ".")
+                   for alias in node.names):
+                return True
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            if module == METADATA_MODULE or (node.level and module == "metadata"):
+                return True
+            if (module == "polarizer_py" or (node.level and not module)) and \
+                    any(alias.name == "metadata" for alias in node.names):
+                return True
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if any(_is_metadata_decorator(d) for d in node.decorator_list):
+                return True
+    return False
 
 
 def imports_metadata(path: Union[str, Path]) -> bool:
-    mf = ModuleFinder()
-    if isinstance(path, Path):
-        path = str(path)
-    mf.run_script(path)
-    modules = list(mod for name, mod in mf.modules.items() if "metadata" in name)
-    if modules:
-        return True
+    with open(str(path), "rb") as src:
+        return source_uses_metadata(src.read())
+
+
+def _load_scan_cache(path: str) -> Dict[str, bool]:
+    import json
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_scan_cache(path: str, cache: Dict[str, bool]) -> None:
+    import json
+    import tempfile
+
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def scan_metadata_usage(paths: Sequence[Union[str, Path]],
+                        workers: int = None,
+                        cache: Dict[str, bool] = None) -> List[bool]:
+    """
+    Runs source_uses_metadata over many files, in a process pool when there are enough of them
+
+    :param paths: the python files
+    :param workers: number of processes (defaults to the number of CPUs, 1 to parse in this process)
+    :param cache: optional dict of sha1 of the file contents to result.  It is checked first, and updated
+    :return: the result for each path, in order
+    """
+    import hashlib
+
+    if cache is None:
+        cache = {}
+    results = [None] * len(paths)
+    todo = []
+    for i, path in enumerate(paths):
+        with open(str(path), "rb") as src:
+            source = src.read()
+        digest = hashlib.sha1(source).hexdigest()
+        if digest in cache:
+            results[i] = cache[digest]
+        else:
+            todo.append((i, digest, source))
+
+    workers = workers or os.cpu_count() or 1
+    sources = [source for _, _, source in todo]
+    if workers > 1 and len(todo) >= POOL_THRESHOLD:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            found = list(pool.map(source_uses_metadata, sources, chunksize=max(1, len(todo) // (workers * 4))))
     else:
-        return False
+        found = [source_uses_metadata(source) for source in sources]
+    for (i, digest, _), uses in zip(todo, found):
+        results[i] = cache[digest] = uses
+    return results
 
 
-def run(project: str):
-    modules = filter(imports_metadata, find_all_py_files(project, excludes=["venv"]))
+def run(project: str, workers: int = None, cache_path: str = None) -> List[Path]:
+    """
+    Returns (and prints) the python files in project which use polarizer_py.metadata
+
+    :param project: directory to scan
+    :param workers: number of processes parsing files
+    :param cache_path: optional json file caching the result for each file content hash across runs
+    :return:
+    """
+    files = list(find_all_py_files(project))
+    cache = _load_scan_cache(cache_path) if cache_path else {}
+    modules = [f for f, uses in zip(files, scan_metadata_usage(files, workers=workers, cache=cache)) if uses]
+    if cache_path:
+        _save_scan_cache(cache_path, cache)
     for i in modules:
         print(i)
     return modules
 
 
-def launch(cmd: str, env=None, cwd=None, shell=False, timeout: int = 300):
+async def run_async(cmd: Union[str, Sequence[str]],
+                    env=None,
+                    cwd=None,
+                    shell=False,
+                    timeout: float = 300,
+                    on_line: Callable[[str], None] = print) -> Tuple[str, int]:
+    """
+    Runs cmd as a subprocess, calling on_line with each line of its output (stdout and stderr interleaved) as soon as
+    it is written.  The command runs in its own process group, and if it hasn't finished after timeout seconds the
+    whole group (including any children it spawned) is terminated, then killed if it still hasn't exited.
+
+    :param cmd: the command, either a string or a list of arguments
+    :param env: environment of the command (defaults to os.environ)
+    :param cwd: working directory (defaults to the current directory)
+    :param shell: run cmd through the shell
+    :param timeout: seconds before the command is killed, or None to wait forever
+    :param on_line: called with every line of output, without the trailing newline.  None to only collect the output
+    :return: (all the output, return code).  The return code is negative (-signal) if the command was killed
+    """
     if env is None:
         env = os.environ
     if cwd is None:
         cwd = os.getcwd()
     if isinstance(cmd, str) and shell is False:
-        cmd = cmd.split(" ")
-        cmd = list(filter(lambda x: x != '', cmd))
+        cmd = list(filter(lambda x: x != '', cmd.split(" ")))
     print("Executing command {}".format(cmd))
 
-    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT, env=env, cwd=cwd, shell=shell)
-    out, err = proc.communicate()
-    ret = proc.poll()
-    if ret is not None and ret != 0:
+    kwargs = dict(stdout=PIPE, stderr=STDOUT, env=env, cwd=cwd, start_new_session=True, limit=STREAM_LIMIT)
+    if shell:
+        proc = await asyncio.create_subprocess_shell(cmd, **kwargs)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+    lines = []
+
+    async def read():
+        async for raw in proc.stdout:
+            line = raw.decode("utf-8", errors="replace")
+            lines.append(line)
+            if on_line is not None:
+                on_line(line.rstrip("\n"))
+        await proc.wait()
+
+    reader = asyncio.ensure_future(read())
+    try:
+        try:
+            await asyncio.wait_for(asyncio.shield(reader), timeout)
+        except asyncio.TimeoutError:
+            print("Command '{}' timed out after {}s, killing it".format(cmd, timeout))
+            _killpg(proc, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(asyncio.shield(reader), KILL_GRACE)
+            except asyncio.TimeoutError:
+                _killpg(proc, signal.SIGKILL)
+                await reader
+    except BaseException:
+        # Interrupted (a Ctrl-C in the terminal doesn't reach the command, which has its own session), cancelled, or the
+        # output couldn't be read (eg a line longer than STREAM_LIMIT): don't leave the command running
+        reader.cancel()
+        await _stop(proc)
+        raise
+
+    ret = proc.returncode
+    if ret != 0:
         print("Command Failed. Return code = {}".format(ret))
+    return "".join(lines), ret
+
+
+def _killpg(proc, sig) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _stop(proc) -> None:
+    """Terminates proc's process group, and kills it if it hasn't exited after KILL_GRACE seconds"""
+    _killpg(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), KILL_GRACE)
+    except BaseException:
+        _killpg(proc, signal.SIGKILL)
+
+
+async def run_many_async(cmds: Sequence[Union[str, Sequence[str]]],
+                         workers: int = 4,
+                         **kwargs) -> List[Tuple[str, int]]:
+    """
+    Runs the commands concurrently, at most workers at a time.  Output lines are prefixed with the command's index.
+
+    :param cmds: the commands to run
+    :param workers: maximum number of commands running at once
+    :param kwargs: passed on to run_async (env, cwd, shell, timeout, on_line)
+    :return: the (output, return code) of each command, in the same order as cmds
+    """
+    slots = asyncio.Semaphore(workers)
+    on_line = kwargs.pop("on_line", print)
+
+    async def run_one(i, cmd):
+        prefixed = None if on_line is None else (lambda line: on_line("[{}] {}".format(i, line)))
+        async with slots:
+            return await run_async(cmd, on_line=prefixed, **kwargs)
+
+    return list(await asyncio.gather(*(run_one(i, cmd) for i, cmd in enumerate(cmds))))
+
+
+def _run_in_new_loop(coro):
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(coro)
+    try:
+        return loop.run_until_complete(task)
+    except BaseException:
+        # A KeyboardInterrupt escapes run_until_complete without reaching the task, so cancel it and let it clean up
+        # (run_async kills its command) before re-raising
+        if not task.done():
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except BaseException:
+                pass
+        raise
+    finally:
+        loop.close()
+
+
+def launch(cmd: str, env=None, cwd=None, shell=False, timeout: int = 300, on_line: Callable[[str], None] = print):
+    """
+    Synchronous version of run_async: runs cmd, streaming its output to on_line, and returns (output, return code).
+    The command's process group is killed after timeout seconds, so pass timeout=None for long builds or clones
+    """
+    return _run_in_new_loop(run_async(cmd, env=env, cwd=cwd, shell=shell, timeout=timeout, on_line=on_line))
+
+
+def run_many(cmds: Sequence[Union[str, Sequence[str]]], workers: int = 4, **kwargs) -> List[Tuple[str, int]]:
+    """
+    Synchronous version of run_many_async
+    """
+    return _run_in_new_loop(run_many_async(cmds, workers=workers, **kwargs))
+
+
+Rule = Tuple[str, str]
+
+
+def _compile_rules(rules: Sequence[Rule], regex: bool = False) -> List[Tuple[Callable, Callable]]:
+    """
+    Turns (pattern, replacement) rules into (test, substitute) functions on bytes.  test(buffer) tells if the
+    pattern occurs in buffer (a bytes or mmap), substitute(line) returns (new line, number of replacements)
+    """
+    import re
+
+    compiled = []
+    for pattern, replacement in rules:
+        if regex:
+            rx = re.compile(pattern.encode("utf-8"))
+            repl = replacement.encode("utf-8")
+            compiled.append((rx.search, lambda line, rx=rx, repl=repl: rx.subn(repl, line)))
+        else:
+            old, new = pattern.encode("utf-8"), replacement.encode("utf-8")
+            compiled.append((lambda buf, old=old: buf.find(old) != -1,
+                             lambda line, old=old, new=new: (line.replace(old, new), line.count(old))))
+    return compiled
+
+
+def _has_match(path: str, compiled: Sequence[Tuple[Callable, Callable]]) -> bool:
+    """Pre-scan of the file, through mmap so that files without a match are never read into memory"""
+    import mmap
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return any(test(mm) for test, _ in compiled)
+
+
+def rewrite_file(path: str, rules: Sequence[Rule], regex: bool = False, dry_run: bool = False,
+                 _compiled: Sequence = None) -> int:
+    """
+    Applies every rule, in order, to each line of the file at path.  The file is streamed line by line into a
+    temporary file in the same directory which then replaces it, so it is never half written.  Patterns are matched
+    within a line; they can't span lines.
+
+    :param path: file to rewrite
+    :param rules: (pattern, replacement) pairs.  Plain strings, or regular expressions if regex is True
+    :param regex: treat patterns as regular expressions (replacements may then use group references like \\1)
+    :param dry_run: only count the replacements, don't change the file
+    :return: the number of replacements made (or that would be made)
+    """
+    import tempfile
+
+    compiled = _compiled or _compile_rules(rules, regex)
+    if not _has_match(path, compiled):
+        return 0
+
     count = 0
-    while ret is None and count < timeout:
-        time.sleep(5)
-        count += 5
-        print("waiting for command '{}' to finish: {}".format(cmd, count))
-    output = out.decode(encoding='utf-8')
-    print(output)
-    return output, proc.returncode
-
-
-def remove(substr: str, replace: str,  file: str, tmp: str):
-    print("in file {}".format(file))
-    with open(file, "r") as java:
-        with open(tmp, "w") as temp:
-            for i, line in enumerate(java.readlines()):
-                if substr in line:
-                    newline = line.replace(substr, replace)
-                    print("Removing {} from {}".format(substr, line))
-                    print("line {} is now: {}".format(i, newline))
-                    temp.write(newline)
-                else:
-                    temp.write(line)
-
-    shutil.move(tmp, file)
+    out = None
+    if not dry_run:
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", prefix=".{}.".format(os.path.basename(path)),
+                                   dir=os.path.dirname(os.path.abspath(path)))
+        out = os.fdopen(fd, "wb")
+    try:
+        with open(path, "rb") as src:
+            for line in src:
+                for _, substitute in compiled:
+                    line, n = substitute(line)
+                    count += n
+                if out is not None:
+                    out.write(line)
+        if out is not None:
+            out.close()
+            if count:
+                shutil.copymode(path, tmp)
+                os.replace(tmp, path)
+            else:
+                os.unlink(tmp)
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.unlink(tmp)
+        raise
+    return count
+
+
+def _rewrite_task(args) -> Tuple[str, int]:
+    path, rules, regex, dry_run = args
+    return path, rewrite_file(path, rules, regex, dry_run)
+
+
+def rewrite(pattern: str,
+            rules: Sequence[Rule],
+            start: str = None,
+            regex: bool = False,
+            dry_run: bool = False,
+            workers: int = None,
+            processes: bool = False,
+            excludes: Sequence[str] = DEFAULT_EXCLUDES) -> Dict[str, int]:
+    """
+    Applies the rules to every file under start matching the glob pattern (eg "**/*.java"), on a pool
+
+    :param pattern: glob relative to start, ** matches any number of directories
+    :param rules: (pattern, replacement) pairs, applied in order
+    :param start: directory to search, defaults to the current directory
+    :param regex: the rule patterns are regular expressions
+    :param dry_run: only count what would be replaced
+    :param workers: size of the pool (defaults to the number of CPUs)
+    :param processes: use a process pool instead of threads (helps with many regex rules)
+    :param excludes: gitignore-style patterns of files and directories to skip (see Excludes)
+    :return: the number of replacements in each file that had any
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    start = start or os.getcwd()
+    match = Excludes([pattern if "/" in pattern.rstrip("/") else "**/" + pattern])
+    paths = [p for p in walk(start, excludes=excludes)
+             if match.match(os.path.relpath(p, start).replace(os.sep, "/"), os.path.basename(p), False)]
+    workers = workers or os.cpu_count() or 1
+
+    if processes and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_rewrite_task, [(p, rules, regex, dry_run) for p in paths],
+                               chunksize=max(1, len(paths) // (workers * 4)))
+            return {path: n for path, n in results if n}
+
+    compiled = _compile_rules(rules, regex)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(lambda p: rewrite_file(p, rules, regex, dry_run, _compiled=compiled), paths)
+        return {path: n for path, n in zip(paths, counts) if n}
+
+
+def remove(substr: str, replace: str,  file: str, tmp: str = None) -> int:
+    """
+    Replaces every occurence of substr in file with replace.  tmp is no longer used: the file is rewritten through a
+    temporary file next to it
+    """
+    count = rewrite_file(file, [(substr, replace)])
+    if count:
+        print("Replaced {} occurences of {} in {}".format(count, substr, file))
+    return count
 
 
 if __name__ == "__main__":
-    rhsm_qe = "/home/stoner/Projects/rhsm-qe/src/rhsm/cli/tests"
-    from pathlib import Path
-    ls = Path(rhsm_qe)
-    java = [j for j in list(ls.glob("**/*.java")) if j.is_file()]
-    for j in java:
-        tmp = "/tmp/{}".format(j.name)
-        remove('DefTypes.Role.VERIFIES', "DefTypes.Role.IS_VERIFIED_BY", str(j), tmp)
-
-    if False:
-        import argparse
-
-        parser = argparse.ArgumentParser()
-        parser.add_argument("-s", "--substr", help="Text to search for and replace")
-        parser.add_argument("-r", "--replace", help="Text to replace if substr is found")
-        parser.add_argument("-f", "--file", help="File to search")
-        parser.add_argument("-t", "--temp", help="Temporary file")
-        opts = parser.parse_args()
-
-        remove(opts.substr, opts.replace, opts.file, opts.temp)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk search and replace, eg: "
+                                                 "-g '**/*.java' -r DefTypes.Role.VERIFIES DefTypes.Role.IS_VERIFIED_BY")
+    parser.add_argument("-d", "--dir", help="Directory to search (defaults to the current directory)")
+    parser.add_argument("-g", "--glob", help="Files to rewrite, relative to --dir", default="**/*")
+    parser.add_argument("-r", "--rule", help="Text to search for and its replacement (may be given several times)",
+                        nargs=2, action="append", metavar=("PATTERN", "REPLACEMENT"), required=True)
+    parser.add_argument("-e", "--regex", help="Patterns are regular expressions", action="store_true")
+    parser.add_argument("-n", "--dry-run", help="Only report how many replacements would be made",
+                        action="store_true")
+    parser.add_argument("-w", "--workers", help="Number of files processed in parallel", type=int, default=None)
+    parser.add_argument("-p", "--processes", help="Use processes instead of threads", action="store_true")
+    opts = parser.parse_args()
 
+    changed = rewrite(opts.glob, [tuple(r) for r in opts.rule], start=opts.dir, regex=opts.regex,
+                      dry_run=opts.dry_run, workers=opts.workers, processes=opts.processes)
+    for path in sorted(changed):
+        print("{}: {}".format(path, changed[path]))
+    print("{} replacements in {} files{}".format(sum(changed.values()), len(changed),
+                                                 " (dry run)" if opts.dry_run else ""))
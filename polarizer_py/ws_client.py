@@ -0,0 +1,156 @@
+"""
+A long lived, multiplexing WebSocket client for the polarizer UMB endpoints.
+
+ws_helper.serve opens a new connection for every request.  UMBClient instead keeps one connection per
+(host, port, url) open, sends any number of requests (as made by ws_helper.make_umb_request) over it concurrently, and
+routes each reply back to the request with the same tag.  A reply with an 'info' key is the final reply to a request,
+any other replies are progress messages.
+
+    async with UMBClient(max_in_flight=8) as client:
+        replies = await asyncio.gather(*(client.request(req, host="localhost", url="/ws/xunit/import", port=9000)
+                                         for req in reqs))
+"""
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Tuple
+
+import websockets
+
+from polarizer_py.logger import glob_logger as log
+
+
+class _Connection:
+    """A single websocket, and the replies waiting to be picked up by each outstanding tag"""
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pending = {}
+        self.reader = asyncio.ensure_future(self._read())
+
+    @property
+    def closed(self) -> bool:
+        return self.reader.done()
+
+    async def _read(self) -> None:
+        error = None
+        try:
+            async for message in self.websocket:
+                reply = json.loads(message)
+                tag = reply.get("tag") if isinstance(reply, dict) else None
+                queue = self.pending.get(str(tag)) if tag is not None else None
+                if queue is None and len(self.pending) == 1:
+                    # Untagged (or unknown) reply, but there is only one request it can belong to
+                    queue = next(iter(self.pending.values()))
+                if queue is None:
+                    log.error("Dropping reply for unknown tag %s", tag)
+                    continue
+                queue.put_nowait(reply)
+        except Exception as ex:
+            error = ex
+        finally:
+            if error is None:
+                error = ConnectionError("websocket closed before the reply arrived")
+            for queue in self.pending.values():
+                queue.put_nowait(error)
+
+    async def close(self) -> None:
+        await self.websocket.close()
+        await asyncio.wait([self.reader])
+
+
+class UMBClient:
+    """
+    Pools one websocket per (host, port, url) and multiplexes requests over it.  At most max_in_flight requests are
+    outstanding at any time across all connections; further requests wait for a free slot.
+    """
+    def __init__(self, max_in_flight: int = 16, **connect_kwargs):
+        """
+        :param max_in_flight: maximum number of requests waiting for their final reply
+        :param connect_kwargs: extra keyword arguments passed to websockets.connect.  max_size defaults to None, since
+                               the reply to a testcase import carries the whole mapping
+        """
+        self.max_in_flight = max_in_flight
+        connect_kwargs.setdefault("max_size", None)
+        self.connect_kwargs = connect_kwargs
+        self._connections = {}
+        self._connecting = {}
+        self._slots = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _connection(self, key: Tuple[str, int, str]) -> _Connection:
+        conn = self._connections.get(key)
+        if conn is not None and not conn.closed:
+            return conn
+
+        # Only one coroutine opens the connection, the others wait for it
+        if key not in self._connecting:
+            host, port, url = key
+            wsurl = "ws://{}:{}{}".format(host, port, url)
+            self._connecting[key] = asyncio.ensure_future(websockets.connect(wsurl, **self.connect_kwargs))
+        try:
+            websocket = await asyncio.shield(self._connecting[key])
+        finally:
+            if self._connecting.get(key) is not None and self._connecting[key].done():
+                del self._connecting[key]
+        conn = self._connections.get(key)
+        if conn is None or conn.websocket is not websocket:
+            conn = self._connections[key] = _Connection(websocket)
+        return conn
+
+    async def request(self,
+                      req: Dict,
+                      host: str = "rhsm-cimetrics.usersys.redhat.com",
+                      url: str = "/ws/xunit/import",
+                      port: int = 9000,
+                      timeout: float = 240,
+                      on_message: Callable[[Dict], Awaitable] = None) -> Dict:
+        """
+        Sends req and waits for its final reply
+
+        :param req: the request, as returned by make_umb_request
+        :param host:
+        :param url:
+        :param port:
+        :param timeout: seconds to wait for the final reply
+        :param on_message: optional coroutine function called with every progress message
+        :return: the final reply (the one with an 'info' key)
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        tag = str(req["tag"])
+        async with self._slots:
+            conn = await self._connection((host, port, url))
+            if tag in conn.pending:
+                raise ValueError("A request with tag {} is already in flight".format(tag))
+            queue = conn.pending[tag] = asyncio.Queue()
+            try:
+                if hasattr(req, "fragments"):
+                    # A ws_helper.StreamingRequest, sent as a fragmented message
+                    req["tag"] = tag
+                    await conn.websocket.send(req.fragments())
+                else:
+                    await conn.websocket.send(json.dumps(dict(req, tag=tag)))
+                loop = asyncio.get_event_loop()
+                deadline = loop.time() + timeout
+                while True:
+                    reply = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                    if isinstance(reply, Exception):
+                        raise reply
+                    if "info" in reply:
+                        return reply
+                    if on_message is not None:
+                        await on_message(reply)
+            finally:
+                del conn.pending[tag]
+
+    async def close(self) -> None:
+        """Closes every pooled connection"""
+        conns = list(self._connections.values())
+        self._connections.clear()
+        for conn in conns:
+            await conn.close()
@@ -1,49 +1,100 @@
-from typing import Mapping, Dict
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Mapping, Dict, Sequence, Tuple
 from uuid import uuid4
 from pathlib import Path
 import asyncio
 import websockets
 import json
-from pprint import pprint
 import argparse
+import glob
 import os
+import sys
+import time
 from os.path import expanduser
+from polarizer_py.ws_client import UMBClient
 
-def make_xunit_import_request(xunit: str, xargs: str = None):
+# Number of characters a StreamingRequest reads from its files at a time
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Codecs for compressed payloads.  A compressed request has every value in its data compressed with the codec and then
+# base64 encoded, and its type is "<codec>+base64" (eg gzip+base64) so the server knows how to decode it
+CODECS = ("gzip", "zlib", "lzma")
+
+# Statuses in the info of a final reply which mean the import explicitly failed
+FAILED_STATUSES = ("failed", "failure", "error")
+
+
+def _compressor(codec: str):
+    """Returns a new compressor object (with compress() and flush()) for codec"""
+    import zlib
+
+    if codec == "gzip":
+        return zlib.compressobj(wbits=31)
+    if codec == "zlib":
+        return zlib.compressobj()
+    if codec == "lzma":
+        import lzma
+        return lzma.LZMACompressor()
+    raise ValueError("Unknown compression {}, must be one of {}".format(codec, ", ".join(CODECS)))
+
+
+def payload_type(codec: str = None) -> str:
+    """Returns the request type declaring how the payload was encoded"""
+    return "na" if codec is None else "{}+base64".format(codec)
+
+
+def compress_payload(text: str, codec: str) -> str:
+    import base64
+
+    comp = _compressor(codec)
+    return base64.b64encode(comp.compress(text.encode("utf-8")) + comp.flush()).decode("ascii")
+
+
+def make_xunit_import_request(xunit: str, xargs: str = None, stream: bool = False, compression: str = None):
     """
     Creates a WebSocket request to the Polarizer UMB verticle to do a Polarion /import/xunit import
 
     :param xunit: Path to the xunit xml file to submit
     :param xargs: Path to the json args file needed by polarizer
+    :param stream: if True, return a StreamingRequest which reads the files while it is being sent
+    :param compression: optional codec (one of CODECS) to compress the payload with
     :return:
     """
     op = "xunit-import-ws"
     tag = "xunit-import-{}".format(uuid4())
     ack = True
     data = {}
-    with open(xunit, "r") as file:
-        data["xunit"] = file.read()
 
     if xargs is None:
         # Look in default location
         home = Path.home()
         xargs = str(home)
 
+    if stream:
+        return StreamingRequest(op, [("xunit", xunit), ("xargs", xargs)], tag=tag, ack=ack, compression=compression)
+
+    with open(xunit, "r") as file:
+        data["xunit"] = file.read()
+
     with open(xargs, "r") as file:
         data["xargs"] = file.read()
 
+    if compression is not None:
+        data = {k: compress_payload(v, compression) for k, v in data.items()}
     data = json.dumps(data)
 
-    return make_umb_request(op, tag=tag, ack=ack, data=data)
+    return make_umb_request(op, _type=payload_type(compression), tag=tag, ack=ack, data=data)
 
 
-def make_testcase_import_request(testcase: str, mapping: str, tcargs: str = None):
+def make_testcase_import_request(testcase: str, mapping: str, tcargs: str = None, stream: bool = False,
+                                 compression: str = None):
     """
     Creates a WebSocket request  to the Polarizer UMB verticle to do a Polarion /import/testcase import
 
     :param testcase: path to the TestCase xml that will be imported to Polarion
     :param mapping: path to the mapping.json file
     :param tcargs:
+    :param stream: if True, return a StreamingRequest which reads the files while it is being sent
+    :param compression: optional codec (one of CODECS) to compress the payload with
     :return: a websocket JSON with an updated mapping.json file
     """
     op = "testcase-import-ws"
@@ -51,6 +102,15 @@ def make_testcase_import_request(testcase: str, mapping: str, tcargs: str = None
     ack = True
     data = {}
 
+    if tcargs is None:
+        # Look in default location
+        home = Path.home()
+        tcargs = str(home)
+
+    if stream:
+        return StreamingRequest(op, [("mapping", mapping), ("testcase", testcase), ("tcargs", tcargs)],
+                                tag=tag, ack=ack, compression=compression)
+
     with open(mapping, "r") as mapfile:
         body = mapfile.read()
         data["mapping"] = body
@@ -58,17 +118,83 @@ def make_testcase_import_request(testcase: str, mapping: str, tcargs: str = None
     with open(testcase, "r") as tcfile:
         data["testcase"] = tcfile.read()
 
-    if tcargs is None:
-        # Look in default location
-        home = Path.home()
-        tcargs = str(home)
-
     with open(tcargs, "r") as argfile:
         data["tcargs"] = argfile.read()
 
+    if compression is not None:
+        data = {k: compress_payload(v, compression) for k, v in data.items()}
     data = json.dumps(data)
 
-    return make_umb_request(op, tag=tag, ack=ack, data=data)
+    return make_umb_request(op, _type=payload_type(compression), tag=tag, ack=ack, data=data)
+
+
+class StreamingRequest(dict):
+    """
+    A request like the ones made by make_umb_request, except that its data is never held in memory.  The data is a
+    json object whose values are the contents of files, and fragments() reads those files piece by piece while
+    yielding the json text of the whole request.  Joined together, the fragments are exactly json.dumps() of the
+    equivalent in-memory request, so serve and UMBClient send them as a single fragmented websocket message.
+    """
+    def __init__(self,
+                 op: str,
+                 files: Sequence[Tuple[str, str]],
+                 tag=None,
+                 ack: bool = False,
+                 chunk_size: int = STREAM_CHUNK_SIZE,
+                 compression: str = None):
+        """
+        :param op:
+        :param files: sequence of (key, path), the file at path becomes the value of key in the data
+        :param tag:
+        :param ack:
+        :param chunk_size: number of characters to read from a file at a time
+        :param compression: optional codec (one of CODECS) to compress each file with, the type is set to match
+        """
+        if compression is not None:
+            _compressor(compression)
+        super().__init__(make_umb_request(op, _type=payload_type(compression), tag=tag, ack=ack))
+        del self["data"]
+        self.files = list(files)
+        self.chunk_size = chunk_size
+        self.compression = compression
+
+    def _read(self, path: str) -> Iterator[str]:
+        """Yields the contents of the file at path, compressed and base64 encoded if needed, in pieces"""
+        with open(path, "r") as f:
+            chunks = iter(lambda: f.read(self.chunk_size), "")
+            if self.compression is None:
+                yield from chunks
+                return
+
+            import base64
+
+            comp = _compressor(self.compression)
+            pending = b""
+            for chunk in chunks:
+                pending += comp.compress(chunk.encode("utf-8"))
+                # base64 encode whole 3 byte groups only, so the pieces join up into one valid base64 string
+                cut = len(pending) - len(pending) % 3
+                if cut:
+                    yield base64.b64encode(pending[:cut]).decode("ascii")
+                    pending = pending[cut:]
+            pending += comp.flush()
+            yield base64.b64encode(pending).decode("ascii")
+
+    def fragments(self) -> Iterator[str]:
+        # data is a json string inside the json request, so everything in it gets json-escaped twice
+        def escape(text: str) -> str:
+            return json.dumps(json.dumps(text)[1:-1])[1:-1]
+
+        def escape_once(text: str) -> str:
+            return json.dumps(text)[1:-1]
+
+        yield json.dumps(dict(self))[:-1] + ', "data": "' + escape_once("{")
+        for i, (key, path) in enumerate(self.files):
+            yield escape_once((", " if i else "") + json.dumps(key) + ': "')
+            for chunk in self._read(path):
+                yield escape(chunk)
+            yield escape_once('"')
+        yield escape_once("}") + '"}'
 
 
 def ws_test():
@@ -99,7 +225,7 @@ def make_umb_request(op: str,
     if data is None:
         data = {}
     if tag is None:
-        tag = uuid4()
+        tag = str(uuid4())
 
     return {
         "op": op,
@@ -110,34 +236,158 @@ def make_umb_request(op: str,
     }
 
 
+async def iter_responses(websocket, timeout: float = 240) -> AsyncIterator[Dict]:
+    """
+    Yields every message received on websocket (decoded from json) until the final one, which is the first message
+    with an 'info' key.  The messages before it are progress messages.
+
+    :param websocket: an open websocket
+    :param timeout: overall number of seconds to wait for the final message
+    :raises asyncio.TimeoutError: if the final message has not arrived within timeout seconds
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        info = json.loads(await asyncio.wait_for(websocket.recv(), remaining))
+        yield info
+        if 'info' in info:
+            return
+
+
 async def serve(req: Dict,
                 host: str = "rhsm-cimetrics.usersys.redhat.com",
                 url: str = "/ws/xunit/import",
-                port: int = 9000) -> str:
+                port: int = 9000,
+                timeout: float = 240,
+                on_message: Callable[[Dict], Awaitable] = None,
+                ws_compression: str = "deflate") -> str:
+    """
+    Sends req over a new websocket and waits for the final reply
+
+    :param req: the request, as returned by make_umb_request
+    :param host:
+    :param url:
+    :param port:
+    :param timeout: overall number of seconds to wait for the final reply
+    :param on_message: optional coroutine function called with every progress message as soon as it arrives
+    :param ws_compression: "deflate" to offer permessage-deflate (used if the server accepts it), or None to disable
+    :return: the final reply, or the last message received if timeout expired first
+    """
     wsurl = "ws://{}:{}{}".format(host, port, url)
 
-    # print("Sending request to {}".format(wsurl))
-
-    async with websockets.connect(wsurl) as websocket:
-        body = json.dumps(req)
+    # The reply to a testcase import carries the whole updated mapping, which easily exceeds the default 1MiB limit
+    async with websockets.connect(wsurl, compression=ws_compression, max_size=None) as websocket:
+        body = req.fragments() if isinstance(req, StreamingRequest) else json.dumps(req)
         await websocket.send(body)
 
-        count = 0
         info = ""
-        while count < 120:
+        try:
+            async for info in iter_responses(websocket, timeout):
+                if on_message is not None and 'info' not in info:
+                    await on_message(info)
+        except asyncio.TimeoutError:
+            pass
+        return info
+
+
+def reply_succeeded(reply: Dict) -> bool:
+    """
+    The default success test of bulk_import: a final reply succeeded unless its info explicitly reports a failure (a
+    status in FAILED_STATUSES)
+    """
+    info = reply.get("info") if isinstance(reply, dict) else None
+    if not isinstance(info, dict):
+        return True
+    return str(info.get("status", "")).lower() not in FAILED_STATUSES
+
+
+def expand_paths(pattern: str) -> List[str]:
+    """
+    Returns the sorted paths of the xml files in pattern if it is a directory, or else the paths matching the glob
+    pattern (** is supported)
+    """
+    pattern = expanduser(pattern)
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.xml")
+    return sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+
+
+async def bulk_import(paths: Sequence[str],
+                      make_request: Callable[[str], Dict],
+                      host: str = "rhsm-cimetrics.usersys.redhat.com",
+                      url: str = "/ws/xunit/import",
+                      port: int = 9000,
+                      max_in_flight: int = 8,
+                      retries: int = 3,
+                      backoff: float = 1.0,
+                      timeout: float = 240,
+                      succeeded: Callable[[Dict], bool] = reply_succeeded,
+                      retry_timeouts: bool = False,
+                      **connect_kwargs) -> Dict:
+    """
+    Submits a request for every file in paths over a single UMBClient, with at most max_in_flight requests outstanding.
+    A failed request (a connection error, or a final reply for which succeeded is False) is retried up to retries times,
+    waiting backoff, 2 * backoff, 4 * backoff... seconds between attempts.  A request which timed out may still be
+    processed by the server, and imports aren't idempotent, so timeouts are only retried if retry_timeouts is True
+
+    :param paths: the files to import
+    :param make_request: function which takes a path and returns the request to send for it
+    :param host:
+    :param url:
+    :param port:
+    :param max_in_flight: maximum number of requests waiting for a reply at once
+    :param retries: how many times to retry a failed request
+    :param backoff: seconds to wait before the first retry
+    :param timeout: seconds to wait for each reply
+    :param succeeded: function which tells if a final reply means the import succeeded
+    :param retry_timeouts: also retry requests whose reply didn't arrive within timeout
+    :param connect_kwargs: extra keyword arguments passed to websockets.connect
+    :return: a summary dict, with the status, attempts and latency of every file
+    """
+    async def submit(client: UMBClient, path: str) -> Dict:
+        result = {"path": path, "status": "failed", "attempts": 0}
+        first = time.monotonic()
+        while True:
+            result["attempts"] += 1
+            start = time.monotonic()
             try:
-                # Have to use wait_for() here, otherwise websocket.recv will yield, effectively stopping the while loop
-                # Yup, asyncio is tricky :)  Also, in python 3.5 can't use yield from in an async function
-                response = await asyncio.wait_for(websocket.recv(), 2)
-                # print("<", end='')
-                info = json.loads(response)
-                # pprint(info, indent=2, width=120)
-                if 'info' in info:
-                    # print("Breaking from while loop")
+                reply = await client.request(make_request(path), host=host, url=url, port=port, timeout=timeout)
+                result["reply"] = reply
+                result["latency"] = time.monotonic() - start
+                info = reply.get("info") if isinstance(reply, dict) else None
+                info = info if isinstance(info, dict) else {}
+                result["reply-status"] = info.get("status")
+                if succeeded(reply):
+                    result["status"] = "ok"
+                    result.pop("error", None)
+                    break
+                result["error"] = "import {}: {}".format(info.get("status"), info.get("error", ""))
+                if result["attempts"] > retries:
                     break
             except asyncio.TimeoutError:
-                count += 1
-        return info
+                result["error"] = "TimeoutError: no reply after {}s".format(timeout)
+                if not retry_timeouts or result["attempts"] > retries:
+                    break
+            except Exception as ex:
+                result["error"] = "{}: {}".format(type(ex).__name__, ex)
+                if result["attempts"] > retries:
+                    break
+            await asyncio.sleep(backoff * 2 ** (result["attempts"] - 1))
+        result["elapsed"] = time.monotonic() - first
+        return result
+
+    start = time.monotonic()
+    async with UMBClient(max_in_flight=max_in_flight, **connect_kwargs) as client:
+        files = await asyncio.gather(*(submit(client, path) for path in paths))
+    ok = sum(1 for f in files if f["status"] == "ok")
+    return {"total": len(files),
+            "ok": ok,
+            "failed": len(files) - ok,
+            "elapsed": time.monotonic() - start,
+            "files": files}
 
 
 if __name__ == "__main__":
@@ -148,8 +398,59 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--type", choices=["xunit", "testcase", "test"], help="type of import to make [xunit|testcase]")
     parser.add_argument("-s", "--server", help="Hostname of polarizer", default="rhsm-cimetrics.usersys.redhat.com")
     parser.add_argument("--port", help="Port for the websocket server", default=9000, type=int)
+    parser.add_argument("--stream", help="Stream the files while sending instead of reading them into memory first",
+                        action="store_true", default=False)
+    parser.add_argument("-c", "--compression", choices=CODECS, default=None, help="Compress the files with this codec")
+    parser.add_argument("--no-ws-compression", help="Don't offer permessage-deflate to the server",
+                        action="store_true", default=False)
+    parser.add_argument("-d", "--xml-dir", help="Directory or glob of xml files to import in bulk (instead of -p)")
+    parser.add_argument("--max-in-flight", help="Bulk mode: maximum concurrent requests", default=8, type=int)
+    parser.add_argument("--retries", help="Bulk mode: retries per file", default=3, type=int)
+    parser.add_argument("--backoff", help="Bulk mode: seconds before the first retry, doubled for each retry",
+                        default=1.0, type=float)
+    parser.add_argument("--timeout", help="Seconds to wait for each reply", default=240, type=float)
+    parser.add_argument("--retry-timeouts", help="Bulk mode: also retry files whose reply timed out (may import them "
+                        "twice)", action="store_true", default=False)
+    parser.add_argument("--summary", help="Bulk mode: write the json summary here instead of stdout")
     opts = parser.parse_args()
 
+    if opts.xml_dir:
+        if opts.type not in ("xunit", "testcase"):
+            raise Exception("Must provide --type of xunit or testcase for --xml-dir")
+        if not opts.json_args:
+            raise Exception("Must provide --json-args")
+        args_path = expanduser(opts.json_args)
+        if opts.type == "xunit":
+            url_endpoint = "/ws/xunit/import"
+
+            def make_request(path):
+                return make_xunit_import_request(path, xargs=args_path, stream=opts.stream,
+                                                 compression=opts.compression)
+        else:
+            if not opts.mapping or not os.path.exists(expanduser(opts.mapping)):
+                raise Exception("Must provide an existing file to --mapping for testcase type")
+            url_endpoint = "/ws/testcase/import"
+            mapping = expanduser(opts.mapping)
+
+            def make_request(path):
+                return make_testcase_import_request(path, mapping, tcargs=args_path, stream=opts.stream,
+                                                    compression=opts.compression)
+
+        paths = expand_paths(opts.xml_dir)
+        if not paths:
+            raise Exception("No xml files found in {}".format(opts.xml_dir))
+        summary = asyncio.get_event_loop().run_until_complete(
+            bulk_import(paths, make_request, host=opts.server, url=url_endpoint, port=opts.port,
+                        max_in_flight=opts.max_in_flight, retries=opts.retries, backoff=opts.backoff,
+                        timeout=opts.timeout, retry_timeouts=opts.retry_timeouts,
+                        compression=None if opts.no_ws_compression else "deflate"))
+        if opts.summary:
+            with open(expanduser(opts.summary), "w") as out:
+                json.dump(summary, out, sort_keys=True, indent=2)
+        else:
+            print(json.dumps(summary, sort_keys=True, indent=2))
+        sys.exit(1 if summary["failed"] else 0)
+
     xml = expanduser(opts.xml_path)
     args_path = expanduser(opts.json_args)
     choice = opts.type
@@ -165,7 +466,7 @@ if __name__ == "__main__":
     req = None
     url_endpoint = None
     if choice == "xunit":
-        req = make_xunit_import_request(xml, xargs=args_path)
+        req = make_xunit_import_request(xml, xargs=args_path, stream=opts.stream, compression=opts.compression)
         url_endpoint = "/ws/xunit/import"
     elif choice == "testcase":
         mapping = expanduser(opts.mapping)
@@ -173,7 +474,8 @@ if __name__ == "__main__":
             raise Exception("Must provide file to --mapping for testcase type")
         if mapping and not os.path.exists(mapping):
             raise Exception("{0} not exist for --mapping".format(mapping))
-        req = make_testcase_import_request(xml, mapping, tcargs=args_path)
+        req = make_testcase_import_request(xml, mapping, tcargs=args_path, stream=opts.stream,
+                                           compression=opts.compression)
         url_endpoint = "/ws/testcase/import"
     elif choice == "test":
         url_endpoint = "/ws"
@@ -183,7 +485,9 @@ if __name__ == "__main__":
         raise Exception("Unknown choice for --type selected")
 
     async def _serve():
-        info = await serve(req, host=opts.server, url=url_endpoint, port=opts.port)
+        ws_compression = None if opts.no_ws_compression else "deflate"
+        info = await serve(req, host=opts.server, url=url_endpoint, port=opts.port, timeout=opts.timeout,
+                           ws_compression=ws_compression)
         print(json.dumps(info, sort_keys=True, indent=2))
 
     loop = asyncio.get_event_loop()
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import sys
+
+import websockets
+
+from polarizer_py import ws_helper
+from polarizer_py.mock_umb import MockUMB
+from polarizer_py.ws_helper import bulk_import, make_umb_request, reply_succeeded
+
+PATHS = ["a.xml", "b.xml", "c.xml"]
+
+
+def _request(path):
+    return make_umb_request("testing", data=path)
+
+
+async def _bulk(server, **kwargs):
+    port = list(server.sockets)[0].getsockname()[1]
+    try:
+        return await bulk_import(PATHS, _request, host="127.0.0.1", url="/ws", port=port, **kwargs)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def _replying(*infos):
+    """A server answering the n-th request it receives with infos[n] (or the last one), or never if that is None"""
+    count = {"n": 0}
+
+    async def handler(websocket, path=None):
+        async for message in websocket:
+            info = infos[min(count["n"], len(infos) - 1)]
+            count["n"] += 1
+            if info is not None:
+                await websocket.send(json.dumps({"tag": json.loads(message)["tag"], "info": info}))
+
+    return handler, count
+
+
+def test_reply_succeeded():
+    assert reply_succeeded({"info": {"status": "passed"}})
+    assert reply_succeeded({"info": {"created": 3}})
+    assert reply_succeeded({"info": "imported"})
+    assert not reply_succeeded({"info": {"status": "failed", "error": "boom"}})
+    assert not reply_succeeded({"info": {"status": "ERROR"}})
+
+
+def test_all_succeed_first_time():
+    async def main():
+        return await _bulk(await MockUMB(delay=0, progress=1).start("127.0.0.1", 0), backoff=0)
+
+    summary = asyncio.run(main())
+    assert (summary["ok"], summary["failed"]) == (3, 0)
+    assert [f["attempts"] for f in summary["files"]] == [1, 1, 1]
+    assert [f["reply-status"] for f in summary["files"]] == ["passed"] * 3
+
+
+def test_reply_without_status_is_a_success():
+    handler, count = _replying({"created": 1})
+
+    async def main():
+        return await _bulk(await websockets.serve(handler, "127.0.0.1", 0), backoff=0)
+
+    summary = asyncio.run(main())
+    assert summary["ok"] == 3
+    assert count["n"] == 3
+
+
+def test_failed_replies_are_retried_with_backoff(monkeypatch):
+    sleeps = []
+    sleep = asyncio.sleep
+
+    def recording_sleep(delay, *args, **kwargs):
+        # websockets sleeps too (eg for keepalive pings), only record the backoffs of bulk_import
+        if sys._getframe(1).f_globals["__name__"] == ws_helper.__name__:
+            sleeps.append(delay)
+            delay = 0
+        return sleep(delay, *args, **kwargs)
+
+    monkeypatch.setattr(ws_helper.asyncio, "sleep", recording_sleep)
+
+    async def main():
+        return await _bulk(await MockUMB(delay=0, progress=0, failure_rate=1.0).start("127.0.0.1", 0),
+                           retries=2, backoff=0.5)
+
+    summary = asyncio.run(main())
+    assert (summary["ok"], summary["failed"]) == (0, 3)
+    for f in summary["files"]:
+        assert f["attempts"] == 3
+        assert f["reply-status"] == "failed"
+        assert "injected failure" in f["error"]
+    assert sorted(sleeps) == [0.5, 0.5, 0.5, 1.0, 1.0, 1.0]
+
+
+def test_failure_then_success():
+    handler, count = _replying({"status": "failed"}, {"status": "failed"}, {"status": "failed"}, {"status": "passed"})
+
+    async def main():
+        return await _bulk(await websockets.serve(handler, "127.0.0.1", 0), retries=3, backoff=0)
+
+    summary = asyncio.run(main())
+    assert summary["ok"] == 3
+    assert sum(f["attempts"] for f in summary["files"]) == 6
+    assert all("error" not in f for f in summary["files"])
+
+
+def test_custom_success_test():
+    async def main():
+        return await _bulk(await MockUMB(delay=0, progress=0).start("127.0.0.1", 0), retries=1, backoff=0,
+                           succeeded=lambda reply: reply["info"].get("data") == "b.xml")
+
+    summary = asyncio.run(main())
+    assert [f["status"] for f in summary["files"]] == ["failed", "ok", "failed"]
+
+
+def test_timeouts_are_not_retried_by_default():
+    handler, count = _replying(None)
+
+    async def main():
+        return await _bulk(await websockets.serve(handler, "127.0.0.1", 0), retries=3, backoff=0, timeout=0.2)
+
+    summary = asyncio.run(main())
+    assert summary["failed"] == 3
+    assert [f["attempts"] for f in summary["files"]] == [1, 1, 1]
+    assert count["n"] == 3
+    assert all(f["error"].startswith("TimeoutError") for f in summary["files"])
+
+
+def test_timeouts_can_be_retried():
+    handler, count = _replying(None, None, None, {"status": "passed"})
+
+    async def main():
+        return await _bulk(await websockets.serve(handler, "127.0.0.1", 0), retries=1, backoff=0, timeout=0.2,
+                           retry_timeouts=True)
+
+    summary = asyncio.run(main())
+    assert summary["ok"] == 3
+    assert count["n"] == 6
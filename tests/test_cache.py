@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from polarizer_py.cache import FileCache
+
+
+class Loader:
+    """Reads a file, remembering which paths it was called for"""
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, path):
+        self.loaded.append(os.path.basename(path))
+        with open(path) as f:
+            return f.read()
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {}
+    for name, size in [("a", 100), ("b", 200), ("c", 300), ("d", 400)]:
+        path = tmp_path / name
+        path.write_text(name * size)
+        paths[name] = str(path)
+    return paths
+
+
+def _keys(cache):
+    return [os.path.basename(key) for key in cache._entries]
+
+
+def test_hits_and_misses(files):
+    loader = Loader()
+    cache = FileCache(loader)
+    assert cache.get(files["a"]) == "a" * 100
+    assert cache.get(files["a"]) == "a" * 100
+    # Relative and absolute paths share an entry
+    assert cache.get(os.path.relpath(files["a"])) == "a" * 100
+    assert loader.loaded == ["a"]
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 0, "entries": 1, "bytes": 100}
+
+
+def test_lru_eviction(files):
+    loader = Loader()
+    cache = FileCache(loader, max_entries=2)
+    cache.get(files["a"])
+    cache.get(files["b"])
+    # Using a makes b the least recently used
+    cache.get(files["a"])
+    cache.get(files["c"])
+    assert _keys(cache) == ["a", "c"]
+    assert cache.evictions == 1
+    cache.get(files["b"])
+    assert _keys(cache) == ["c", "b"]
+    assert loader.loaded == ["a", "b", "c", "b"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "evictions": 2, "entries": 2, "bytes": 500}
+
+
+def test_max_bytes(files):
+    cache = FileCache(Loader(), max_bytes=550)
+    cache.get(files["a"])
+    cache.get(files["b"])
+    assert cache.bytes == 300
+    cache.get(files["c"])
+    assert _keys(cache) == ["b", "c"]
+    assert cache.bytes == 500
+    cache.get(files["d"])
+    assert _keys(cache) == ["d"]
+    assert cache.bytes == 400
+    assert cache.evictions == 3
+
+
+def test_entry_over_max_bytes_is_kept(files):
+    cache = FileCache(Loader(), max_bytes=50)
+    cache.get(files["a"])
+    assert _keys(cache) == ["a"]
+    cache.get(files["b"])
+    assert _keys(cache) == ["b"]
+    assert (cache.bytes, cache.evictions) == (200, 1)
+
+
+def test_resize(files):
+    cache = FileCache(Loader())
+    for name in "abcd":
+        cache.get(files[name])
+    cache.resize(max_entries=3)
+    assert _keys(cache) == ["b", "c", "d"]
+    cache.resize(max_bytes=700)
+    assert _keys(cache) == ["c", "d"]
+    assert cache.stats() == {"hits": 0, "misses": 4, "evictions": 2, "entries": 2, "bytes": 700}
+
+
+def test_invalidated_by_mtime(files):
+    loader = Loader()
+    cache = FileCache(loader)
+    cache.get(files["a"])
+    st = os.stat(files["a"])
+    os.utime(files["a"], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.get(files["a"]) == "a" * 100
+    assert loader.loaded == ["a", "a"]
+    assert cache.stats() == {"hits": 0, "misses": 2, "evictions": 0, "entries": 1, "bytes": 100}
+
+
+def test_invalidated_by_size(files):
+    loader = Loader()
+    cache = FileCache(loader)
+    cache.get(files["a"])
+    st = os.stat(files["a"])
+    with open(files["a"], "w") as f:
+        f.write("x" * 150)
+    # Same mtime, so only the size tells the content changed
+    os.utime(files["a"], ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert cache.get(files["a"]) == "x" * 150
+    assert loader.loaded == ["a", "a"]
+    assert (cache.misses, cache.bytes, len(cache)) == (2, 150, 1)
+
+
+def test_clear(files):
+    cache = FileCache(Loader())
+    cache.get(files["a"])
+    cache.clear()
+    assert (len(cache), cache.bytes) == (0, 0)
+    cache.get(files["a"])
+    assert cache.misses == 2
+
+
+def test_missing_file(tmp_path):
+    cache = FileCache(Loader())
+    with pytest.raises(FileNotFoundError):
+        cache.get(str(tmp_path / "missing"))
+    assert cache.stats()["misses"] == 0
@@ -0,0 +1,171 @@
+import os
+from xml.dom import minidom
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from polarizer_py.metadata import (_make_test_steps, generate_import_xml, generate_import_xml_chunks, meta_to_tc_xml,
+                                   write_testcases_xml, write_testcases_xml_chunks)
+
+SELECTOR = ("rhsm_qe", "testcase_importer")
+
+METAS = [
+    {"name": "pkg.mod.test_plain", "id": "", "description": "A plain test",
+     "test-steps": _make_test_steps(["self", "x", "y"])},
+    {"name": "pkg.mod.Test.test_escaping", "id": "RHEL6-1", "description": "Checks <tags> & \"quotes\" > all, naïvely",
+     "test-steps": _make_test_steps(["a&b"])},
+    {"name": "pkg.mod.test_empty", "id": "", "description": "", "test-steps": _make_test_steps([])},
+    {"name": "pkg.mod.test_no_steps", "id": "", "description": "multi\nline", "test-steps": []},
+]
+
+
+def _toprettyxml(project, metas):
+    """How generate_import_xml built the document before it was streamed"""
+    parent = ET.Element("testcases", attrib={"project-id": project})
+    response_props = ET.SubElement(parent, "response-properties")
+    ET.SubElement(response_props, "response-property", attrib={"name": SELECTOR[0], "value": SELECTOR[1]})
+    for item in metas:
+        parent.append(meta_to_tc_xml(item["name"], item))
+    return str.encode(minidom.parseString(ET.tostring(parent)).toprettyxml(indent="  "))
+
+
+def test_same_bytes_as_toprettyxml(tmp_path):
+    path = tmp_path / "testcases.xml"
+    write_testcases_xml(str(path), "RHEL6 & co", SELECTOR, METAS)
+    assert path.read_bytes() == _toprettyxml("RHEL6 & co", METAS)
+
+
+def test_empty_project(tmp_path):
+    path = tmp_path / "testcases.xml"
+    write_testcases_xml(str(path), "RHEL6", SELECTOR, [])
+    assert path.read_bytes() == _toprettyxml("RHEL6", [])
+
+
+def test_without_indent_parses_to_the_same_tree(tmp_path):
+    pretty, compact = tmp_path / "pretty.xml", tmp_path / "compact.xml"
+    write_testcases_xml(str(pretty), "RHEL6", SELECTOR, METAS)
+    write_testcases_xml(str(compact), "RHEL6", SELECTOR, METAS, indent=None)
+    assert b"\n" not in compact.read_bytes().replace(b"multi\nline", b"")
+
+    def strip(elem):
+        return (elem.tag, elem.attrib, (elem.text or "").strip(), [strip(child) for child in elem])
+
+    assert strip(ET.parse(str(compact)).getroot()) == strip(ET.parse(str(pretty)).getroot())
+
+
+def _metas(n, description="Test number {}"):
+    return [{"name": "pkg.mod.test_{:03}".format(i), "id": "", "description": description.format(i),
+             "test-steps": _make_test_steps(["self", "arg{}".format(i)])} for i in range(n)]
+
+
+def _testcases(path):
+    root = ET.parse(path).getroot()
+    tcs = list(root.iter("testcase"))
+    for tc in tcs:
+        # The whitespace after the last testcase differs from that between testcases
+        tc.tail = None
+    return root.get("project-id"), [ET.tostring(tc) for tc in tcs]
+
+
+def _selector_of(path):
+    prop = ET.parse(path).getroot().find("response-properties/response-property")
+    return prop.get("name"), prop.get("value")
+
+
+@pytest.fixture
+def written():
+    """Chunk files written to /tmp by the test, removed afterwards"""
+    paths = []
+    yield paths
+    for path in paths:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _check_chunks(chunks, whole_path, project, written):
+    written.extend(c.path for c in chunks)
+    assert [c.selector for c in chunks] == [(SELECTOR[0], "{}-{}".format(SELECTOR[1], i))
+                                             for i in range(1, len(chunks) + 1)]
+    union = []
+    for chunk in chunks:
+        assert _selector_of(chunk.path) == chunk.selector
+        chunk_project, tcs = _testcases(chunk.path)
+        assert chunk_project == project
+        assert len(tcs) == chunk.testcases
+        union.extend(tcs)
+    assert union == _testcases(whole_path)[1]
+
+
+@pytest.mark.parametrize("indent", ["  ", None])
+def test_chunks_by_testcases(tmp_path, written, indent):
+    metas = _metas(10)
+    whole = tmp_path / "whole.xml"
+    write_testcases_xml(str(whole), "RHEL6", SELECTOR, metas, indent=indent)
+    chunks = write_testcases_xml_chunks("RHEL6", SELECTOR, metas, max_testcases=3, indent=indent)
+    _check_chunks(chunks, str(whole), "RHEL6", written)
+    assert [c.testcases for c in chunks] == [3, 3, 3, 1]
+
+
+def test_chunks_by_bytes(tmp_path, written):
+    metas = _metas(20)
+    whole = tmp_path / "whole.xml"
+    write_testcases_xml(str(whole), "RHEL6", SELECTOR, metas)
+    max_bytes = 1500
+    chunks = write_testcases_xml_chunks("RHEL6", SELECTOR, metas, max_bytes=max_bytes)
+    _check_chunks(chunks, str(whole), "RHEL6", written)
+    assert len(chunks) > 1
+    sizes = [os.path.getsize(c.path) for c in chunks]
+    assert all(size <= max_bytes for size in sizes)
+    # Each chunk is as full as it can be: the first testcase of the next one would not have fitted
+    tc_size = (os.path.getsize(str(whole)) - os.path.getsize(chunks[0].path)) // (20 - chunks[0].testcases)
+    assert all(size + tc_size > max_bytes for size in sizes[:-1])
+
+
+def test_chunks_by_both_limits(tmp_path, written):
+    metas = _metas(12)
+    whole = tmp_path / "whole.xml"
+    write_testcases_xml(str(whole), "RHEL6", SELECTOR, metas)
+    max_bytes = 1500
+    by_bytes = write_testcases_xml_chunks("RHEL6", SELECTOR, metas, max_bytes=max_bytes)
+    written.extend(c.path for c in by_bytes)
+    chunks = write_testcases_xml_chunks("RHEL6", SELECTOR, metas, max_testcases=by_bytes[0].testcases - 1,
+                                        max_bytes=max_bytes)
+    _check_chunks(chunks, str(whole), "RHEL6", written)
+    assert max(c.testcases for c in chunks) == by_bytes[0].testcases - 1
+
+
+def test_oversized_testcase_gets_its_own_chunk(tmp_path, written, caplog):
+    metas = _metas(5)
+    metas[2]["description"] = "x" * 5000
+    whole = tmp_path / "whole.xml"
+    write_testcases_xml(str(whole), "RHEL6", SELECTOR, metas)
+    chunks = write_testcases_xml_chunks("RHEL6", SELECTOR, metas, max_bytes=2000)
+    _check_chunks(chunks, str(whole), "RHEL6", written)
+    oversized = [c for c in chunks if os.path.getsize(c.path) > 2000]
+    assert len(oversized) == 1 and oversized[0].testcases == 1
+    assert "pkg.mod.test_002" in _testcases(oversized[0].path)[1][0].decode()
+    assert "pkg.mod.test_002 alone is bigger than 2000 bytes" in caplog.text
+
+
+def test_no_testcases_no_chunks():
+    assert write_testcases_xml_chunks("RHEL6", SELECTOR, [], max_testcases=3) == []
+
+
+@pytest.mark.parametrize("batch, workers", [
+    ({"max-testcases": 4}, None),
+    ({"max-testcases": 4}, 2),
+    ({"max-bytes": 1500}, None),
+    ({"max-testcases": 4, "max-bytes": 1500}, 2),
+])
+def test_generate_import_xml_chunks(written, batch, workers):
+    cfg = {"testcase": {"selector": {"name": SELECTOR[0], "value": SELECTOR[1]}, "batch": batch}}
+    import_list = {"RHEL6": _metas(10), "RHEL7": _metas(3, "Other test {}")}
+    wholes = generate_import_xml(import_list, cfg=cfg)
+    written.extend(wholes.values())
+    chunks = generate_import_xml_chunks(import_list, cfg=cfg, workers=workers)
+    assert list(chunks) == ["RHEL6", "RHEL7"]
+    for project, project_chunks in chunks.items():
+        _check_chunks(project_chunks, wholes[project], project, written)
+        assert all(c.testcases <= batch.get("max-testcases", 10) for c in project_chunks)
+        assert all(os.path.getsize(c.path) <= batch.get("max-bytes", 1 << 20) for c in project_chunks)
+    assert [c.testcases for c in chunks["RHEL7"]] == [3]
@@ -0,0 +1,157 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from polarizer_py.jar_cache import JarCache, build_jar, cache_key, tree_hash
+
+ARTIFACT = "target/*standalone*.jar"
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+
+def _git(repo, *args):
+    return subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                          cwd=str(repo), check=True, stdout=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    (repo / ".gitignore").write_text("target/\n")
+    (repo / "src.clj").write_text("(ns sm)\n")
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "initial")
+    return repo
+
+
+@pytest.fixture
+def build(tmp_path):
+    """A stub build, which writes a jar of the sources and counts how often it ran"""
+    log = tmp_path / "builds.log"
+    return (log, ("mkdir -p target", "cat src.clj > target/sm-1.0-standalone.jar && echo built >> {}".format(log)))
+
+
+def _builds(log):
+    return len(log.read_text().splitlines()) if log.exists() else 0
+
+
+@needs_git
+def test_tree_hash(repo):
+    tree = tree_hash(str(repo))
+    assert tree == _git(repo, "rev-parse", "HEAD^{tree}")
+    # Another commit of the same contents has the same tree
+    _git(repo, "commit", "-q", "--allow-empty", "-m", "empty")
+    assert tree_hash(str(repo)) == tree
+    # Ignored files don't make the tree dirty
+    (repo / "target").mkdir()
+    (repo / "target" / "x.jar").write_text("jar")
+    assert tree_hash(str(repo)) == tree
+
+
+@pytest.mark.parametrize("change", ["modified", "untracked", "staged"])
+@needs_git
+def test_dirty_tree_has_no_hash(repo, change):
+    if change == "modified":
+        (repo / "src.clj").write_text("(ns sm2)\n")
+    elif change == "untracked":
+        (repo / "new.clj").write_text("")
+    else:
+        (repo / "new.clj").write_text("")
+        _git(repo, "add", "new.clj")
+    assert tree_hash(str(repo)) is None
+
+
+def test_cache_key():
+    key = cache_key("abc", ["lein uberjar"], ARTIFACT)
+    assert key.startswith("abc-")
+    assert key == cache_key("abc", ("lein uberjar",), ARTIFACT)
+    assert key != cache_key("abd", ["lein uberjar"], ARTIFACT)
+    assert key != cache_key("abc", ["lein with-profile test uberjar"], ARTIFACT)
+    assert key != cache_key("abc", ["lein uberjar"], "target/*.jar")
+
+
+@needs_git
+def test_build_is_cached(repo, build, tmp_path):
+    log, commands = build
+    cache = JarCache(str(tmp_path / "cache"))
+    jar = build_jar(str(repo), commands, ARTIFACT, cache)
+    key = cache_key(tree_hash(str(repo)), commands, ARTIFACT)
+    assert jar == str(tmp_path / "cache" / key / "sm-1.0-standalone.jar")
+    assert _builds(log) == 1
+
+    assert build_jar(str(repo), commands, ARTIFACT, cache) == jar
+    assert _builds(log) == 1
+
+    # A new commit with other sources is built again
+    (repo / "src.clj").write_text("(ns sm2)\n")
+    _git(repo, "commit", "-q", "-am", "change")
+    other = build_jar(str(repo), commands, ARTIFACT, cache)
+    assert other != jar
+    assert open(other).read() == "(ns sm2)\n"
+    assert _builds(log) == 2
+    assert len(cache.entries()) == 2
+
+
+@needs_git
+def test_dirty_tree_bypasses_the_cache(repo, build, tmp_path):
+    log, commands = build
+    cache = JarCache(str(tmp_path / "cache"))
+    (repo / "src.clj").write_text("(ns dirty)\n")
+    for _ in range(2):
+        jar = build_jar(str(repo), commands, ARTIFACT, cache)
+        assert open(jar).read() == "(ns dirty)\n"
+    assert _builds(log) == 2
+    assert jar.startswith(str(repo))
+    assert cache.entries() == []
+
+
+@needs_git
+def test_failed_build(repo, tmp_path):
+    with pytest.raises(RuntimeError):
+        build_jar(str(repo), ["exit 3"], ARTIFACT, JarCache(str(tmp_path / "cache")))
+
+
+def _jar(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"\0" * size)
+    return str(path)
+
+
+def _age(cache, key, seconds):
+    then = time.time() - seconds
+    os.utime(os.path.join(cache.cache_dir, key), (then, then))
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = JarCache(str(tmp_path / "cache"), max_bytes=250)
+    cache.put("a", _jar(tmp_path, "a.jar", 100))
+    _age(cache, "a", 30)
+    cache.put("b", _jar(tmp_path, "b.jar", 100))
+    _age(cache, "b", 20)
+    # Using a makes b the least recently used
+    assert cache.get("a").endswith("a.jar")
+    cache.put("c", _jar(tmp_path, "c.jar", 100))
+    assert [key for _, _, key in cache.entries()] == ["a", "c"]
+    assert cache.get("b") is None
+    assert sum(size for _, size, _ in cache.entries()) == 200
+
+
+def test_new_entry_is_kept_even_if_too_big(tmp_path):
+    cache = JarCache(str(tmp_path / "cache"), max_bytes=150)
+    cache.put("a", _jar(tmp_path, "a.jar", 100))
+    _age(cache, "a", 30)
+    cache.put("big", _jar(tmp_path, "big.jar", 200))
+    assert [key for _, _, key in cache.entries()] == ["big"]
+    assert cache.evict(keep="big") == []
+    assert cache.evict() == ["big"]
+
+
+def test_partial_entries_are_ignored(tmp_path):
+    cache = JarCache(str(tmp_path / "cache"))
+    os.makedirs(os.path.join(cache.cache_dir, "a.tmp123"))
+    assert cache.entries() == []
+    assert JarCache(str(tmp_path / "missing")).entries() == []
@@ -0,0 +1,72 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from polarizer_py import utils
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _gone(pid: int, wait: float = 10) -> bool:
+    """True once pid has exited (a zombie left for init to reap counts as exited)"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_output_and_return_code():
+    lines = []
+    output, ret = utils.launch("echo one; echo two >&2; exit 3", shell=True, on_line=lines.append)
+    assert ret == 3
+    assert lines == ["one", "two"]
+    assert output == "one\ntwo\n"
+
+
+def test_timeout_kills_the_process_group():
+    lines = []
+    start = time.monotonic()
+    output, ret = utils.launch("sleep 37 & echo $!; wait", shell=True, timeout=0.5, on_line=lines.append)
+    assert time.monotonic() - start < 10
+    assert ret < 0
+    assert _gone(int(lines[0]))
+
+
+@pytest.mark.skipif(not os.path.exists("/proc"), reason="needs /proc")
+def test_interrupt_kills_the_command():
+    code = "from polarizer_py.utils import launch; launch('echo $$; exec sleep 37', shell=True, timeout=None)"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+    parent = subprocess.Popen([sys.executable, "-u", "-c", code], env=env, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+    try:
+        pid = None
+        for line in parent.stdout:
+            if line.strip().isdigit():
+                pid = int(line)
+                break
+        assert pid is not None
+        parent.send_signal(signal.SIGINT)
+        assert parent.wait(10) != 0
+        assert _gone(pid)
+    finally:
+        parent.kill()
+        parent.wait()
+
+
+def test_unreadable_output_kills_the_command(monkeypatch):
+    monkeypatch.setattr(utils, "STREAM_LIMIT", 1024)
+    lines = []
+    with pytest.raises(Exception):
+        utils.launch("echo $$; head -c 10000 /dev/zero | tr '\\\\0' x; echo; exec sleep 37", shell=True, timeout=None,
+                     on_line=lines.append)
+    assert _gone(int(lines[0]))
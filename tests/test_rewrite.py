@@ -0,0 +1,137 @@
+import os
+import stat
+import tempfile
+
+import pytest
+
+from polarizer_py import utils
+from polarizer_py.utils import _compile_rules, _has_match, rewrite, rewrite_file
+
+RULES = [("Role.VERIFIES", "Role.IS_VERIFIED_BY")]
+FILES = {
+    "src/A.java": "import Role;\nx = Role.VERIFIES;\ny = Role.VERIFIES + Role.VERIFIES;\n",
+    "src/pkg/B.java": "z = Role.VERIFIES;\n",
+    "src/pkg/C.java": "nothing to see here\n",
+    "src/D.txt": "Role.VERIFIES\n",
+    "src/Empty.java": "",
+    "node_modules/dep/E.java": "Role.VERIFIES\n",
+    "Top.java": "Role.VERIFIES\n",
+}
+MODE = 0o750
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel, text in FILES.items():
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    os.chmod(str(tmp_path / "src/pkg/B.java"), MODE)
+    return tmp_path
+
+
+def _contents(top):
+    return {os.path.relpath(os.path.join(d, name), str(top)).replace(os.sep, "/"):
+            open(os.path.join(d, name)).read()
+            for d, _, names in os.walk(str(top)) for name in names}
+
+
+def test_rewrite_file_replaces_atomically(tree):
+    path = tree / "src/A.java"
+    inode = os.stat(str(path)).st_ino
+    assert rewrite_file(str(path), RULES) == 3
+    assert path.read_text() == FILES["src/A.java"].replace("Role.VERIFIES", "Role.IS_VERIFIED_BY")
+    # A new file was renamed over the old one, and no temporary file is left behind
+    assert os.stat(str(path)).st_ino != inode
+    assert sorted(os.listdir(str(tree / "src"))) == ["A.java", "D.txt", "Empty.java", "pkg"]
+
+
+def test_rewrite_file_keeps_the_mode(tree):
+    path = tree / "src/pkg/B.java"
+    assert rewrite_file(str(path), RULES) == 1
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == MODE
+
+
+def test_rules_apply_in_order(tmp_path):
+    path = tmp_path / "f.txt"
+    path.write_text("a b\nb\n")
+    assert rewrite_file(str(path), [("a", "b"), ("b", "c")]) == 4
+    assert path.read_text() == "c c\nc\n"
+
+
+def test_regex_rules(tree):
+    path = tree / "src/A.java"
+    assert rewrite_file(str(path), [(r"Role\.(\w+)", r"Roles.\1()")], regex=True) == 3
+    assert "x = Roles.VERIFIES();" in path.read_text()
+    assert "import Role;" in path.read_text()
+
+
+def test_dry_run_only_counts(tree):
+    path = tree / "src/A.java"
+    before = os.stat(str(path))
+    assert rewrite_file(str(path), RULES, dry_run=True) == 3
+    after = os.stat(str(path))
+    assert path.read_text() == FILES["src/A.java"]
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert sorted(os.listdir(str(tree / "src"))) == ["A.java", "D.txt", "Empty.java", "pkg"]
+
+
+def test_prescan_skips_files_without_a_match(tree, monkeypatch):
+    compiled = _compile_rules(RULES)
+    assert _has_match(str(tree / "src/A.java"), compiled)
+    assert not _has_match(str(tree / "src/pkg/C.java"), compiled)
+    assert not _has_match(str(tree / "src/Empty.java"), compiled)
+    assert _has_match(str(tree / "src/A.java"), _compile_rules([(r"VERIF\w+;$", "")], regex=True))
+
+    def no_temp_file(*args, **kwargs):
+        raise AssertionError("a file without a match was rewritten")
+
+    monkeypatch.setattr(tempfile, "mkstemp", no_temp_file)
+    path = tree / "src/pkg/C.java"
+    before = os.stat(str(path))
+    assert rewrite_file(str(path), RULES) == 0
+    assert rewrite_file(str(tree / "src/Empty.java"), RULES) == 0
+    assert os.stat(str(path)).st_mtime_ns == before.st_mtime_ns
+
+
+def test_failure_leaves_the_file_alone(tree, monkeypatch):
+    path = tree / "src/A.java"
+
+    def failing_rules(rules, regex=False):
+        def substitute(line):
+            if b"y =" in line:
+                raise RuntimeError("boom")
+            return line.replace(b"Role", b"X"), 1
+        return [(lambda buf: True, substitute)]
+
+    monkeypatch.setattr(utils, "_compile_rules", failing_rules)
+    with pytest.raises(RuntimeError):
+        rewrite_file(str(path), RULES)
+    assert path.read_text() == FILES["src/A.java"]
+    assert sorted(os.listdir(str(tree / "src"))) == ["A.java", "D.txt", "Empty.java", "pkg"]
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("**/*.java", {"src/A.java": 3, "src/pkg/B.java": 1, "Top.java": 1}),
+    ("*.java", {"src/A.java": 3, "src/pkg/B.java": 1, "Top.java": 1}),
+    ("src/*.java", {"src/A.java": 3}),
+    ("src/**/*.java", {"src/A.java": 3, "src/pkg/B.java": 1}),
+    ("**/*.txt", {"src/D.txt": 1}),
+    ("**/*.py", {}),
+])
+def test_glob_selection(tree, pattern, expected):
+    changed = rewrite(pattern, RULES, start=str(tree), dry_run=True, workers=2)
+    assert {os.path.relpath(p, str(tree)).replace(os.sep, "/"): n for p, n in changed.items()} == expected
+    assert _contents(tree) == FILES
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_rewrite_tree(tree, processes):
+    changed = rewrite("**/*.java", RULES, start=str(tree), workers=2, processes=processes)
+    assert {os.path.relpath(p, str(tree)).replace(os.sep, "/"): n for p, n in changed.items()} == \
+        {"src/A.java": 3, "src/pkg/B.java": 1, "Top.java": 1}
+    expected = dict(FILES)
+    for rel in ("src/A.java", "src/pkg/B.java", "Top.java"):
+        expected[rel] = FILES[rel].replace("Role.VERIFIES", "Role.IS_VERIFIED_BY")
+    assert _contents(tree) == expected
+    assert stat.S_IMODE(os.stat(str(tree / "src/pkg/B.java")).st_mode) == MODE
@@ -0,0 +1,274 @@
+import ast
+import importlib
+import textwrap
+import types
+
+import pytest
+
+from polarizer_py.metadata import MetaData, _make_test_steps
+from polarizer_py.static_scan import find_tests, function_varnames
+
+# Exercises every kind of binding _ScopeNames knows about
+SCOPES = textwrap.dedent('''
+    import os
+
+    COUNTER = 0
+
+
+    def plain(a, b=1, *args, c, d=2, **kwargs):
+        total = a + b
+        total += c
+        return total
+
+
+    def positional_only(a, b, /, c):
+        x, (y, *z) = a, (b, c)
+        return x
+
+
+    def comprehensions(items):
+        evens = [i for i in items if i % 2 == 0]
+        pairs = {k: v for k, v in zip(items, items)}
+        gen = (j for j in items)
+        nested = [[m * n for m in items] for n in items]
+        return evens, pairs, gen, nested
+
+
+    def handlers(path):
+        try:
+            with open(path) as fh, open(path) as (other):
+                data = fh.read()
+        except OSError as err:
+            data = str(err)
+        else:
+            extra = 1
+        finally:
+            done = True
+        for idx, (left, right) in enumerate([(1, 2)]):
+            del left
+        while (chunk := data[:1]):
+            data = data[1:]
+        return data
+
+
+    def declarations():
+        global COUNTER
+        COUNTER = 1
+        import os.path as osp
+        from os import sep, pathsep as ps
+        import json
+
+        def inner():
+            return captured
+        captured = 2
+
+        class Local:
+            attr = 1
+        return inner, Local, osp, sep, ps, json
+
+
+    def enclosing():
+        shared = 0
+        unused = 1
+
+        def bump(step):
+            nonlocal shared
+            shared += step
+            return shared
+
+        return bump
+
+
+    def matching(value):
+        match value:
+            case [first, *rest]:
+                return first, rest
+            case {"key": found, **others}:
+                return found, others
+            case Point(x=px) | Point(y=px):
+                return px
+            case str() as text:
+                return text
+        return None
+
+
+    async def coroutine(urls):
+        async with open(urls) as conn:
+            async for item in conn:
+                got = await item
+        return [u async for u in conn]
+
+
+    def lambdas(seq):
+        key = lambda item, default=None: item or default
+        return sorted(seq, key=key)
+
+
+    class Point:
+        x = y = 0
+
+
+    class Outer:
+        def method(self, arg):
+            local = arg
+            return local
+
+        class Inner:
+            def method(self, *, flag):
+                return [flag for _ in range(2)]
+''')
+
+
+def _code_objects(code: types.CodeType):
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield const
+            yield from _code_objects(const)
+
+
+def _function_nodes(tree: ast.AST):
+    return [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+
+
+def _pairs(source: str, filename: str):
+    """Every function in source, with the code object CPython compiles for it"""
+    tree = ast.parse(source)
+    codes = {(code.co_name, code.co_firstlineno): code
+             for code in _code_objects(compile(source, filename, "exec"))}
+    pairs = []
+    for node in _function_nodes(tree):
+        lineno = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+        pairs.append((node, codes[(node.name, lineno)]))
+    return pairs
+
+
+@pytest.mark.parametrize("name", sorted({node.name for node in _function_nodes(ast.parse(SCOPES))}))
+def test_varnames_match_the_compiler(name):
+    pairs = [(node, code) for node, code in _pairs(SCOPES, "<scopes>") if node.name == name]
+    assert pairs
+    for node, code in pairs:
+        assert function_varnames(node) == list(code.co_varnames), code.co_qualname
+
+
+@pytest.mark.parametrize("module", ["argparse", "ast", "json.decoder", "textwrap", "polarizer_py.metadata",
+                                    "polarizer_py.utils", "polarizer_py.static_scan"])
+def test_varnames_match_the_compiler_on_real_modules(module):
+    path = importlib.import_module(module).__file__
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    pairs = _pairs(source, path)
+    assert pairs
+    for node, code in pairs:
+        assert function_varnames(node) == list(code.co_varnames), code.co_qualname
+
+
+TESTS = textwrap.dedent('''
+    from polarizer_py import metadata as meta_module
+    from polarizer_py.metadata import MetaData
+    from polarizer_py.metadata import metadata as md
+    import polarizer_py.metadata as pm
+
+    DEFS = "defs/{name}.yaml"
+    CUSTOM = {"project": "RHEL6"}
+
+
+    @md(path=DEFS)
+    def test_alias(x, y=2):
+        total = [i for i in range(x)]
+        return total
+
+
+    @MetaData.metadata(definition=CUSTOM)
+    def test_classmethod(a):
+        try:
+            pass
+        except ValueError as err:
+            return err
+
+
+    @meta_module.metadata()
+    def test_module_attribute(value):
+        global DEFS
+        return value
+
+
+    class TestOuter:
+        @pm.metadata()
+        def test_method(self, arg):
+            with open(arg) as fh:
+                return fh
+
+        class TestInner:
+            @md()
+            def test_nested(self, *, flag):
+                return flag
+
+
+    def factory():
+        counter = 0
+
+        @md()
+        def test_local(step):
+            nonlocal counter
+            counter += step
+            return counter
+        return test_local
+
+
+    factory()
+
+
+    def helper(unrelated):
+        return unrelated
+''')
+
+
+@pytest.fixture
+def registered(monkeypatch):
+    """Runs the real @metadata decorators, recording what they would register"""
+    calls = {}
+
+    def _register(cls, qname, cfg, path=None, definition=None, description=None, test_steps=(), params=()):
+        calls[qname] = {"path": path, "definition": definition, "test_steps": test_steps, "params": params}
+
+    monkeypatch.setattr(MetaData, "cfg", {})
+    monkeypatch.setattr(MetaData, "_register", classmethod(_register))
+    return calls
+
+
+def test_find_tests_matches_an_import(tmp_path, monkeypatch, registered):
+    package = tmp_path / "scanpkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "test_module.py").write_text(TESTS)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.import_module("scanpkg.test_module")
+
+    tests, skipped = find_tests(TESTS, "scanpkg.test_module")
+    assert skipped == []
+    assert sorted(t.qname for t in tests) == sorted(registered)
+    assert "scanpkg.test_module.TestOuter.TestInner.test_nested" in registered
+    assert "scanpkg.test_module.factory.<locals>.test_local" in registered
+    for test in tests:
+        real = registered[test.qname]
+        assert test.varnames == list(real["params"]), test.qname
+        assert _make_test_steps(test.args) == real["test_steps"], test.qname
+        assert test.path == real["path"]
+        assert test.definition == real["definition"]
+
+
+def test_non_literal_arguments_are_skipped():
+    source = textwrap.dedent('''
+        from polarizer_py.metadata import metadata
+
+        @metadata(path=compute())
+        def test_dynamic():
+            pass
+
+        @metadata()
+        def test_static():
+            pass
+    ''')
+    tests, skipped = find_tests(source, "pkg.mod", "mod.py")
+    assert [t.qname for t in tests] == ["pkg.mod.test_static"]
+    assert len(skipped) == 1 and "test_dynamic" in skipped[0]
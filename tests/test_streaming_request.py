@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from polarizer_py.mock_umb import decode_payload
+from polarizer_py.ws_helper import CODECS, StreamingRequest, make_umb_request
+
+CONTENTS = {
+    "xunit": '<testsuite name="a&b">\n  <testcase name="t\\1" msg="say \\"hi\\""/>\n</testsuite>\n' * 50,
+    "xargs": json.dumps({"project": "RHEL6", "naïve": "☃ \t tab", "nested": {"a": [1, 2]}}),
+    "empty": "",
+}
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for key, text in CONTENTS.items():
+        path = tmp_path / key
+        path.write_text(text, encoding="utf-8")
+        paths.append((key, str(path)))
+    return paths
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_fragments_join_to_json_dumps(files, chunk_size):
+    req = StreamingRequest("xunit-import-ws", files, ack=True, chunk_size=chunk_size)
+    in_memory = make_umb_request("xunit-import-ws", tag=req["tag"], ack=True, data=json.dumps(CONTENTS))
+    assert "".join(req.fragments()) == json.dumps(in_memory)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compressed_fragments_decode_to_the_files(files, codec):
+    req = StreamingRequest("xunit-import-ws", files, chunk_size=16, compression=codec)
+    sent = json.loads("".join(req.fragments()))
+    assert sent["type"] == "{}+base64".format(codec)
+    data = json.loads(sent["data"])
+    assert {key: decode_payload(sent["type"], value) for key, value in data.items()} == CONTENTS
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from polarizer_py import metadata
+from polarizer_py.metadata import MetaData, _make_test_steps
+
+QNAME = "pkg.mod.test_synced"
+STEPS = _make_test_steps(["x", "y"])
+STATE = ("cfg", "mapping", "definitions", "manifest", "write_behind", "import_list", "journal", "manifest_dirty")
+
+
+def _definition(tc_id="RHEL6-1", update=False, **fields):
+    return {"project": "RHEL6", "id": tc_id, "update": update, "custom-fields": dict(fields)}
+
+
+class Run:
+    """One run of the tests: MetaData state loaded from the files in a directory, as a fresh process would"""
+    def __init__(self, tmp_path, monkeypatch):
+        self.tmp_path = tmp_path
+        self.mapping_path = tmp_path / "mapping.json"
+        self.manifest_path = tmp_path / "manifest.json"
+        self.mapping_path.write_text("{}")
+        self.processed = []
+        self.written = []
+        # Not monkeypatch.setattr, which would look the lazy attributes up (and load them) to save them
+        self.saved = {name: MetaData.__dict__[name] for name in STATE}
+
+        get_metadata = MetaData._get_metadata.__func__
+        write_mapping = metadata.write_mapping
+
+        def recording_get_metadata(cls, kwargs, name):
+            self.processed.append(name)
+            return get_metadata(cls, kwargs, name)
+
+        def recording_write_mapping(path, mapping):
+            self.written.append(path)
+            write_mapping(path, mapping)
+
+        monkeypatch.setattr(MetaData, "_get_metadata", classmethod(recording_get_metadata))
+        monkeypatch.setattr(metadata, "write_mapping", recording_write_mapping)
+
+    def start(self):
+        cfg = {"mapping": str(self.mapping_path), "sync-manifest": str(self.manifest_path)}
+        manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        values = [cfg, json.loads(self.mapping_path.read_text()), {}, manifest, True, {}, [], False]
+        for name, value in zip(STATE, values):
+            setattr(MetaData, name, value)
+        self.processed.clear()
+        self.written.clear()
+
+    def restore(self):
+        for name, value in self.saved.items():
+            setattr(MetaData, name, value)
+
+    def register(self, qname=QNAME, description="A test", params=("x", "y"), **definition):
+        MetaData._register(qname, MetaData.cfg, definition=_definition(**definition), description=description,
+                           test_steps=STEPS, params=params)
+
+    def manifest(self):
+        return json.loads(self.manifest_path.read_text())
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    r = Run(tmp_path, monkeypatch)
+    try:
+        r.start()
+        r.register()
+        MetaData.flush()
+        assert r.processed == [QNAME]
+        assert r.manifest()[QNAME]["ids"] == {"RHEL6": "RHEL6-1"}
+        r.start()
+        yield r
+    finally:
+        r.restore()
+
+
+def test_unchanged_synced_test_is_skipped(run):
+    run.register()
+    MetaData.flush()
+    assert run.processed == []
+    assert run.written == []
+    assert not MetaData.manifest_dirty
+
+
+def test_changed_definition_is_processed_again(run):
+    hashed = run.manifest()[QNAME]["hash"]
+    run.register(caseimportance="high")
+    MetaData.flush()
+    assert run.processed == [QNAME]
+    assert run.written == [str(run.manifest_path)]
+    assert run.manifest()[QNAME]["hash"] != hashed
+
+
+@pytest.mark.parametrize("change", [{"description": "Another test"}, {"params": ("x", "y", "z")}])
+def test_changed_function_is_processed_again(run, change):
+    run.register(**change)
+    assert run.processed == [QNAME]
+
+
+def test_test_missing_from_the_mapping_is_processed_again(run):
+    run.mapping_path.write_text("{}")
+    run.start()
+    run.register()
+    MetaData.flush()
+    assert run.processed == [QNAME]
+    assert json.loads(run.mapping_path.read_text())[QNAME]["RHEL6"]["id"] == "RHEL6-1"
+    # Same fingerprint and ids as before, but the manifest entry was rewritten with them
+    assert run.written == [str(run.mapping_path), str(run.manifest_path)]
+
+
+def test_changed_mapping_id_is_processed_again(run):
+    run.mapping_path.write_text(json.dumps({QNAME: {"RHEL6": {"id": "RHEL6-2", "params": ["x", "y"]}}}))
+    run.start()
+    run.register()
+    assert run.processed == [QNAME]
+
+
+def test_unsynced_test_is_not_recorded(run):
+    run.register(qname="pkg.mod.test_new", tc_id="")
+    MetaData.flush()
+    assert run.processed == ["pkg.mod.test_new"]
+    # It needs importing, so it isn't in the manifest, which therefore wasn't rewritten
+    assert MetaData.import_list["RHEL6"][0]["name"] == "pkg.mod.test_new"
+    assert run.written == [str(run.mapping_path)]
+    assert "pkg.mod.test_new" not in run.manifest()
+
+
+def test_test_that_becomes_unsynced_is_dropped(run):
+    run.register(update=True)
+    MetaData.flush()
+    assert run.processed == [QNAME]
+    assert run.written == [str(run.manifest_path)]
+    assert QNAME not in run.manifest()
+
+
+def test_fingerprint_depends_on_the_default_definitions(run):
+    args = (QNAME, None, None, "A test", STEPS, ["x", "y"])
+    before = MetaData._fingerprint(*args)
+    assert MetaData._fingerprint(*args) == before
+    MetaData.definitions[QNAME] = {"RHEL6": _definition()}
+    assert MetaData._fingerprint(*args) != before
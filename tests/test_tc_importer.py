@@ -0,0 +1,105 @@
+import json
+import socket
+
+import pytest
+import requests
+
+from polarizer_py import tc_importer
+from polarizer_py.mock_mapper import MockMapper
+from polarizer_py.tc_importer import ImporterClient, ImportJob, merge_mappings
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {"tcargs": tmp_path / "tcargs.json", "mapping": tmp_path / "mapping.json", "jar": tmp_path / "x.jar"}
+    paths["tcargs"].write_text(json.dumps({"project": "RHEL6"}))
+    paths["mapping"].write_text(json.dumps({"a.test": {"RHEL6": {"id": "", "params": []}}}))
+    paths["jar"].write_bytes(b"\0" * 100000)
+    return ImportJob(str(paths["tcargs"]), str(paths["jar"]), str(paths["mapping"]))
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Every file opened by tc_importer"""
+    handles = []
+
+    def tracking_open(*args, **kwargs):
+        f = open(*args, **kwargs)
+        handles.append(f)
+        return f
+
+    monkeypatch.setattr(tc_importer, "open", tracking_open, raising=False)
+    return handles
+
+
+def _mapper(**kwargs) -> MockMapper:
+    server = MockMapper(("127.0.0.1", 0), **kwargs)
+    server.start()
+    return server
+
+
+def test_retries_503(files, opened):
+    server = _mapper(fail_first=2)
+    try:
+        with ImporterClient(url=server.url, retries=3, backoff=0) as client:
+            resp = client.import_testcases(files["tcargs"], files["jar"], files["mapping"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert resp.status_code == 200
+    assert resp.json()["mapping"]["a.test"]["RHEL6"]["id"] == "RHEL6-1"
+    assert server.requests == 3
+    assert server.jar_bytes == 100000
+    # Every attempt reopened the three files, and closed them
+    assert len(opened) == 9
+    assert all(f.closed for f in opened)
+
+
+def test_gives_up_after_retries(files, opened):
+    server = _mapper(fail_first=10)
+    try:
+        with ImporterClient(url=server.url, retries=1, backoff=0) as client:
+            resp = client.import_testcases(files["tcargs"], files["jar"], files["mapping"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert resp.status_code == 503
+    assert server.requests == 2
+    assert all(f.closed for f in opened)
+
+
+def test_connection_errors_close_files(files, opened):
+    # A port nothing listens on
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    with ImporterClient(url="http://127.0.0.1:{}/testcase/mapper".format(port), retries=1, backoff=0) as client:
+        with pytest.raises(requests.ConnectionError):
+            client.import_testcases(files["tcargs"], files["jar"], files["mapping"])
+    assert len(opened) == 6
+    assert all(f.closed for f in opened)
+
+
+def test_import_many_keeps_job_order(files):
+    server = _mapper(delay=0.01)
+    try:
+        with ImporterClient(url=server.url, backoff=0) as client:
+            responses = client.import_many([files] * 4 + [(files["tcargs"], files["jar"], files["mapping"])],
+                                           max_workers=3)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [r.status_code for r in responses] == [200] * 5
+    ids = set(r.json()["mapping"]["a.test"]["RHEL6"]["id"] for r in responses)
+    assert len(ids) == 5
+
+
+def test_merge_mappings_prefers_entries_with_ids():
+    rhel6 = {"t": {"RHEL6": {"id": "RHEL6-1"}, "RHEL7": {"id": ""}}}
+    rhel7 = {"t": {"RHEL6": {"id": ""}, "RHEL7": {"id": "RHEL7-2"}}}
+    assert merge_mappings([rhel6, rhel7]) == {"t": {"RHEL6": {"id": "RHEL6-1"}, "RHEL7": {"id": "RHEL7-2"}}}
@@ -0,0 +1,174 @@
+import os
+import time
+
+import pytest
+
+from polarizer_py.utils import DEFAULT_EXCLUDES, DirManifest, Excludes, find_all_py_files, walk
+
+TREE = [
+    "setup.py",
+    "pkg/__init__.py",
+    "pkg/mod.py",
+    "pkg/mod.pyc",
+    "pkg/__pycache__/mod.cpython-311.pyc",
+    "pkg/sub/venv/lib/site.py",
+    "pkg/sub/node_modules/dep/index.py",
+    "pkg/sub/real.py",
+    "venv/lib/python3/site.py",
+    ".venv/lib/site.py",
+    ".git/hooks/pre-commit.py",
+    ".tox/py311/lib/x.py",
+    "node_modules/dep/setup.py",
+    "build/lib/pkg/mod.py",
+    "docs/conf.py",
+    "docs/api/docs/index.py",
+    "notes/venv",
+]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel in TREE:
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    return tmp_path
+
+
+def _rels(top, paths):
+    return sorted(os.path.relpath(str(p), str(top)).replace(os.sep, "/") for p in paths)
+
+
+@pytest.mark.parametrize("patterns, rel, is_dir, excluded", [
+    (["venv"], "venv", True, True),
+    (["venv"], "a/b/venv", True, True),
+    (["venv"], "a/b/venv", False, True),
+    (["venv/"], "a/b/venv", True, True),
+    (["venv/"], "a/b/venv", False, False),
+    (["*.pyc"], "pkg/mod.pyc", False, True),
+    (["*.pyc"], "pkg/mod.py", False, False),
+    (["/docs"], "docs", True, True),
+    (["/docs"], "api/docs", True, False),
+    (["build/lib"], "build/lib", True, True),
+    (["build/lib"], "src/build/lib", True, False),
+    (["docs/*.py"], "docs/conf.py", False, True),
+    (["docs/*.py"], "docs/api/conf.py", False, False),
+    (["docs/**/*.py"], "docs/conf.py", False, True),
+    (["docs/**/*.py"], "docs/api/deep/conf.py", False, True),
+    (["**/gen"], "a/b/gen", True, True),
+    (["mod?.py"], "mod1.py", False, True),
+    (["mod[!0-9].py"], "mod1.py", False, False),
+    (["mod[!0-9].py"], "modx.py", False, True),
+    (["*.py", "!keep.py"], "keep.py", False, False),
+    (["*.py", "!keep.py"], "drop.py", False, True),
+    (["*.py", "!keep.py", "keep.py"], "keep.py", False, True),
+    (["!keep.py"], "keep.py", False, False),
+])
+def test_excludes_match(patterns, rel, is_dir, excluded):
+    assert Excludes(patterns).match(rel, rel.rsplit("/", 1)[-1], is_dir) is excluded
+
+
+def test_default_excludes_prune_at_every_depth(tree):
+    assert _rels(tree, find_all_py_files(str(tree))) == [
+        "build/lib/pkg/mod.py",
+        "docs/api/docs/index.py",
+        "docs/conf.py",
+        "pkg/__init__.py",
+        "pkg/mod.py",
+        "pkg/sub/real.py",
+        "setup.py",
+    ]
+
+
+def test_excluded_directories_are_not_descended(tree, monkeypatch):
+    listed = []
+    manifest = DirManifest()
+    listing = manifest.listing
+
+    def recording(dirpath):
+        listed.append(os.path.relpath(dirpath, str(tree)).replace(os.sep, "/"))
+        return listing(dirpath)
+
+    monkeypatch.setattr(manifest, "listing", recording)
+    list(walk(str(tree), excludes=DEFAULT_EXCLUDES, manifest=manifest))
+    for pruned in ("venv", ".venv", ".git", ".tox", "node_modules", "pkg/__pycache__", "pkg/sub/venv",
+                   "pkg/sub/node_modules"):
+        assert not any(d == pruned or d.startswith(pruned + "/") for d in listed), pruned
+
+
+def test_dir_only_pattern_keeps_files_of_that_name(tree):
+    rels = _rels(tree, walk(str(tree), excludes=["venv/"]))
+    assert "notes/venv" in rels
+    assert not any(r.startswith("venv/") or "/venv/" in r for r in rels)
+
+
+def test_anchored_patterns_and_reincludes(tree):
+    excludes = DEFAULT_EXCLUDES + ("/docs", "build/", "*.py", "!__init__.py", "!pkg/sub/*.py")
+    assert _rels(tree, walk(str(tree), excludes=excludes)) == [
+        "notes/venv",
+        "pkg/__init__.py",
+        "pkg/mod.pyc",
+        "pkg/sub/real.py",
+    ]
+    rels = _rels(tree, walk(str(tree), excludes=["/docs/api"]))
+    assert "docs/conf.py" in rels and "docs/api/docs/index.py" not in rels
+
+
+def test_get_dirs_and_workers(tree):
+    sequential = _rels(tree, walk(str(tree), excludes=DEFAULT_EXCLUDES, get_dirs=True))
+    threaded = _rels(tree, walk(str(tree), excludes=DEFAULT_EXCLUDES, get_dirs=True, workers=4))
+    assert sequential == threaded
+    assert "pkg/sub" in sequential and "pkg/sub/venv" not in sequential
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(str(path), (then, then))
+
+
+def test_manifest_hits_until_the_mtime_changes(tree):
+    pkg = tree / "pkg"
+    _age(pkg, 60)
+    manifest = DirManifest()
+    first = manifest.listing(str(pkg))
+    assert (manifest.hits, manifest.misses) == (0, 1)
+    assert manifest.listing(str(pkg)) == first
+    assert (manifest.hits, manifest.misses) == (1, 1)
+
+    (pkg / "new.py").write_text("")
+    files, _ = manifest.listing(str(pkg))
+    assert "new.py" in files
+    assert (manifest.hits, manifest.misses) == (1, 2)
+    # Modified within MIN_AGE, so not cached yet
+    assert str(pkg) not in manifest.dirs
+    manifest.listing(str(pkg))
+    assert (manifest.hits, manifest.misses) == (1, 3)
+
+    _age(pkg, 30)
+    manifest.listing(str(pkg))
+    files, _ = manifest.listing(str(pkg))
+    assert "new.py" in files
+    assert (manifest.hits, manifest.misses) == (2, 4)
+
+
+def test_manifest_is_persisted(tree, tmp_path_factory):
+    for dirpath, dirnames, _ in os.walk(str(tree)):
+        for name in dirnames:
+            _age(os.path.join(dirpath, name), 60)
+    _age(tree, 60)
+    path = str(tmp_path_factory.mktemp("manifest") / "manifest.json")
+
+    manifest = DirManifest(path)
+    expected = _rels(tree, walk(str(tree), excludes=DEFAULT_EXCLUDES, manifest=manifest))
+    assert manifest.hits == 0 and manifest.misses > 0
+    manifest.save()
+
+    reloaded = DirManifest(path)
+    assert _rels(tree, walk(str(tree), excludes=DEFAULT_EXCLUDES, manifest=reloaded)) == expected
+    assert (reloaded.hits, reloaded.misses) == (manifest.misses, 0)
+
+
+def test_unreadable_manifest_starts_empty(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json")
+    assert DirManifest(str(path)).dirs == {}
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from polarizer_py.mock_umb import MockUMB
+from polarizer_py.ws_client import UMBClient
+from polarizer_py.ws_helper import make_umb_request
+
+
+def _port(server) -> int:
+    return list(server.sockets)[0].getsockname()[1]
+
+
+async def _serve(handler):
+    server = await websockets.serve(handler, "127.0.0.1", 0)
+    return server, _port(server)
+
+
+def test_replies_are_routed_by_tag():
+    async def main():
+        # The jitter makes the replies arrive in a different order than the requests were sent
+        server = await MockUMB(delay=0.01, jitter=0.05, progress=2, seed=7).start("127.0.0.1", 0)
+        progress = {}
+
+        def on_message_for(tag):
+            async def on_message(msg):
+                assert msg["tag"] == tag
+                progress[tag] = progress.get(tag, 0) + 1
+            return on_message
+
+        try:
+            async with UMBClient(max_in_flight=20) as client:
+                reqs = [make_umb_request("testing", data="payload-{}".format(i)) for i in range(20)]
+                replies = await asyncio.gather(*(client.request(req, host="127.0.0.1", url="/ws", port=_port(server),
+                                                                on_message=on_message_for(req["tag"]))
+                                                 for req in reqs))
+                assert len(client._connections) == 1
+        finally:
+            server.close()
+            await server.wait_closed()
+
+        for req, reply in zip(reqs, replies):
+            assert reply["tag"] == req["tag"]
+            assert reply["info"]["data"] == req["data"]
+            assert progress[req["tag"]] == 2
+
+    asyncio.run(main())
+
+
+def test_in_flight_limit():
+    state = {"in_flight": 0, "max": 0}
+
+    async def handler(websocket, path=None):
+        async def respond(message):
+            req = json.loads(message)
+            state["in_flight"] += 1
+            state["max"] = max(state["max"], state["in_flight"])
+            await asyncio.sleep(0.02)
+            state["in_flight"] -= 1
+            await websocket.send(json.dumps({"tag": req["tag"], "info": {"status": "passed"}}))
+
+        tasks = [asyncio.ensure_future(respond(message)) async for message in websocket]
+        await asyncio.gather(*tasks)
+
+    async def main():
+        server, port = await _serve(handler)
+        try:
+            async with UMBClient(max_in_flight=3) as client:
+                replies = await asyncio.gather(*(client.request(make_umb_request("testing"), host="127.0.0.1",
+                                                                url="/ws", port=port) for _ in range(12)))
+        finally:
+            server.close()
+            await server.wait_closed()
+        assert all(r["info"]["status"] == "passed" for r in replies)
+
+    asyncio.run(main())
+    assert state["max"] == 3
+
+
+def test_pending_requests_fail_when_the_connection_closes():
+    async def handler(websocket, path=None):
+        # Wait for both requests, then hang up without replying
+        await websocket.recv()
+        await websocket.recv()
+        await websocket.close()
+
+    async def main():
+        server, port = await _serve(handler)
+        try:
+            async with UMBClient() as client:
+                results = await asyncio.wait_for(
+                    asyncio.gather(*(client.request(make_umb_request("testing"), host="127.0.0.1", url="/ws",
+                                                    port=port, timeout=30) for _ in range(2)),
+                                   return_exceptions=True), 5)
+        finally:
+            server.close()
+            await server.wait_closed()
+        return results
+
+    results = asyncio.run(main())
+    assert len(results) == 2
+    for result in results:
+        assert isinstance(result, (ConnectionError, websockets.ConnectionClosed))
+
+
+def test_duplicate_tag_is_rejected():
+    async def handler(websocket, path=None):
+        async for message in websocket:
+            await asyncio.sleep(0.05)
+            await websocket.send(json.dumps({"tag": json.loads(message)["tag"], "info": {"status": "passed"}}))
+
+    async def main():
+        server, port = await _serve(handler)
+        try:
+            async with UMBClient() as client:
+                req = make_umb_request("testing", tag="same")
+                return await asyncio.gather(client.request(req, host="127.0.0.1", url="/ws", port=port),
+                                            client.request(req, host="127.0.0.1", url="/ws", port=port),
+                                            return_exceptions=True)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    first, second = asyncio.run(main())
+    assert first["info"]["status"] == "passed"
+    with pytest.raises(ValueError):
+        raise second
+
+
+def test_replies_over_1mib():
+    big = "x" * (3 << 19)
+
+    async def main():
+        server = await MockUMB(delay=0, progress=0).start("127.0.0.1", 0)
+        try:
+            async with UMBClient() as client:
+                return await client.request(make_umb_request("testing", data=big), host="127.0.0.1", url="/ws",
+                                            port=_port(server))
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    reply = asyncio.run(main())
+    assert reply["info"]["data"] == big